@@ -1,21 +1,94 @@
-from flask import Flask, redirect, request, make_response, render_template
+from flask import Flask, abort, jsonify, redirect, request, make_response, render_template, render_template_string
 
 from src.strava.client import create_strava_client
-from src.strava.helpers import download_all_activities
-from src.summits.visited import calculate_summit_history
-from src.visualisation.map import plot_activities
-from src.visualisation.bar_chart import compute_compleation_report
-from src.summits.summits import PersistentLocalFileSummitReference
-import time
+from src.strava.helpers import LocalFileActivityCache
+from src.visualisation.heatmap import EMPTY_TILE, LocalFileTileCache
+from src.summits.summits import MemoryMappedSummitReference
+from src.summits.compact import CompactSummitReference
+from src.summits.spatial_index import SummitIndex
+from src.summits.parallel import ParallelSummitSearch
+from src.summits.store import LocalFileVisitStore
+from src.jobs import FAILED, LocalFileResultStore, ReportJobQueue
+from src.cache import ReportCache
+from src.instrumentation import configure_logging, metrics, profile_if_slow, span
+from src.report import SummitReportGenerator
+import atexit
+import hmac
+import logging
+import os
 
 import uuid
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
 client = create_strava_client()
 
 database = {}
 
+activity_cache = LocalFileActivityCache('./activity_cache')
+visit_store = LocalFileVisitStore('./visit_store')
+report_cache = ReportCache(directory='./report_cache')
+tile_cache = LocalFileTileCache('./tile_cache')
+
+# Athletes with more activities than this are shown a server-rendered heatmap of their routes, rather than the routes
+# themselves.
+HEATMAP_ACTIVITY_THRESHOLD = 2000
+
+# Set SUMMITMAP_PROFILE_DIR to write a cProfile dump of every report that takes longer than
+# SUMMITMAP_PROFILE_THRESHOLD seconds to generate.
+PROFILE_DIRECTORY = os.environ.get('SUMMITMAP_PROFILE_DIR')
+PROFILE_THRESHOLD_SECONDS = float(os.environ.get('SUMMITMAP_PROFILE_THRESHOLD', 30))
+
+# /metrics exposes internal timings and counters, so is only served to requests from this host, or, if
+# SUMMITMAP_METRICS_TOKEN is set, to requests with an "Authorization: Bearer <token>" header.
+METRICS_TOKEN = os.environ.get('SUMMITMAP_METRICS_TOKEN')
+LOOPBACK_ADDRESSES = {'127.0.0.1', '::1'}
+
+# Loaded once per process. The reference columns are memory-mapped, so workers forked by a pre-loading server share
+# the same physical pages. Create ./database with scripts/convert_summit_reference.py.
+summit_reference_datasource = MemoryMappedSummitReference('./database')
+summit_index = SummitIndex(summit_reference_datasource)
+# Reports are built from a compact in-memory copy of the reference, while summit detection uses the full precision
+# coordinates.
+report_reference = CompactSummitReference(summit_reference_datasource)
+
+# Set SUMMITMAP_DETECTION_WORKERS above 1 to search for summit visits on a pool of worker processes. The pool is off
+# by default, as it is slower than searching in the request thread unless every worker has a spare core: measure with
+# benchmarks/parallel_detection.py on the target machine first. The pool is started here, before any threads.
+DETECTION_WORKERS = int(os.environ.get('SUMMITMAP_DETECTION_WORKERS', 1))
+summit_search = None
+if DETECTION_WORKERS > 1:
+    summit_search = ParallelSummitSearch(summit_reference_datasource, workers=DETECTION_WORKERS)
+    atexit.register(summit_search.close)
+
+# Set SUMMITMAP_NEAR_DUPLICATE_DISTANCE to a distance in metres to search repeated routes recorded with slightly
+# different GPS traces once, e.g. a daily commute. This is approximate, see RouteDeduplicator, so is off by default.
+NEAR_DUPLICATE_DISTANCE = None
+if os.environ.get('SUMMITMAP_NEAR_DUPLICATE_DISTANCE'):
+    NEAR_DUPLICATE_DISTANCE = float(os.environ['SUMMITMAP_NEAR_DUPLICATE_DISTANCE'])
+
+report_generator = SummitReportGenerator(client=client,
+                                         reference_source=report_reference,
+                                         summit_index=summit_index,
+                                         visit_store=visit_store,
+                                         activity_cache=activity_cache,
+                                         report_cache=report_cache,
+                                         render_template=render_template,
+                                         tile_cache=tile_cache,
+                                         heatmap_activity_threshold=HEATMAP_ACTIVITY_THRESHOLD,
+                                         summit_search=summit_search,
+                                         near_duplicate_distance=NEAR_DUPLICATE_DISTANCE)
+
+# Shown while a report is being generated. Refreshes until the finished report is served at the same URL.
+PENDING_PAGE = '''<!DOCTYPE html>
+<html>
+<head><meta http-equiv="refresh" content="3"><title>SummitMap</title></head>
+<body><p>Generating your summit map ({{ status }})...</p></body>
+</html>'''
+
 
 @app.route("/")
 def summit_map():
@@ -26,10 +99,11 @@ def summit_map():
     athlete_id = database.pop(one_time_token, None)
 
     if athlete_id is not None:
-        print(f'Generating map for athlete {athlete_id}')
-        # If an athlete ID has been resolved, the user has authenticated. Generate the map.
-        summit_report_page = generate_summit_report(athlete_id)
-        response = make_response(summit_report_page)
+        logger.info('generating map', extra={'fields': {'athlete_id': athlete_id}})
+        # If an athlete ID has been resolved, the user has authenticated. Queue the map generation and send the user
+        # to the report page, which waits for the job to finish.
+        job = report_jobs.submit(athlete_id)
+        response = redirect(f'/report/{job.id}')
         response.set_cookie('ott', '', expires=0)  # Prompt users browser to delete the token
         return response
 
@@ -46,37 +120,77 @@ def summit_map():
         # Strava has provided an auth code -store it, and store the user ID alongside a one-time-token.
         # Return the token to the user as a cookie, allow the user to request map generation.
         athlete_id = client.authorisation.post_athlete_auth_code(authorisation_code)
-        print(f'athlete {athlete_id} authenticated')
+        logger.info('athlete authenticated', extra={'fields': {'athlete_id': athlete_id}})
         one_time_token = str(uuid.uuid4().int)
         database.update({one_time_token: athlete_id})
-        print(database)
         response = make_response(render_template('login.html'))
         response.set_cookie(key='ott', value=one_time_token)
         return response
 
 
-def generate_summit_report(athlete_id: int):
-    start = time.time()
-    all_activities = download_all_activities(client=client,
-                                             athlete_id=athlete_id)
-    athlete_data = client.get_athlete_info(athlete_id)
-    athlete_name = f"{athlete_data['firstname']} {athlete_data['lastname']}"
-    print(f'Download time: {time.time() - start}')
-    summit_reference_datasource = PersistentLocalFileSummitReference('./database.pkl')
-    start = time.time()
-    dataset = calculate_summit_history(activities=all_activities, reference_source=summit_reference_datasource)
-    print(f'Calc time: {time.time() - start}')
-    visited_summits = dataset.loc[dataset['latest_visit'].notnull()]
-    unvisited_summits = dataset.loc[dataset['latest_visit'].isnull()]
-
-    map = plot_activities(activities=all_activities,
-                          visited_summits=visited_summits,
-                          unvisited_summits=unvisited_summits)
-    report = compute_compleation_report(dataset)
-    return render_template('/display.html',
-                           athlete=athlete_name,
-                           map=map._repr_html_(),
-                           report_df=report.iloc[::-1])
+@app.route("/status/<job_id>")
+def report_status(job_id: str):
+    job = report_jobs.status(job_id)
+    if job is None:
+        abort(404)
+    # The cause of a failure is logged when the job fails, and not shown to clients.
+    return jsonify(status=job.status, error='Map generation failed' if job.status == FAILED else None)
+
+
+@app.route("/report/<job_id>")
+def report(job_id: str):
+    job = report_jobs.status(job_id)
+    if job is None:
+        abort(404)
+    if job.status == FAILED:
+        return make_response('Map generation failed, please try again.', 500)
+    if not job.finished:
+        return render_template_string(PENDING_PAGE, status=job.status)
+    page = report_jobs.result(job_id)
+    if page is None:
+        # The job expired since its status was read.
+        abort(404)
+    return page
+
+
+@app.route("/metrics")
+def report_metrics():
+    if not metrics_access_allowed():
+        abort(404)
+    return jsonify(metrics.snapshot())
+
+
+def metrics_access_allowed() -> bool:
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+    # Requests forwarded by a reverse proxy on the same host arrive from the loopback address, but carry the client's
+    # address in X-Forwarded-For.
+    return request.remote_addr in LOOPBACK_ADDRESSES and 'X-Forwarded-For' not in request.headers
+
+
+@app.route("/tiles/<layer>/<int:zoom>/<int:x>/<int:y>.png")
+def heatmap_tile(layer: str, zoom: int, x: int, y: int):
+    tile = tile_cache.get(layer, zoom, x, y)
+    response = make_response(EMPTY_TILE if tile is None else tile)
+    response.headers['Content-Type'] = 'image/png'
+    # Layer names are unguessable and never reused, so a tile never changes, but it must not be stored by shared caches.
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
+def generate_summit_report(athlete_id: int) -> str:
+    return report_generator.generate(athlete_id)
+
+
+def run_summit_report_job(athlete_id: int) -> str:
+    # Jobs run outside of a request, so templates need an application context to render.
+    with app.app_context(), profile_if_slow(f'report-{athlete_id}', PROFILE_DIRECTORY, PROFILE_THRESHOLD_SECONDS), \
+            span('report', athlete_id=athlete_id):
+        return generate_summit_report(athlete_id)
+
+
+report_jobs = ReportJobQueue(generate_report=run_summit_report_job,
+                             result_store=LocalFileResultStore('./reports'))
 
 
 if __name__ == '__main__':
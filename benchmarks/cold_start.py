@@ -0,0 +1,64 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import generate_summit_reference
+from src.summits.summits import write_columnar_reference
+
+# Each loader runs in a fresh interpreter, so nothing is shared with the parent process except the OS page cache.
+LOADERS = {
+    'read_pickle': '''
+import pandas as pd
+df = pd.read_pickle(PICKLE)
+df = df.loc[(df['Latitude'] >= 56.5) & (df['Latitude'] <= 56.7) &
+            (df['Longitude'] >= -5.1) & (df['Longitude'] <= -4.9)]
+''',
+    'memory-mapped': '''
+from src.summits.summits import MemoryMappedSummitReference
+reference = MemoryMappedSummitReference(DIRECTORY)
+df = reference.load(latitude_window=(56.5, 56.7), longitude_window=(-5.1, -4.9))
+''',
+}
+
+# Resident memory is read from /proc rather than getrusage, as ru_maxrss is inherited from the parent process.
+TIMER = '''
+import time
+import pandas, numpy
+start = time.perf_counter()
+{loader}
+elapsed = time.perf_counter() - start
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS'))
+print(elapsed, rss)
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare cold start time of pd.read_pickle against opening a '
+                                                 'memory-mapped summit reference, each followed by a window query.')
+    parser.add_argument('--summits', type=int, default=20000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, 'database.pkl')
+        columnar_path = os.path.join(directory, 'database')
+        df = generate_summit_reference(args.summits)
+        df.to_pickle(pickle_path)
+        write_columnar_reference(df, columnar_path)
+
+        for name, loader in LOADERS.items():
+            source = f'PICKLE = {pickle_path!r}\nDIRECTORY = {columnar_path!r}\n' + TIMER.format(loader=loader)
+            timings = []
+            for _ in range(args.repeats):
+                output = subprocess.run([sys.executable, '-c', source], capture_output=True, text=True, check=True)
+                timings.append([float(value) for value in output.stdout.split()])
+            best_time = min(elapsed for elapsed, _ in timings)
+            rss = max(rss for _, rss in timings)
+            print(f'{name:>14}: {1000 * best_time:8.2f} ms, resident memory {rss / 1024:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_summit_reference
+from src.summits.compact import CompactSummitReference
+from src.summits.spatial_index import SummitIndex
+from src.summits.summits import MemoryMappedSummitReference, write_columnar_reference
+from src.visualisation.bar_chart import summarise_completion
+from src.visualisation.map import plot_activities
+
+
+def best_time(function, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def with_visits(summits: pd.DataFrame, visited: np.array) -> pd.DataFrame:
+    summits = summits.copy()
+    summits['latest_visit'] = pd.Series(pd.Timestamp('2020-01-01'), index=summits.index).where(visited)
+    return summits
+
+
+def private_bytes(arrays) -> int:
+    """
+    Count the bytes of the arrays which are held in process memory, rather than memory-mapped from a file.
+    """
+    return sum(array.nbytes for array in arrays if not isinstance(array.base, np.memmap)
+               and not isinstance(array, np.memmap))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the per-process memory and report latency of building '
+                                                 'reports from the full summit reference against the compact '
+                                                 'reference, as the app does.')
+    parser.add_argument('--summits', type=int, default=20000)
+    parser.add_argument('--visited-fraction', type=float, default=0.3)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        df = generate_summit_reference(args.summits)
+        # Summit names repeat in the real reference, e.g. there are many summits named Beinn Bhreac.
+        df['Name'] = [f'Summit {number % max(args.summits // 4, 1)}' for number in df['Number']]
+        write_columnar_reference(df, directory)
+        # As in app.py: summit detection uses an index over the memory-mapped columns, and reports the compact copy.
+        reference = MemoryMappedSummitReference(directory)
+        summit_index = SummitIndex(reference)
+        compact_reference = CompactSummitReference(reference)
+
+        visited = np.random.default_rng(0).random(args.summits) < args.visited_fraction
+        summits = with_visits(reference.load(), visited)
+        compact_summits = with_visits(compact_reference.load(), visited)
+
+        full_bytes = reference.load().memory_usage(deep=True).sum()
+        compact_bytes = compact_reference.df.memory_usage(deep=True).sum()
+        index_bytes = private_bytes([summit_index.numbers, summit_index.coordinates.latitude,
+                                     summit_index.coordinates.longitude])
+        print(f'{"per-process memory":>22}: full reference {full_bytes / 1024 ** 2:7.2f} MB, '
+              f'compact reference {compact_bytes / 1024 ** 2:7.2f} MB, summit index columns '
+              f'{index_bytes / 1024 ** 2:7.2f} MB outside the memory-mapped file')
+
+        def render_map(dataset: pd.DataFrame):
+            # As report.py does, reading the classifications of the visited and unvisited summits.
+            visited_summits = dataset.loc[dataset['latest_visit'].notnull()]
+            unvisited_summits = dataset.loc[dataset['latest_visit'].isnull()]
+            plot_activities([], visited_summits, unvisited_summits, geojson=True).get_root().render()
+
+        full_time = best_time(lambda: render_map(summits), args.repeats)
+        compact_time = best_time(lambda: render_map(compact_summits), args.repeats)
+        print(f'{"summit map":>22}: full reference {1000 * full_time:7.2f} ms, '
+              f'compact reference {1000 * compact_time:7.2f} ms, {full_time / compact_time:5.2f}x faster')
+
+        full_time = best_time(lambda: summarise_completion(summits), args.repeats)
+        compact_time = best_time(lambda: summarise_completion(compact_summits), args.repeats)
+        print(f'{"completion summary":>22}: full reference {1000 * full_time:7.2f} ms, '
+              f'compact reference {1000 * compact_time:7.2f} ms, {full_time / compact_time:5.2f}x faster')
+
+
+if __name__ == '__main__':
+    main()
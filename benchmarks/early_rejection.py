@@ -0,0 +1,79 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.helpers import RouteStore, activities_from_json
+from src.summits.spatial_index import OccupancyGrid, SummitIndex
+from src.summits.summits import PersistentLocalFileSummitReference
+from src.summits.visited import DISTANCE_PROXIMITY, calculate_visits_batch
+
+# Lowland region with no summits, which road and urban activities start from.
+LOWLANDS = (51.5, 53.5, -2.5, 0.0)
+
+
+def generate_mixed_history(n_activities: int, summits: pd.DataFrame, hill_fraction: float, route_points: int):
+    """
+    Generate a synthetic history in which hill_fraction of the activities start at a summit, and the rest are road and
+    urban activities in a region without summits.
+    """
+    n_hills = int(n_activities * hill_fraction)
+    towns = generate_summit_reference(max(n_activities // 10, 1), region=LOWLANDS, seed=1)
+    activities = generate_activities(n_hills, summits, route_points=route_points, seed=0) + \
+        generate_activities(n_activities - n_hills, towns, route_points=route_points, seed=1)
+    np.random.default_rng(0).shuffle(activities)
+    for activity_id, activity in enumerate(activities, start=1):
+        activity['id'] = activity_id
+    return activities_from_json(activities)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare summit detection with and without early rejection of '
+                                                 'routes against the summit occupancy grid.')
+    parser.add_argument('--activities', type=int, default=5000)
+    parser.add_argument('--summits', type=int, default=20000)
+    parser.add_argument('--route-points', type=int, default=500)
+    parser.add_argument('--hill-fraction', type=float, default=0.2)
+    parser.add_argument('--exact', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, 'database.pkl')
+        generate_summit_reference(args.summits).to_pickle(filepath)
+        reference = PersistentLocalFileSummitReference(filepath)
+        summit_index = SummitIndex(reference)
+        activities = generate_mixed_history(args.activities, reference.load(), args.hill_fraction, args.route_points)
+        print(f'{len(activities)} activities, {args.hill_fraction:.0%} starting at a summit')
+
+        # Build the grid outside the timings, as the index does once per process.
+        grid, build_time = timed(summit_index.occupancy_grid, DISTANCE_PROXIMITY)
+        print(f'{"grid build":>22}: {build_time:8.3f} s, {len(grid.cells)} occupied cells')
+
+        expected, baseline = timed(calculate_visits_batch, activities, summit_index, exact=args.exact,
+                                   early_rejection=False)
+        print(f'{"no early rejection":>22}: {baseline:8.3f} s')
+
+        visits, elapsed = timed(calculate_visits_batch, activities, summit_index, exact=args.exact)
+        pd.testing.assert_frame_equal(visits, expected)
+        print(f'{"early rejection":>22}: {elapsed:8.3f} s, speedup {baseline / elapsed:5.2f}x, identical visits')
+
+        routes = RouteStore.from_routes([activity.route for activity in activities])
+        for cell_size in (250., 500., 1000., 2000., 5000.):
+            grid = OccupancyGrid(summit_index.coordinates, distance=DISTANCE_PROXIMITY, cell_size=cell_size)
+            near, screen_time = timed(grid.query_routes, routes.latitude, routes.longitude, routes.offsets)
+            print(f'{f"{cell_size:.0f} m cells":>22}: {len(grid.cells):8d} occupied cells, '
+                  f'{1 - near.mean():6.1%} of activities rejected in {1000 * screen_time:7.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import tempfile
+import time
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.helpers import RouteStore
+from src.visualisation.heatmap import LocalFileTileCache, MAX_ZOOM, render_tile, route_density
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time heatmap rasterisation and tile rendering at each zoom level.')
+    parser.add_argument('--activities', type=int, default=10000)
+    parser.add_argument('--route-points', type=int, default=300)
+    parser.add_argument('--max-zoom', type=int, default=MAX_ZOOM)
+    args = parser.parse_args()
+
+    activities = generate_activities(args.activities, generate_summit_reference(1000), route_points=args.route_points)
+    routes = RouteStore.from_polylines([activity['map']['summary_polyline'] for activity in activities])
+    tile_cache = LocalFileTileCache(tempfile.mkdtemp())
+    print(f'{len(routes)} routes, {len(routes.latitude)} points')
+
+    total_tiles, total_bytes, total_time = 0, 0, 0.
+    for zoom in range(args.max_zoom + 1):
+        start = time.perf_counter()
+        grid = route_density(routes, zoom)
+        rasterised = time.perf_counter() - start
+        max_count = int(grid.counts.max()) if len(grid.counts) else 0
+        tiles, tile_bytes = 0, 0
+        for x, y, counts in grid.tiles():
+            tile = render_tile(counts, max_count)
+            tile_cache.put('benchmark', zoom, x, y, tile)
+            tiles += 1
+            tile_bytes += len(tile)
+        elapsed = time.perf_counter() - start
+        total_tiles, total_bytes, total_time = total_tiles + tiles, total_bytes + tile_bytes, total_time + elapsed
+        print(f'zoom {zoom:>2}: rasterise {rasterised:7.3f} s, total {elapsed:7.3f} s, '
+              f'{tiles:>6} tiles, {tile_bytes / 1e6:7.2f} MB')
+    print(f'   total: {total_time:7.3f} s, {total_tiles:>6} tiles, {total_bytes / 1e6:7.2f} MB')
+
+
+if __name__ == '__main__':
+    main()
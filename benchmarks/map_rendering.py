@@ -0,0 +1,41 @@
+import argparse
+import time
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.helpers import activities_from_json
+from src.summits.spatial_index import SummitIndex
+from src.summits.summits import PersistentLocalFileSummitReference
+from src.summits.visited import calculate_summit_history_batch
+from src.visualisation.map import plot_activities
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare build time and page size of the per-object folium map '
+                                                 'against the GeoJSON layer map.')
+    parser.add_argument('--summits', type=int, default=10000)
+    parser.add_argument('--activities', type=int, default=1000)
+    parser.add_argument('--route-points', type=int, default=500)
+    parser.add_argument('--simplify-zoom', type=int, default=14)
+    parser.add_argument('--reference', default='/tmp/benchmark_summits.pkl')
+    args = parser.parse_args()
+
+    generate_summit_reference(args.summits).to_pickle(args.reference)
+    reference_source = PersistentLocalFileSummitReference(args.reference)
+    activities = activities_from_json(generate_activities(args.activities, reference_source.load(),
+                                                          route_points=args.route_points))
+    dataset = calculate_summit_history_batch(activities, reference_source, summit_index=SummitIndex(reference_source))
+    visited_summits = dataset.loc[dataset['latest_visit'].notnull()]
+    unvisited_summits = dataset.loc[dataset['latest_visit'].isnull()]
+
+    for name, geojson in [('objects', False), ('geojson', True)]:
+        start = time.perf_counter()
+        map = plot_activities(activities, visited_summits, unvisited_summits,
+                              geojson=geojson, simplify_zoom=args.simplify_zoom)
+        built = time.perf_counter() - start
+        page = map.get_root().render()
+        rendered = time.perf_counter() - start
+        print(f'{name:>8}: build {built:8.3f} s, build + render {rendered:8.3f} s, page {len(page) / 1e6:8.2f} MB')
+
+
+if __name__ == '__main__':
+    main()
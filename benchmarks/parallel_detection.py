@@ -0,0 +1,55 @@
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.helpers import activities_from_json
+from src.summits.parallel import ParallelSummitSearch
+from src.summits.spatial_index import SummitIndex
+from src.summits.summits import PersistentLocalFileSummitReference
+from src.summits.visited import calculate_visits_batch
+
+
+def sorted_visits(visits):
+    return visits.sort_values(['activity', 'visited_summits']).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serial summit detection against the process pool at '
+                                                 'increasing worker counts.')
+    parser.add_argument('--activities', type=int, default=5000)
+    parser.add_argument('--summits', type=int, default=20000)
+    parser.add_argument('--route-points', type=int, default=500)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--exact', action='store_true')
+    args = parser.parse_args()
+    print(f'{os.cpu_count()} CPUs')
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, 'database.pkl')
+        generate_summit_reference(args.summits).to_pickle(filepath)
+        reference = PersistentLocalFileSummitReference(filepath)
+        activities = activities_from_json(generate_activities(args.activities, reference.load(),
+                                                              route_points=args.route_points))
+
+        summit_index = SummitIndex(reference)
+        start = time.perf_counter()
+        expected = sorted_visits(calculate_visits_batch(activities, summit_index, exact=args.exact))
+        serial = time.perf_counter() - start
+        print(f'{"serial":>10}: {serial:8.3f} s')
+
+        for workers in args.workers:
+            with ParallelSummitSearch(reference, workers=workers) as search:
+                start = time.perf_counter()
+                visits = sorted_visits(search.calculate_visits(activities, exact=args.exact))
+                elapsed = time.perf_counter() - start
+            # The datetime resolution of the date column may differ between pandas versions.
+            pd.testing.assert_frame_equal(visits, expected, check_dtype=False)
+            print(f'{workers:>2} workers: {elapsed:8.3f} s, speedup {serial / elapsed:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
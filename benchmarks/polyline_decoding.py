@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import numpy as np
+import polyline
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.decoding import decode_polyline, decode_polylines
+
+EDGE_CASES = [
+    '',
+    polyline.encode([(0., 0.)]),
+    polyline.encode([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]),
+    polyline.encode([(-89.99999, -179.99999), (89.99999, 179.99999), (-89.99999, -179.99999)]),
+    polyline.encode([(57.1, -3.5)] * 10),
+]
+
+
+def check_correctness(polyline_strs):
+    """
+    Compare the NumPy decoders against the polyline package, raising an AssertionError on any mismatch.
+    """
+    latitude, longitude, offsets = decode_polylines(polyline_strs)
+    assert len(offsets) == len(polyline_strs) + 1
+    for index, polyline_str in enumerate(polyline_strs):
+        expected = np.array(polyline.decode(polyline_str)).reshape(-1, 2)
+        single_latitude, single_longitude = decode_polyline(polyline_str)
+        for lat, lng in [(latitude[offsets[index]:offsets[index + 1]], longitude[offsets[index]:offsets[index + 1]]),
+                         (single_latitude, single_longitude)]:
+            assert len(lat) == len(expected), f'polyline {index}: expected {len(expected)} points, got {len(lat)}'
+            np.testing.assert_allclose(lat, expected[:, 0], rtol=0, atol=1e-9)
+            np.testing.assert_allclose(lng, expected[:, 1], rtol=0, atol=1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the NumPy polyline decoders against the polyline package, '
+                                                 'and compare decode time.')
+    parser.add_argument('--activities', type=int, default=5000)
+    parser.add_argument('--route-points', type=int, default=200)
+    args = parser.parse_args()
+
+    activities = generate_activities(args.activities, generate_summit_reference(1000),
+                                     route_points=args.route_points)
+    polyline_strs = [activity['map']['summary_polyline'] for activity in activities]
+
+    check_correctness(EDGE_CASES)
+    check_correctness(EDGE_CASES + polyline_strs + EDGE_CASES)
+    print('decoded coordinates match the polyline package')
+
+    for name, method in [('polyline.decode', lambda: [np.array(polyline.decode(p)).T for p in polyline_strs]),
+                         ('decode_polyline', lambda: [decode_polyline(p) for p in polyline_strs]),
+                         ('decode_polylines', lambda: decode_polylines(polyline_strs))]:
+        start = time.perf_counter()
+        method()
+        print(f'{name:>16}: {time.perf_counter() - start:8.3f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import datetime as dt
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import polyline
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.helpers import RouteStore, activities_from_json
+from src.summits.dedup import RouteDeduplicator
+from src.summits.spatial_index import SummitIndex
+from src.summits.summits import PersistentLocalFileSummitReference
+from src.summits.visited import calculate_visits_batch, find_route_visits
+
+
+def generate_commute_history(n_activities: int,
+                             summits: pd.DataFrame,
+                             n_commutes: int,
+                             commute_fraction: float,
+                             route_points: int,
+                             jitter: float = 0.,
+                             seed: int = 0) -> List[Dict]:
+    """
+    Generate a synthetic history in which commute_fraction of the activities repeat one of n_commutes routes, each
+    repeat with its own id and date. If jitter is positive, repeats are offset by up to jitter decimal degrees, as
+    recorded by a different GPS trace, so they are near duplicates rather than exact duplicates.
+    """
+    rng = np.random.default_rng(seed)
+    n_repeats = int(n_activities * commute_fraction)
+    commutes = generate_activities(n_commutes, summits, route_points=route_points, seed=seed + 1)
+    activities = generate_activities(n_activities - n_repeats, summits, route_points=route_points, seed=seed)
+    for repeat in range(n_repeats):
+        commute = dict(commutes[rng.integers(n_commutes)])
+        route = np.array(polyline.decode(commute['map']['summary_polyline']))
+        if jitter > 0:
+            route = route + rng.uniform(-jitter, jitter, route.shape)
+        commute['map'] = {'summary_polyline': polyline.encode([tuple(point) for point in route])}
+        commute['start_date'] = (dt.datetime(2015, 1, 1) + dt.timedelta(hours=repeat)).isoformat() + 'Z'
+        activities.append(commute)
+    rng.shuffle(activities)
+    for activity_id, activity in enumerate(activities, start=1):
+        activity['id'] = activity_id
+    return activities
+
+
+def search_without_deduplication(activities, summit_index: SummitIndex, exact: bool) -> pd.DataFrame:
+    return find_route_visits(summit_index=summit_index,
+                             routes=RouteStore.from_routes([activity.route for activity in activities]),
+                             activity_ids=np.array([activity.id for activity in activities], dtype='int64'),
+                             activity_dates=pd.to_datetime([activity.date for activity in activities]),
+                             exact=exact)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare summit detection with and without route deduplication on '
+                                                 'a commute heavy synthetic history.')
+    parser.add_argument('--activities', type=int, default=5000)
+    parser.add_argument('--summits', type=int, default=20000)
+    parser.add_argument('--route-points', type=int, default=500)
+    parser.add_argument('--commutes', type=int, default=5)
+    parser.add_argument('--commute-fraction', type=float, default=0.8)
+    parser.add_argument('--near-duplicate-distance', type=float, default=200.)
+    parser.add_argument('--exact', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, 'database.pkl')
+        generate_summit_reference(args.summits).to_pickle(filepath)
+        reference = PersistentLocalFileSummitReference(filepath)
+        summit_index = SummitIndex(reference)
+        for jitter in (0., 0.00005):
+            activities = activities_from_json(generate_commute_history(args.activities, reference.load(),
+                                                                       n_commutes=args.commutes,
+                                                                       commute_fraction=args.commute_fraction,
+                                                                       route_points=args.route_points,
+                                                                       jitter=jitter))
+            label = 'near duplicate repeats' if jitter else 'exact repeats'
+            print(f'{len(activities)} activities, {args.commute_fraction:.0%} repeating {args.commutes} commutes, '
+                  f'{label}')
+
+            expected, baseline = timed(search_without_deduplication, activities, summit_index, args.exact)
+            print(f'{"no deduplication":>24}: {baseline:8.3f} s')
+
+            visits, elapsed = timed(calculate_visits_batch, activities, summit_index, exact=args.exact)
+            pd.testing.assert_frame_equal(visits, expected)
+            print(f'{"exact deduplication":>24}: {elapsed:8.3f} s, speedup {baseline / elapsed:5.2f}x, '
+                  f'identical visits')
+
+            deduplicator = RouteDeduplicator(near_duplicate_distance=args.near_duplicate_distance)
+            visits, elapsed = timed(calculate_visits_batch, activities, summit_index, exact=args.exact,
+                                    deduplicator=deduplicator)
+            # Near duplicate matching is approximate, so report how many visits differ from searching every route.
+            keys = ['activity', 'visited_summits']
+            differing = len(pd.concat([visits[keys], expected[keys]]).drop_duplicates(keep=False))
+            print(f'{"near duplicate matching":>24}: {elapsed:8.3f} s, speedup {baseline / elapsed:5.2f}x, '
+                  f'{differing} of {len(expected)} visits differ')
+
+
+if __name__ == '__main__':
+    main()
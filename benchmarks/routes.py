@@ -0,0 +1,49 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import polyline
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.helpers import RouteStore
+
+
+def dataframe_routes(polyline_strs):
+    # Mirrors the previous Route implementation, a pd.DataFrame subclass per activity.
+    routes = []
+    for polyline_str in polyline_strs:
+        coords = np.array(polyline.decode(polyline_str)).T
+        routes.append(pd.DataFrame(data={'lat': coords[0], 'lng': coords[1]}))
+    return routes
+
+
+def measure(method, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = method(*args)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare memory and decode time of per-activity DataFrame routes '
+                                                 'against the columnar RouteStore.')
+    parser.add_argument('--activities', type=int, default=5000)
+    parser.add_argument('--route-points', type=int, default=200)
+    args = parser.parse_args()
+
+    activities = generate_activities(args.activities, generate_summit_reference(1000),
+                                     route_points=args.route_points)
+    polyline_strs = [activity['map']['summary_polyline'] for activity in activities]
+
+    for name, method in [('DataFrame', dataframe_routes), ('RouteStore', RouteStore.from_polylines)]:
+        _, elapsed, retained, peak = measure(method, polyline_strs)
+        print(f'{name:>10}: {elapsed:8.3f} s, retained {retained / 1e6:8.2f} MB, peak {peak / 1e6:8.2f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.summits.summits import write_columnar_reference
+
+HEAVY_MODULES = ['pandas', 'numpy', 'scipy', 'folium', 'jinja2', 'stravaclient']
+
+# Each request runs in a fresh interpreter, as in a new Lambda container. The Strava client is replaced by a fake
+# serving synthetic activities, so that only the cost of the entry point itself is measured.
+INVOCATION = '''
+import json, sys, time
+start = time.perf_counter()
+import src.serverless as serverless
+imported = time.perf_counter() - start
+
+
+class FakeAuthorisation:
+    def generate_authorisation_url(self, redirect_uri, scope):
+        return 'https://www.strava.com/oauth/authorize'
+
+    def post_athlete_auth_code(self, code):
+        return 1
+
+
+class FakeClient:
+    authorisation = FakeAuthorisation()
+
+    def list_activities(self, athlete_id, page, per_page, after=None):
+        with open(ACTIVITIES) as f:
+            activities = json.load(f)
+        return activities[(page - 1) * per_page:page * per_page]
+
+    def get_athlete_info(self, athlete_id):
+        return {'firstname': 'Synthetic', 'lastname': 'Athlete'}
+
+
+serverless._client = FakeClient()
+timings = []
+for athlete_id in (1, 2):
+    # The second athlete has no cached activities or report, so it measures a warm but uncached invocation.
+    event = dict(EVENT)
+    if 'cookies' in event:
+        event['cookies'] = [f'ott={serverless.issue_token(athlete_id)}']
+    start = time.perf_counter()
+    response = serverless.handler(event, None)
+    timings.append(time.perf_counter() - start)
+    assert response['statusCode'] in (200, 302), response
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS'))
+print(json.dumps({'import': imported, 'first': timings[0], 'warm': timings[1], 'rss_kb': rss,
+                  'loaded': [module for module in HEAVY if module in sys.modules]}))
+'''
+
+EVENTS = {
+    'login': {'version': '2.0', 'rawPath': '/'},
+    'authorise': {'version': '2.0', 'rawPath': '/', 'queryStringParameters': {'authorise': 'true'}},
+    'callback': {'version': '2.0', 'rawPath': '/', 'queryStringParameters': {'code': 'code'}},
+    # The cookie is replaced by a token signed for each athlete.
+    'report': {'version': '2.0', 'rawPath': '/', 'cookies': []},
+}
+
+TEMPLATES = {
+    'login.html': '<html>{% if login %}login{% endif %}</html>',
+    'display.html': '<html>{{ athlete }}{{ map | safe }}{{ report_df | length }}</html>',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time, first invocation time and loaded '
+                                                 'modules of the serverless handler for each request type, each in '
+                                                 'a fresh interpreter.')
+    parser.add_argument('--summits', type=int, default=20000)
+    parser.add_argument('--activities', type=int, default=200)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        summits = generate_summit_reference(args.summits)
+        write_columnar_reference(summits, os.path.join(directory, 'database'))
+        activities_path = os.path.join(directory, 'activities.json')
+        with open(activities_path, 'w') as f:
+            json.dump(generate_activities(args.activities, summits), f)
+        os.makedirs(os.path.join(directory, 'templates'))
+        for name, template in TEMPLATES.items():
+            with open(os.path.join(directory, 'templates', name), 'w') as f:
+                f.write(template)
+
+        print(f'{"request":>10} {"import ms":>10} {"first ms":>10} {"warm ms":>10} {"RSS MB":>8}  loaded modules')
+        for name, event in EVENTS.items():
+            results = []
+            for repeat in range(args.repeats):
+                state_directory = os.path.join(directory, f'state-{name}-{repeat}')
+                env = dict(os.environ,
+                           SUMMITMAP_REFERENCE_DIR=os.path.join(directory, 'database'),
+                           SUMMITMAP_STATE_DIR=state_directory,
+                           SUMMITMAP_TEMPLATE_DIR=os.path.join(directory, 'templates'))
+                source = (f'ACTIVITIES = {activities_path!r}\nEVENT = {event!r}\nHEAVY = {HEAVY_MODULES!r}\n'
+                          + INVOCATION)
+                output = subprocess.run([sys.executable, '-c', source], capture_output=True, text=True, check=True,
+                                        env=env)
+                results.append(json.loads(output.stdout.splitlines()[-1]))
+            best = min(results, key=lambda result: result['import'] + result['first'])
+            print(f'{name:>10} {1000 * best["import"]:10.1f} {1000 * best["first"]:10.1f} '
+                  f'{1000 * best["warm"]:10.1f} {best["rss_kb"] / 1024:8.1f}  {", ".join(best["loaded"]) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import argparse
+import csv
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from benchmarks.synthetic import SCOTLAND, generate_activities, generate_summit_reference
+from src.strava.helpers import RouteStore, activities_from_json, interpolate_polyline
+from src.summits.locator import nearest_neighbour_search, trim_search_area
+from src.summits.spatial_index import SummitIndex
+from src.summits.summits import PersistentLocalFileSummitReference
+from src.summits.visited import SAMPLING_DISTANCE_INVERSE, calculate_summit_history, calculate_summit_history_batch
+from src.utils import CoordinateSet
+from src.visualisation.map import plot_activities
+
+
+def measure(stage: Callable[[], object]) -> Dict[str, float]:
+    """
+    Time a stage, then run it again under tracemalloc to record its peak memory. The runs are kept separate, as
+    tracemalloc slows down allocation heavy code considerably.
+    """
+    start = time.perf_counter()
+    stage()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': elapsed, 'peak_mb': peak / 1e6}
+
+
+def run_stages(n_activities: int,
+               reference: PersistentLocalFileSummitReference,
+               summit_index: SummitIndex,
+               route_points: int,
+               region: tuple,
+               seed: int) -> List[Dict]:
+    """
+    Generate a synthetic athlete and time each stage of the summit pipeline on their activities.
+
+    :return: list of result dictionaries, one per stage
+    """
+    summits = reference.load()
+    activity_json = generate_activities(n_activities, summits, route_points=route_points, seed=seed, region=region)
+    polyline_strs = [activity['map']['summary_polyline'] for activity in activity_json]
+    activities = activities_from_json(activity_json)
+    routes = [interpolate_polyline(activity.route, int(activity.distance * SAMPLING_DISTANCE_INVERSE))
+              for activity in activities]
+    trails = [CoordinateSet(latitude=route.latitude, longitude=route.longitude) for route in routes]
+    search_areas = [trim_search_area(reference, trail, search_window_width=0.1) for trail in trails]
+    points = sum(len(route) for route in routes)
+
+    dataset = calculate_summit_history_batch(activities, reference, summit_index=summit_index)
+    visited_summits = dataset.loc[dataset['latest_visit'].notnull()]
+    unvisited_summits = dataset.loc[dataset['latest_visit'].isnull()]
+
+    def nearest_neighbours():
+        for trail, search_area in zip(trails, search_areas):
+            if len(search_area):
+                nearest_neighbour_search(trail, CoordinateSet(latitude=search_area['Latitude'].values,
+                                                              longitude=search_area['Longitude'].values))
+
+    # Each stage with the unit its throughput is counted in.
+    stages = [
+        ('decode', 'points', len(RouteStore.from_polylines(polyline_strs).latitude),
+         lambda: RouteStore.from_polylines(polyline_strs)),
+        ('interpolate_polyline', 'activities', n_activities,
+         lambda: [interpolate_polyline(activity.route, int(activity.distance * SAMPLING_DISTANCE_INVERSE))
+                  for activity in activities]),
+        ('trim_search_area', 'activities', n_activities,
+         lambda: [trim_search_area(reference, trail, search_window_width=0.1) for trail in trails]),
+        ('nearest_neighbour_search', 'points', points, nearest_neighbours),
+        ('calculate_summit_history', 'activities', n_activities,
+         lambda: calculate_summit_history(activities, reference)),
+        ('calculate_summit_history_batch', 'activities', n_activities,
+         lambda: calculate_summit_history_batch(activities, reference, summit_index=summit_index)),
+        ('plot_activities', 'activities', n_activities,
+         lambda: plot_activities(activities, visited_summits, unvisited_summits, geojson=True).get_root().render()),
+    ]
+
+    results = []
+    for name, unit, items, stage in stages:
+        result = measure(stage)
+        result.update(stage=name, activities=n_activities, unit=unit, items=items,
+                      throughput=items / result['seconds'])
+        results.append(result)
+    return results
+
+
+def print_scaling(results: List[Dict]):
+    """
+    Print the scaling exponent of each stage: the slope of log(time) against log(activities) between the smallest and
+    largest runs. 1 is linear scaling.
+    """
+    for stage in dict.fromkeys(result['stage'] for result in results):
+        runs = [result for result in results if result['stage'] == stage]
+        smallest, largest = runs[0], runs[-1]
+        if largest['activities'] == smallest['activities']:
+            continue
+        exponent = (np.log(largest['seconds'] / smallest['seconds']) /
+                    np.log(largest['activities'] / smallest['activities']))
+        print(f'{stage:>31}: time ~ activities^{exponent:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each stage of the summit pipeline on synthetic athletes of '
+                                                 'increasing size, reporting throughput, peak memory and scaling.')
+    parser.add_argument('--activities', type=int, nargs='+', default=[100, 300, 1000])
+    parser.add_argument('--summits', type=int, default=20000)
+    parser.add_argument('--route-points', type=int, default=200)
+    parser.add_argument('--region', type=float, nargs=4, default=SCOTLAND,
+                        metavar=('LAT_MIN', 'LAT_MAX', 'LNG_MIN', 'LNG_MAX'),
+                        help='bounding box the synthetic athletes are active in')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', help='optional path to write the results to, e.g. for plotting scaling curves')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, 'database.pkl')
+        generate_summit_reference(args.summits, seed=args.seed).to_pickle(filepath)
+        reference = PersistentLocalFileSummitReference(filepath)
+        summit_index = SummitIndex(reference)
+
+        results = []
+        print(f'{"stage":>31} {"activities":>10} {"seconds":>9} {"throughput":>22} {"peak MB":>9}')
+        for n_activities in sorted(args.activities):
+            for result in run_stages(n_activities, reference, summit_index, args.route_points,
+                                     tuple(args.region), args.seed):
+                print(f'{result["stage"]:>31} {n_activities:>10} {result["seconds"]:9.3f} '
+                      f'{result["throughput"]:12.0f} {result["unit"] + "/s":<9} {result["peak_mb"]:9.1f}')
+                results.append(result)
+        print()
+        print_scaling(results)
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['stage', 'activities', 'unit', 'items', 'seconds', 'throughput',
+                                                   'peak_mb'])
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.helpers import RouteStore, activities_from_json, densify_routes, interpolate_polyline
+from src.summits.locator import haversine_distance
+from src.summits.spatial_index import SummitIndex
+from src.summits.summits import PersistentLocalFileSummitReference
+from src.summits.visited import (DISTANCE_PROXIMITY, SAMPLING_DISTANCE, SAMPLING_DISTANCE_INVERSE,
+                                 calculate_summit_history, calculate_summit_history_batch)
+from src.utils import CoordinateSet
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-athlete summit history wall time.')
+    parser.add_argument('--activities', type=int, default=1000)
+    parser.add_argument('--summits', type=int, default=20000)
+    parser.add_argument('--route-points', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, 'database.pkl')
+        generate_summit_reference(args.summits).to_pickle(filepath)
+        reference = PersistentLocalFileSummitReference(filepath)
+        summits = reference.load()
+        activities = activities_from_json(generate_activities(args.activities, summits,
+                                                              route_points=args.route_points))
+
+        start = time.perf_counter()
+        summit_index = SummitIndex(reference)
+        index_time = time.perf_counter() - start
+
+        results = {}
+        for name, method, kwargs in [('loop', calculate_summit_history, {}),
+                                     ('loop + index', calculate_summit_history, {'summit_index': summit_index}),
+                                     ('batch', calculate_summit_history_batch, {'summit_index': summit_index}),
+                                     ('batch exact', calculate_summit_history_batch,
+                                      {'summit_index': summit_index, 'exact': True})]:
+            start = time.perf_counter()
+            results[name] = method(activities=activities, reference_source=reference, **kwargs)
+            print(f'{name:>14}: {time.perf_counter() - start:8.3f} s')
+        print(f'{"index build":>14}: {index_time:8.3f} s')
+
+        expected = results['loop']['latest_visit']
+        assert results['loop + index']['latest_visit'].equals(expected), 'loop + index does not match the loop'
+        # The batch modes find every summit within DISTANCE_PROXIMITY of a route segment, whereas the loop only finds
+        # the nearest summit to each resampled point, so small differences in the summits detected are expected.
+        assert results['batch']['latest_visit'].equals(results['batch exact']['latest_visit']), \
+            'batch does not match batch exact'
+        for name in ['batch', 'batch exact']:
+            visited = results[name]['latest_visit'].notnull()
+            print(f'{name:>14}: {visited.sum()} visited summits, {(visited != expected.notnull()).sum()} differing '
+                  f'from loop ({expected.notnull().sum()} visited)')
+
+        loop_routes = RouteStore.from_routes([interpolate_polyline(activity.route,
+                                                                   int(activity.distance * SAMPLING_DISTANCE_INVERSE))
+                                              for activity in activities])
+        activity_routes = RouteStore.from_routes([activity.route for activity in activities])
+        # Densifying at half the visit distance, and searching only the visit distance around each point, is the
+        # oversampling the batch mode replaces.
+        oversampled_routes = densify_routes(activity_routes, spacing=DISTANCE_PROXIMITY / 2)
+        batch_routes = densify_routes(activity_routes, spacing=SAMPLING_DISTANCE)
+        for name, routes in [('loop', loop_routes), ('oversampled', oversampled_routes), ('batch', batch_routes)]:
+            print(f'{name:>14}: {len(routes.latitude)} points searched, '
+                  f'maximum spacing {maximum_spacing(routes):.1f} m')
+        print(f'{"batch exact":>14}: {len(activity_routes.segments()[0])} segments searched')
+
+        start = time.perf_counter()
+        _, summit_indices, _ = summit_index.query_radius(CoordinateSet(latitude=oversampled_routes.latitude,
+                                                                       longitude=oversampled_routes.longitude),
+                                                         distance=DISTANCE_PROXIMITY)
+        oversampled_time = time.perf_counter() - start
+        batch_visited = set(results['batch'].loc[results['batch']['latest_visit'].notnull(), 'Number'])
+        oversampled_visited = set(summit_index.numbers[summit_indices])
+        print(f'{"oversampled":>14}: {len(oversampled_visited)} visited summits in {oversampled_time:.3f} s, '
+              f'{len(batch_visited - oversampled_visited)} of the batch visits missed, '
+              f'{len(oversampled_visited - batch_visited)} not in the batch visits')
+
+
+def maximum_spacing(routes: RouteStore) -> float:
+    spacing = haversine_distance(*np.radians([routes.longitude[:-1], routes.latitude[:-1],
+                                              routes.longitude[1:], routes.latitude[1:]]))
+    # Exclude the gaps between the last point of one route and the first point of the next.
+    route_starts = routes.offsets[1:-1]
+    within_route = np.ones(len(spacing), dtype=bool)
+    within_route[route_starts[(route_starts > 0) & (route_starts < len(routes.latitude))] - 1] = False
+    return spacing[within_route].max()
+
+
+if __name__ == '__main__':
+    main()
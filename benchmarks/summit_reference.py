@@ -0,0 +1,50 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import SCOTLAND, generate_summit_reference
+from src.summits.summits import (MemoryMappedSummitReference, PersistentLocalFileSummitReference,
+                                write_columnar_reference)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare bounding box window query latency of summit references.')
+    parser.add_argument('--summits', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--window-width', type=float, default=0.2)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    lat_min, lat_max, lng_min, lng_max = SCOTLAND
+    centres = np.column_stack([rng.uniform(lat_min, lat_max, args.queries),
+                               rng.uniform(lng_min, lng_max, args.queries)])
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, 'database.pkl')
+        df = generate_summit_reference(args.summits)
+        df.to_pickle(filepath)
+        columns_directory = os.path.join(directory, 'database')
+        write_columnar_reference(df, columns_directory)
+
+        results = {}
+        for name, reference in [('persistent', PersistentLocalFileSummitReference(filepath)),
+                                ('memory-mapped', MemoryMappedSummitReference(columns_directory))]:
+            reference.load()
+            start = time.perf_counter()
+            results[name] = [reference.load(latitude_window=(lat - args.window_width, lat + args.window_width),
+                                            longitude_window=(lng - args.window_width, lng + args.window_width))
+                             for lat, lng in centres]
+            elapsed = time.perf_counter() - start
+            print(f'{name:>13}: {1e6 * elapsed / args.queries:8.1f} us per window query')
+
+        # Memory-mapped rows are sorted by latitude, so windows are compared in the order of the original index.
+        for persistent, memory_mapped in zip(results['persistent'], results['memory-mapped']):
+            memory_mapped = memory_mapped.sort_values('index').reset_index(drop=True)[persistent.columns]
+            assert persistent.equals(memory_mapped), 'memory-mapped window does not match the persistent reference'
+
+
+if __name__ == '__main__':
+    main()
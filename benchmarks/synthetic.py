@@ -0,0 +1,80 @@
+import datetime as dt
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import polyline
+
+from src.summits.compact import CLASSIFICATIONS
+from src.summits.locator import haversine_distance
+
+SCOTLAND = (55.5, 58.5, -6.5, -3.0)
+
+
+def generate_summit_reference(n_summits: int,
+                              region: Tuple[float, float, float, float] = SCOTLAND,
+                              seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a synthetic summit database with the same columns as the reference pickle.
+
+    :param n_summits: number of summits to generate
+    :param region: (lat_min, lat_max, lng_min, lng_max) bounding box in decimal degrees
+    :param seed: random seed
+    :return: pd.DataFrame of synthetic summits
+    """
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, lng_min, lng_max = region
+    df = pd.DataFrame({
+        'Number': np.arange(1, n_summits + 1),
+        'Name': [f'Summit {i}' for i in range(1, n_summits + 1)],
+        'Metres': rng.integers(300, 1345, n_summits),
+        'Latitude': rng.uniform(lat_min, lat_max, n_summits),
+        'Longitude': rng.uniform(lng_min, lng_max, n_summits),
+    })
+    for classification in CLASSIFICATIONS:
+        df[classification] = (rng.random(n_summits) < 0.2).astype(int)
+    return df
+
+
+def generate_activities(n_activities: int,
+                        summits: pd.DataFrame,
+                        route_points: int = 200,
+                        step: float = 0.001,
+                        seed: int = 0,
+                        region: Union[Tuple[float, float, float, float], None] = None) -> List[Dict]:
+    """
+    Generate synthetic Strava activity JSON, each a random walk starting at a randomly chosen summit.
+
+    :param n_activities: number of activities to generate
+    :param summits: summit database the routes start from
+    :param route_points: number of vertices in each summary polyline
+    :param step: typical standard deviation of each random walk step, in decimal degrees
+    :param seed: random seed
+    :param region: optional (lat_min, lat_max, lng_min, lng_max) bounding box the athlete is active in. Routes only
+    start from summits inside it.
+    :return: list of activity JSON dictionaries, as returned by the Strava list activities endpoint
+    """
+    rng = np.random.default_rng(seed)
+    if region is not None:
+        lat_min, lat_max, lng_min, lng_max = region
+        summits = summits.loc[summits['Latitude'].between(lat_min, lat_max) &
+                              summits['Longitude'].between(lng_min, lng_max)]
+    start_date = dt.datetime(2015, 1, 1)
+    activities = []
+    for activity_id in range(1, n_activities + 1):
+        start = summits.iloc[rng.integers(len(summits))]
+        # Summary polylines are simplified, so vertices are dense on bends and sparse on straight sections. Scaling
+        # each step by an exponential variate gives a similar spread of segment lengths.
+        scale = rng.exponential(1., route_points)
+        lat = start['Latitude'] + np.cumsum(rng.normal(0, step, route_points) * scale)
+        lng = start['Longitude'] + np.cumsum(rng.normal(0, step, route_points) * scale)
+        distance = np.sum(haversine_distance(*np.radians([lng[:-1], lat[:-1], lng[1:], lat[1:]])))
+        activities.append({
+            'id': activity_id,
+            'start_date': (start_date + dt.timedelta(hours=int(rng.integers(24 * 365 * 8)))).isoformat() + 'Z',
+            'map': {'summary_polyline': polyline.encode(list(zip(lat, lng)))},
+            'distance': float(distance),
+            'moving_time': int(distance / 3),
+            'elapsed_time': int(distance / 2.5),
+        })
+    return activities
@@ -0,0 +1,19 @@
+import argparse
+
+import pandas as pd
+
+from src.summits.summits import write_columnar_reference
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the summit reference pickle to memory-mappable column '
+                                                 'files, for use with MemoryMappedSummitReference.')
+    parser.add_argument('pickle', help='path to the summit reference pickle, e.g. database.pkl')
+    parser.add_argument('directory', help='directory to write the column files to, e.g. database')
+    args = parser.parse_args()
+
+    write_columnar_reference(pd.read_pickle(args.pickle), args.directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import logging
+
+from src.instrumentation import configure_logging
+from src.strava.helpers import LocalFileActivityCache
+from src.summits.recompute import diff_references, recompute_visit_histories
+from src.summits.store import LocalFileVisitStore
+from src.summits.summits import open_summit_reference
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the stored visit histories of every athlete after a change '
+                                                 'to the summit reference, searching only the activities near added '
+                                                 'or moved summits.')
+    parser.add_argument('old_reference', help='summit reference the visit histories were computed against, as a '
+                                              'pickle or a directory of column files')
+    parser.add_argument('new_reference', help='updated summit reference, as a pickle or a directory of column files')
+    parser.add_argument('--visit-store', default='./visit_store', help='visit store directory')
+    parser.add_argument('--activity-cache', default='./activity_cache', help='activity cache directory')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, defaults to the '
+                                                                  'number of CPUs')
+    args = parser.parse_args()
+    configure_logging()
+
+    diff = diff_references(open_summit_reference(args.old_reference), open_summit_reference(args.new_reference))
+    logger.info('summit reference diff', extra={'fields': {'added': len(diff.added), 'removed': len(diff.removed),
+                                                           'moved': len(diff.moved),
+                                                           'reclassified': len(diff.reclassified)}})
+    if diff.old_version == diff.new_version:
+        return
+
+    visit_store = LocalFileVisitStore(args.visit_store)
+    totals = recompute_visit_histories(athlete_ids=visit_store.athletes(),
+                                       diff=diff,
+                                       reference_path=args.new_reference,
+                                       visit_store=visit_store,
+                                       activity_cache=LocalFileActivityCache(args.activity_cache),
+                                       workers=args.workers)
+    logger.info('visit histories updated', extra={'fields': totals})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Union
+
+
+def activity_fingerprint(activities: List[Dict], reference_version: str) -> str:
+    """
+    Fingerprint the inputs a summit report depends on: the athlete's activities, identified by their count and the
+    most recent activity, and the version of the summit reference the visits were calculated against.
+
+    :param activities: list of activity JSON dictionaries
+    :param reference_version: version of the summit reference, including the detection method
+    :return: fingerprint string
+    """
+    latest = max(activities, key=lambda activity: (activity['start_date'], activity['id']), default=None)
+    key = {
+        'count': len(activities),
+        'latest_id': None if latest is None else latest['id'],
+        'latest_start_date': None if latest is None else latest['start_date'],
+        'reference_version': reference_version,
+    }
+    return hashlib.md5(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class ReportCache:
+    """
+    Two tier cache of rendered report pages, keyed by athlete id. Each entry records the fingerprint of the inputs it
+    was rendered from, and is only returned for a matching fingerprint. The memory tier is an LRU bounded by total
+    page size; the optional disk tier keeps the latest page of each athlete, pruning the least recently written pages
+    once it exceeds its own size limit.
+    """
+
+    def __init__(self,
+                 max_memory_bytes: int = 256 * 1024 ** 2,
+                 directory: Union[str, None] = None,
+                 max_disk_bytes: int = 2 * 1024 ** 3):
+        self.max_memory_bytes = max_memory_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries: 'OrderedDict[int, Tuple[str, str]]' = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock()
+
+    def get(self, athlete_id: int, fingerprint: str) -> Union[str, None]:
+        with self.lock:
+            entry = self.entries.get(athlete_id)
+            if entry is not None and entry[0] == fingerprint:
+                self.entries.move_to_end(athlete_id)
+                return entry[1]
+
+        entry = self._read(athlete_id)
+        if entry is None or entry[0] != fingerprint:
+            return None
+        self._remember(athlete_id, *entry)
+        return entry[1]
+
+    def put(self, athlete_id: int, fingerprint: str, page: str):
+        self._remember(athlete_id, fingerprint, page)
+        self._write(athlete_id, fingerprint, page)
+
+    def _remember(self, athlete_id: int, fingerprint: str, page: str):
+        with self.lock:
+            previous = self.entries.pop(athlete_id, None)
+            if previous is not None:
+                self.memory_bytes -= len(previous[1])
+            self.entries[athlete_id] = (fingerprint, page)
+            self.memory_bytes += len(page)
+            while self.memory_bytes > self.max_memory_bytes and len(self.entries) > 1:
+                _, (_, evicted_page) = self.entries.popitem(last=False)
+                self.memory_bytes -= len(evicted_page)
+
+    def _read(self, athlete_id: int) -> Union[Tuple[str, str], None]:
+        if self.directory is None or not os.path.exists(self._filepath(athlete_id)):
+            return None
+        with open(self._filepath(athlete_id), 'r') as f:
+            entry = json.load(f)
+        return entry['fingerprint'], entry['page']
+
+    def _write(self, athlete_id: int, fingerprint: str, page: str):
+        if self.directory is None:
+            return
+        with self.disk_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            temporary_filepath = f'{self._filepath(athlete_id)}.tmp'
+            with open(temporary_filepath, 'w') as f:
+                json.dump({'fingerprint': fingerprint, 'page': page}, f)
+            os.replace(temporary_filepath, self._filepath(athlete_id))
+            self._prune()
+
+    def _prune(self):
+        filepaths = [os.path.join(self.directory, filename) for filename in os.listdir(self.directory)
+                     if filename.endswith('.json')]
+        files = sorted((os.path.getmtime(filepath), os.path.getsize(filepath), filepath) for filepath in filepaths)
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, filepath in files[:-1]:
+            if total_bytes <= self.max_disk_bytes:
+                break
+            os.remove(filepath)
+            total_bytes -= size
+
+    def _filepath(self, athlete_id: int) -> str:
+        return os.path.join(self.directory, f'{athlete_id}.json')
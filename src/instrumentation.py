@@ -0,0 +1,204 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Union
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where peak resident set size growth is not recorded.
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """
+    A timed stage of work. The number of items processed, and any other fields, can be set while the span is open.
+
+    peak_rss_growth_bytes is how far the peak resident set size of the whole process grew while the span was open. It
+    is not the memory allocated by the span: it is zero if the span stayed below an earlier peak, and includes the
+    allocations of any other threads running at the time.
+    """
+
+    def __init__(self, name: str, items: Union[int, None] = None, **fields):
+        self.name = name
+        self.items = items
+        self.fields = fields
+        self.seconds = None
+        self.peak_rss_growth_bytes = None
+
+
+class MetricsRegistry:
+    """
+    In-process, thread safe registry of span durations, item counts and peak resident set size growth, and of named
+    counters, aggregated since the process started.
+    """
+
+    def __init__(self):
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def record(self, span: Span):
+        with self.lock:
+            metric = self.spans.setdefault(span.name, {'count': 0, 'errors': 0, 'seconds_total': 0.,
+                                                       'seconds_max': 0., 'items_total': 0,
+                                                       'peak_rss_growth_bytes_max': 0})
+            metric['count'] += 1
+            metric['errors'] += int(span.fields.get('error') is not None)
+            metric['seconds_total'] += span.seconds
+            metric['seconds_max'] = max(metric['seconds_max'], span.seconds)
+            metric['items_total'] += span.items or 0
+            metric['peak_rss_growth_bytes_max'] = max(metric['peak_rss_growth_bytes_max'],
+                                                      span.peak_rss_growth_bytes or 0)
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def counter(self, name: str) -> float:
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def snapshot(self) -> Dict:
+        """
+        Return a copy of the metrics, with mean duration and throughput derived for each span.
+        """
+        with self.lock:
+            spans = {name: dict(metric) for name, metric in self.spans.items()}
+            counters = dict(self.counters)
+        for metric in spans.values():
+            metric['seconds_mean'] = metric['seconds_total'] / metric['count']
+            metric['items_per_second'] = metric['items_total'] / metric['seconds_total'] \
+                if metric['seconds_total'] > 0 else 0.
+        return {'spans': spans, 'counters': counters}
+
+    def reset(self):
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def span(name: str, items: Union[int, None] = None, **fields) -> Iterator[Span]:
+    """
+    Time a block of work, recording its duration, item count and peak resident set size growth to the metrics registry
+    and as a structured log record. The growth is process-wide, see Span, so concurrent spans are attributed each
+    other's allocations.
+
+    :param name: name of the stage, e.g. decode
+    :param items: number of items processed, if known up front. Can also be set on the yielded Span.
+    :param fields: further fields logged with the span, e.g. athlete_id
+    """
+    current = Span(name, items=items, **fields)
+    peak_rss = _peak_rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception as error:
+        current.fields['error'] = type(error).__name__
+        raise
+    finally:
+        current.seconds = time.perf_counter() - start
+        if peak_rss is not None:
+            current.peak_rss_growth_bytes = _peak_rss_bytes() - peak_rss
+        metrics.record(current)
+        logger.info(name, extra={'fields': {'span': name, 'seconds': round(current.seconds, 6),
+                                            'items': current.items,
+                                            'peak_rss_growth_bytes': current.peak_rss_growth_bytes, **current.fields}})
+
+
+def instrumented(name: str, count_items: Union[Callable[..., int], None] = None):
+    """
+    Decorate a function so that every call is recorded as a span.
+
+    :param name: span name
+    :param count_items: optional function of the call's arguments returning the number of items processed
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, items=count_items(*args, **kwargs) if count_items is not None else None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile_if_slow(name: str, directory: Union[str, None], threshold_seconds: float = 10.) -> Iterator[None]:
+    """
+    Profile a block with cProfile, and dump the profile to directory if the block takes longer than threshold_seconds.
+    Profiling is opt-in: if directory is None, the block runs unprofiled. Only the calling thread is profiled, and
+    the block runs unprofiled if another profiler is already active.
+
+    :param name: prefix of the profile filename
+    :param directory: directory profiles are written to, or None to disable profiling
+    :param threshold_seconds: minimum duration of a block for its profile to be kept
+    """
+    if directory is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        if elapsed > threshold_seconds:
+            os.makedirs(directory, exist_ok=True)
+            filepath = os.path.join(directory, f'{name}-{int(time.time())}.prof')
+            profiler.dump_stats(filepath)
+            logger.warning('slow block profiled', extra={'fields': {'profile': filepath, 'name': name,
+                                                                    'seconds': round(elapsed, 6)}})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as single line JSON objects, including any fields passed as extra={'fields': {...}}.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: int = logging.INFO):
+    """
+    Write structured JSON logs to stderr.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+
+def _peak_rss_bytes() -> Union[int, None]:
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Protocol, Union
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+
+@dataclass
+class Job:
+    id: str
+    athlete_id: int
+    status: str = QUEUED
+    error: Union[str, None] = None
+    finished_at: Union[float, None] = None
+    # Updated periodically by the process running the job while it is queued or running, so that jobs left unfinished
+    # by a process that died can be recognised.
+    heartbeat_at: Union[float, None] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (COMPLETE, FAILED)
+
+
+class ResultStore(Protocol):
+    def get(self, job_id: str) -> Union[str, None]:
+        pass
+
+    def put(self, job_id: str, result: str):
+        pass
+
+    def get_job(self, job_id: str) -> Union[Job, None]:
+        pass
+
+    def put_job(self, job: Job):
+        pass
+
+    def delete(self, job_id: str):
+        pass
+
+    def jobs(self) -> List[Job]:
+        pass
+
+    def claim(self, job: Job) -> str:
+        pass
+
+    def release(self, athlete_id: int, job_id: str):
+        pass
+
+
+class LocalFileResultStore:
+    """
+    Stores the status of each job as a JSON file, and the rendered page of each finished job as an HTML file, in a
+    local directory. Every process sharing the directory sees the same jobs. The active job of each athlete is claimed
+    by creating a claim file holding its id, which only one process can create.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get(self, job_id: str) -> Union[str, None]:
+        filepath = self._filepath(job_id, 'html')
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, 'r') as f:
+            return f.read()
+
+    def put(self, job_id: str, result: str):
+        self._write(self._filepath(job_id, 'html'), result)
+
+    def get_job(self, job_id: str) -> Union[Job, None]:
+        filepath = self._filepath(job_id, 'json')
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, 'r') as f:
+            return Job(**json.load(f))
+
+    def put_job(self, job: Job):
+        self._write(self._filepath(job.id, 'json'), json.dumps(asdict(job)))
+
+    def delete(self, job_id: str):
+        # Remove the status last, so a job is never reported complete without its page.
+        for extension in ('html', 'json'):
+            try:
+                os.remove(self._filepath(job_id, extension))
+            except FileNotFoundError:
+                pass
+
+    def jobs(self) -> List[Job]:
+        """
+        Return every job in the store.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        jobs = [self.get_job(filename[:-len('.json')]) for filename in os.listdir(self.directory)
+                if filename.endswith('.json')]
+        # A job may be deleted by another process while the directory is read.
+        return [job for job in jobs if job is not None]
+
+    def claim(self, job: Job) -> str:
+        """
+        Claim an athlete for a job, unless another job already holds the claim.
+
+        :param job: job to claim its athlete for
+        :return: id of the job holding the claim, which is job.id if the claim was made
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        filepath = self._claim_filepath(job.athlete_id)
+        try:
+            descriptor = os.open(filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(filepath, 'r') as f:
+                    return f.read()
+            except FileNotFoundError:
+                # Released since it was found, so try again.
+                return self.claim(job)
+        with os.fdopen(descriptor, 'w') as f:
+            f.write(job.id)
+        return job.id
+
+    def release(self, athlete_id: int, job_id: str):
+        """
+        Release the claim on an athlete, if it is held by the given job.
+        """
+        filepath = self._claim_filepath(athlete_id)
+        try:
+            with open(filepath, 'r') as f:
+                if f.read() != job_id:
+                    return
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+    def _write(self, filepath: str, content: str):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_filepath = f'{filepath}.{uuid.uuid4().hex}.tmp'
+        with open(temporary_filepath, 'w') as f:
+            f.write(content)
+        os.replace(temporary_filepath, filepath)
+
+    def _claim_filepath(self, athlete_id: int) -> str:
+        return os.path.join(self.directory, f'athlete-{int(athlete_id)}.claim')
+
+    def _filepath(self, job_id: str, extension: str) -> str:
+        # Job ids are generated as hex uuids, but guard against path traversal from ids supplied in a URL.
+        return os.path.join(self.directory, f'{os.path.basename(job_id)}.{extension}')
+
+
+class ReportJobQueue:
+    """
+    Runs report generation jobs on a pool of worker threads, so that requests return immediately and clients poll for
+    the result. At most one job per athlete is queued or running at a time, across every process sharing the result
+    store; submitting a report for an athlete who already has a job in progress returns the existing job.
+
+    Job status and results are kept in the result store rather than in memory, so a job can be polled from any process
+    sharing the store. While a job is queued or running, its process records a heartbeat every heartbeat_seconds. A
+    job with no heartbeat for stale_seconds was left unfinished by a process that stopped, and is marked failed.
+    Finished jobs and their pages are deleted ttl_seconds after they finish, checked at most every expiry_seconds.
+    """
+
+    def __init__(self,
+                 generate_report: Callable[[int], str],
+                 result_store: ResultStore,
+                 workers: int = 2,
+                 ttl_seconds: float = 3600.,
+                 heartbeat_seconds: float = 10.,
+                 stale_seconds: float = 60.,
+                 expiry_seconds: float = 60.):
+        """
+        :param generate_report: function generating the report page for an athlete id
+        :param result_store: ResultStore the job status and finished pages are written to
+        :param workers: number of reports generated concurrently
+        :param ttl_seconds: time finished jobs are kept for, in seconds
+        :param heartbeat_seconds: interval between heartbeats of the queued and running jobs, in seconds
+        :param stale_seconds: time without a heartbeat after which an unfinished job is marked failed, in seconds
+        :param expiry_seconds: minimum interval between checks for expired jobs, in seconds
+        """
+        self.generate_report = generate_report
+        self.result_store = result_store
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.expiry_seconds = expiry_seconds
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.active_jobs: Dict[str, Job] = {}
+        # Held while the status of an active job is written, so a heartbeat never overwrites a newer status.
+        self.lock = threading.Lock()
+        self.last_expiry = None
+        self.stopped = threading.Event()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat, args=(heartbeat_seconds,), daemon=True)
+        self.heartbeat_thread.start()
+
+    def submit(self, athlete_id: int) -> Job:
+        self.expire_if_due()
+        job = Job(id=uuid.uuid4().hex, athlete_id=athlete_id, heartbeat_at=time.time())
+        with self.lock:
+            self.result_store.put_job(job)
+            self.active_jobs[job.id] = job
+
+        claimed_id = self.result_store.claim(job)
+        while claimed_id != job.id:
+            claimed_job = self.status(claimed_id)
+            if claimed_job is not None and not claimed_job.finished:
+                with self.lock:
+                    self.active_jobs.pop(job.id)
+                self.result_store.delete(job.id)
+                return claimed_job
+            # The claim is held by a finished, failed or expired job.
+            self.result_store.release(athlete_id, claimed_id)
+            claimed_id = self.result_store.claim(job)
+
+        self.executor.submit(self._run, job)
+        return job
+
+    def status(self, job_id: str) -> Union[Job, None]:
+        job = self.result_store.get_job(job_id)
+        if job is not None and self._is_stale(job):
+            job = self._fail_stale_job(job)
+        return job
+
+    def result(self, job_id: str) -> Union[str, None]:
+        job = self.status(job_id)
+        if job is None or job.status != COMPLETE:
+            return None
+        return self.result_store.get(job_id)
+
+    def expire_if_due(self):
+        """
+        Expire jobs, unless they were expired less than expiry_seconds ago.
+        """
+        with self.lock:
+            now = time.time()
+            if self.last_expiry is not None and now - self.last_expiry < self.expiry_seconds:
+                return
+            self.last_expiry = now
+        self.expire()
+
+    def expire(self):
+        """
+        Mark stale jobs failed, and delete the jobs that finished more than ttl_seconds ago, and their pages.
+        """
+        expired_before = time.time() - self.ttl_seconds
+        for job in self.result_store.jobs():
+            if self._is_stale(job):
+                job = self._fail_stale_job(job)
+            if job.finished and job.finished_at is not None and job.finished_at < expired_before:
+                self.result_store.delete(job.id)
+
+    def close(self):
+        """
+        Stop the heartbeat, and wait for the queued and running jobs to finish.
+        """
+        self.executor.shutdown(wait=True)
+        self.stopped.set()
+
+    def _is_stale(self, job: Job) -> bool:
+        return not job.finished and (job.heartbeat_at or 0.) < time.time() - self.stale_seconds
+
+    def _fail_stale_job(self, job: Job) -> Job:
+        logger.warning('report job stopped without finishing',
+                       extra={'fields': {'job_id': job.id, 'athlete_id': job.athlete_id}})
+        job.status = FAILED
+        job.error = 'job stopped without finishing'
+        job.finished_at = job.heartbeat_at or time.time()
+        self.result_store.put_job(job)
+        self.result_store.release(job.athlete_id, job.id)
+        return job
+
+    def _heartbeat(self, heartbeat_seconds: float):
+        while not self.stopped.wait(heartbeat_seconds):
+            with self.lock:
+                for job in self.active_jobs.values():
+                    job.heartbeat_at = time.time()
+                    self.result_store.put_job(job)
+
+    def _run(self, job: Job):
+        with self.lock:
+            job.status = RUNNING
+            job.heartbeat_at = time.time()
+            self.result_store.put_job(job)
+        try:
+            self.result_store.put(job.id, self.generate_report(job.athlete_id))
+            self._finish(job, COMPLETE)
+        except Exception as error:
+            logger.exception('report job failed', extra={'fields': {'job_id': job.id, 'athlete_id': job.athlete_id}})
+            self._finish(job, FAILED, error=str(error))
+
+    def _finish(self, job: Job, status: str, error: Union[str, None] = None):
+        with self.lock:
+            job.status = status
+            job.error = error
+            job.finished_at = time.time()
+            self.result_store.put_job(job)
+            self.active_jobs.pop(job.id, None)
+        self.result_store.release(job.athlete_id, job.id)
@@ -0,0 +1,162 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from stravaclient import StravaClient
+
+from src.strava.helpers import (Activity, ActivityCache, activities_from_json, iter_activity_pages,
+                                latest_start_timestamp, merge_activities)
+from src.summits.dedup import RouteDeduplicator
+from src.summits.parallel import ParallelSummitSearch
+from src.summits.spatial_index import SummitIndex
+from src.summits.store import VisitStore, empty_visits
+from src.summits.summits import SummitReference
+from src.summits.visited import (activity_extents, calculate_visits_batch, load_visit_history, merge_visit_history,
+                                 summarise_visits)
+
+
+def stream_summit_history(client: StravaClient,
+                          athlete_id: int,
+                          reference_source: SummitReference,
+                          summit_index: SummitIndex,
+                          visit_store: VisitStore,
+                          activity_cache: Union[ActivityCache, None] = None,
+                          max_in_flight: int = 4,
+                          workers: int = 2,
+                          exact: bool = False,
+                          summit_search: ParallelSummitSearch = None,
+                          current_activities: Union[List[Dict], None] = None,
+                          near_duplicate_distance: Union[float, None] = None) -> Tuple[List[Activity], pd.DataFrame]:
+    """
+    Download an athlete's activities and calculate their summit history as a streaming pipeline. Each page of
+    activities is decoded and searched for summit visits by a worker thread as soon as it arrives, while later pages
+    are still being downloaded. Cached activities are fed through the same pipeline ahead of the downloaded pages, and
+    only activities absent from the stored visit history are searched.
+
+    :param client: client exposing the Strava list activities endpoint
+    :param athlete_id: athlete whose summit history is calculated
+    :param reference_source: SummitReference datasource defining the summits
+    :param summit_index: SummitIndex built over reference_source
+    :param visit_store: VisitStore persisting the per-activity visits of each athlete
+    :param activity_cache: optional ActivityCache. If provided, only activities started after the most recent cached
+    activity are downloaded.
+    :param max_in_flight: maximum number of pages requested concurrently
+    :param workers: number of worker threads decoding pages and searching for summit visits
+    :param exact: if True, visits are found by exact distance to the route segments rather than by sampling points
+    :param summit_search: optional ParallelSummitSearch. If provided, the activities of each page are searched on its
+    worker processes rather than by the worker thread.
+    :param current_activities: optional activity JSON of all the athlete's activities, already brought up to date by
+    the caller, e.g. when checking for new activities. If provided, these are searched in place of the cached
+    activities, and nothing is downloaded.
+    :param near_duplicate_distance: optional grid spacing in metres. If provided, near duplicate routes are searched
+    once, see RouteDeduplicator. The visit history is then stored separately from that of searching every route.
+    :return: tuple containing the list of all the athlete's activities, and the summit reference pd.DataFrame with
+    first_visit, latest_visit and visit_count columns
+    """
+    history = load_visit_history(athlete_id=athlete_id,
+                                 reference_source=reference_source,
+                                 visit_store=visit_store,
+                                 exact=exact,
+                                 near_duplicate_distance=near_duplicate_distance)
+    download = current_activities is None
+    if download:
+        cached_activities = activity_cache.load(athlete_id) if activity_cache is not None else []
+    else:
+        cached_activities = current_activities
+    downloaded_activities = []
+
+    def pages() -> Iterator[List[Dict]]:
+        per_page = 200
+        for start in range(0, len(cached_activities), per_page):
+            yield cached_activities[start:start + per_page]
+        if not download:
+            return
+
+        for _, page in iter_activity_pages(client=client,
+                                           athlete_id=athlete_id,
+                                           per_page=per_page,
+                                           max_in_flight=max_in_flight,
+                                           after=latest_start_timestamp(cached_activities)):
+            downloaded_activities.extend(page)
+            yield page
+
+    activities, new_visits = process_activity_pages(pages=pages(),
+                                                    summit_index=summit_index,
+                                                    processed_activities=history.processed_activities,
+                                                    workers=workers,
+                                                    exact=exact,
+                                                    summit_search=summit_search,
+                                                    near_duplicate_distance=near_duplicate_distance)
+
+    if activity_cache is not None and downloaded_activities:
+        activity_cache.save(athlete_id, merge_activities(cached_activities, downloaded_activities))
+
+    history = merge_visit_history(athlete_id=athlete_id,
+                                  history=history,
+                                  activity_ids=np.array([activity.id for activity in activities], dtype='int64'),
+                                  new_visits=new_visits,
+                                  visit_store=visit_store,
+                                  activity_extents=activity_extents(activities))
+    return activities, summarise_visits(history.visits, reference_source)
+
+
+def process_activity_pages(pages: Iterable[List[Dict]],
+                           summit_index: SummitIndex,
+                           processed_activities: np.array,
+                           workers: int = 2,
+                           exact: bool = False,
+                           summit_search: ParallelSummitSearch = None,
+                           near_duplicate_distance: Union[float, None] = None) -> Tuple[List[Activity], pd.DataFrame]:
+    """
+    Decode pages of activity JSON and search them for summit visits on a pool of worker threads. The next page is only
+    taken from pages once a worker is free, so at most workers pages are held undecoded at any time. Routes are
+    deduplicated across pages, so a route repeated on many pages is searched once.
+
+    :param pages: iterable of pages of activity JSON dictionaries
+    :param summit_index: SummitIndex to query
+    :param processed_activities: ids of activities that have already been searched, and are decoded only
+    :param workers: number of worker threads
+    :param exact: if True, visits are found by exact distance to the route segments rather than by sampling points
+    :param summit_search: optional ParallelSummitSearch the activities are searched with
+    :param near_duplicate_distance: optional grid spacing in metres for near duplicate route matching
+    :return: tuple containing the list of decoded activities in page order, and a pd.DataFrame of the new visits
+    """
+    seen_activities = set()
+    deduplicator = RouteDeduplicator(near_duplicate_distance=near_duplicate_distance)
+    futures = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for page in pages:
+            # Drop activities repeated across pages, e.g. returned by both the cache and an overlapping download.
+            page = [activity for activity in page if activity['id'] not in seen_activities]
+            seen_activities.update(activity['id'] for activity in page)
+
+            pending = [future for future in futures if not future.done()]
+            if len(pending) >= workers:
+                wait(pending, return_when=FIRST_COMPLETED)
+            futures.append(executor.submit(process_activity_page, page, summit_index, processed_activities, exact,
+                                           summit_search, deduplicator))
+
+    results = [future.result() for future in futures]
+    activities = [activity for page_activities, _ in results for activity in page_activities]
+    visits = pd.concat([empty_visits()] + [page_visits for _, page_visits in results], ignore_index=True)
+    return activities, visits
+
+
+def process_activity_page(page: List[Dict],
+                          summit_index: SummitIndex,
+                          processed_activities: np.array,
+                          exact: bool = False,
+                          summit_search: ParallelSummitSearch = None,
+                          deduplicator: RouteDeduplicator = None) -> Tuple[List[Activity], pd.DataFrame]:
+    activities = activities_from_json(page)
+    processed = np.isin([activity.id for activity in activities], processed_activities)
+    new_activities = [activity for activity, seen in zip(activities, processed) if not seen]
+    if not new_activities:
+        return activities, empty_visits()
+    if summit_search is not None:
+        return activities, summit_search.calculate_visits(activities=new_activities, exact=exact,
+                                                          deduplicator=deduplicator)
+    return activities, calculate_visits_batch(activities=new_activities, summit_index=summit_index, exact=exact,
+                                              deduplicator=deduplicator)
@@ -0,0 +1,131 @@
+import logging
+from typing import Callable, Union
+
+from stravaclient import StravaClient
+
+from src.cache import ReportCache, activity_fingerprint
+from src.instrumentation import metrics, span
+from src.pipeline import stream_summit_history
+from src.strava.helpers import (ActivityCache, RouteStore, download_activity_pages, latest_start_timestamp,
+                                merge_activities)
+from src.summits.parallel import ParallelSummitSearch
+from src.summits.spatial_index import SummitIndex
+from src.summits.store import VisitStore
+from src.summits.summits import SummitReference
+from src.summits.visited import visit_history_version
+from src.visualisation.bar_chart import summarise_completion
+from src.visualisation.heatmap import TileCache, new_layer_name, render_heatmap_tiles
+from src.visualisation.map import plot_activities
+
+logger = logging.getLogger(__name__)
+
+
+class SummitReportGenerator:
+    """
+    Generates the summit report page of an athlete: downloads their activities, calculates their summit history, and
+    renders the map and completion report. Shared by the Flask app and the serverless handler, which differ only in
+    how templates are rendered and where state is stored.
+    """
+
+    def __init__(self,
+                 client: StravaClient,
+                 reference_source: SummitReference,
+                 summit_index: SummitIndex,
+                 visit_store: VisitStore,
+                 activity_cache: ActivityCache,
+                 report_cache: ReportCache,
+                 render_template: Callable[..., str],
+                 tile_cache: Union[TileCache, None] = None,
+                 heatmap_activity_threshold: int = 2000,
+                 summit_search: ParallelSummitSearch = None,
+                 near_duplicate_distance: Union[float, None] = None):
+        """
+        :param reference_source: SummitReference the report is built from, e.g. a CompactSummitReference
+        :param render_template: function rendering a named template with keyword arguments, e.g. flask.render_template
+        :param tile_cache: optional TileCache. If provided, athletes with more than heatmap_activity_threshold
+        activities are shown a server-rendered heatmap of their routes, served from /tiles, rather than the routes.
+        :param summit_search: optional ParallelSummitSearch the activities are searched with
+        :param near_duplicate_distance: optional grid spacing in metres. If provided, near duplicate routes, e.g.
+        repeated commutes recorded with slightly different GPS traces, are searched once. See RouteDeduplicator.
+        """
+        self.client = client
+        self.reference_source = reference_source
+        self.summit_index = summit_index
+        self.visit_store = visit_store
+        self.activity_cache = activity_cache
+        self.report_cache = report_cache
+        self.render_template = render_template
+        self.tile_cache = tile_cache
+        self.heatmap_activity_threshold = heatmap_activity_threshold
+        self.summit_search = summit_search
+        self.near_duplicate_distance = near_duplicate_distance
+
+    def generate(self, athlete_id: int) -> str:
+        reference_version = visit_history_version(self.reference_source, exact=True,
+                                                  near_duplicate_distance=self.near_duplicate_distance)
+        cached_activities = self.activity_cache.load(athlete_id)
+        current_activities = None
+        if cached_activities:
+            # Repeat visit: fetch only the activities added since the last report, and serve the cached page if
+            # nothing has changed. First visits skip this check and stream the download straight into summit
+            # detection. On a miss, the activities are already up to date, so the pipeline does not download again.
+            new_activities = download_activity_pages(client=self.client,
+                                                     athlete_id=athlete_id,
+                                                     after=latest_start_timestamp(cached_activities))
+            if new_activities:
+                cached_activities = merge_activities(cached_activities, new_activities)
+                self.activity_cache.save(athlete_id, cached_activities)
+            cached_page = self.report_cache.get(athlete_id, activity_fingerprint(cached_activities, reference_version))
+            if cached_page is not None:
+                metrics.increment('report_cache_hits')
+                logger.info('serving cached report', extra={'fields': {'athlete_id': athlete_id}})
+                return cached_page
+            current_activities = cached_activities
+
+        with span('summit_history', athlete_id=athlete_id) as history:
+            all_activities, dataset = stream_summit_history(client=self.client,
+                                                            athlete_id=athlete_id,
+                                                            reference_source=self.reference_source,
+                                                            summit_index=self.summit_index,
+                                                            visit_store=self.visit_store,
+                                                            activity_cache=self.activity_cache,
+                                                            exact=True,
+                                                            summit_search=self.summit_search,
+                                                            current_activities=current_activities,
+                                                            near_duplicate_distance=self.near_duplicate_distance)
+            history.items = len(all_activities)
+        athlete_data = self.client.get_athlete_info(athlete_id)
+        athlete_name = f"{athlete_data['firstname']} {athlete_data['lastname']}"
+        visited_summits = dataset.loc[dataset['latest_visit'].notnull()]
+        unvisited_summits = dataset.loc[dataset['latest_visit'].isnull()]
+
+        fingerprint = activity_fingerprint(self.activity_cache.load(athlete_id), reference_version)
+        heatmap_tiles = None
+        if self.tile_cache is not None and len(all_activities) > self.heatmap_activity_threshold:
+            # Tiles are rendered once per set of activities, under an unguessable layer name replacing the athlete's
+            # previous layer.
+            layer = self.tile_cache.athlete_layer(athlete_id, fingerprint)
+            if layer is None:
+                layer = new_layer_name()
+                with span('render_heatmap_tiles', athlete_id=athlete_id) as render:
+                    routes = RouteStore.from_routes([activity.route for activity in all_activities])
+                    render.items = render_heatmap_tiles(routes, tile_cache=self.tile_cache, layer=layer)
+                self.tile_cache.publish(athlete_id, fingerprint, layer)
+            heatmap_tiles = f'/tiles/{layer}/{{z}}/{{x}}/{{y}}.png'
+
+        with span('render_map', items=len(all_activities), athlete_id=athlete_id):
+            map = plot_activities(activities=all_activities,
+                                  visited_summits=visited_summits,
+                                  unvisited_summits=unvisited_summits,
+                                  geojson=True,
+                                  heatmap_tiles=heatmap_tiles)
+            map_html = map._repr_html_()
+        with span('render_report', athlete_id=athlete_id):
+            summary = summarise_completion(dataset)
+            page = self.render_template('/display.html',
+                                        athlete=athlete_name,
+                                        map=map_html,
+                                        report_df=summary.classifications.iloc[::-1],
+                                        summary=summary)
+        self.report_cache.put(athlete_id, fingerprint, page)
+        return page
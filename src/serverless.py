@@ -0,0 +1,229 @@
+"""
+AWS Lambda entry point, for running SummitMap behind API Gateway. Configure the function handler as
+src.serverless.handler.
+
+Only the standard library is imported at module level, so login and redirect requests do not pay for importing the
+rendering and scientific stacks. These are imported on the report path, together with the summit reference, and kept
+in module globals that are reused by later invocations of a warm container. Set SUMMITMAP_PRELOAD=1 to load them
+during the init phase instead, e.g. with provisioned concurrency.
+
+Requests may be served by different containers, so the athlete is identified between the authorisation callback and
+the report by a short-lived cookie signed with SUMMITMAP_TOKEN_SECRET, rather than by state held in a container.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from http.cookies import SimpleCookie
+from typing import Dict, List, Tuple, Union
+
+from src.instrumentation import configure_logging, span
+
+REFERENCE_DIRECTORY = os.environ.get('SUMMITMAP_REFERENCE_DIR', './database')
+# /tmp is the only writable location in a Lambda container, and does not outlive it.
+STATE_DIRECTORY = os.environ.get('SUMMITMAP_STATE_DIR', '/tmp')
+TEMPLATE_DIRECTORY = os.environ.get('SUMMITMAP_TEMPLATE_DIR', './templates')
+REDIRECT_URI = os.environ.get('SUMMITMAP_REDIRECT_URI', 'http://127.0.0.1:5000/')
+# Lifetime of the signed cookie identifying the athlete, which must cover the refreshes of a slow report.
+TOKEN_TTL_SECONDS = int(os.environ.get('SUMMITMAP_TOKEN_TTL', 600))
+# API Gateway ends requests after 29 seconds. A report that takes longer is left generating, and a page that refreshes
+# until it is ready is returned instead.
+REPORT_TIMEOUT_SECONDS = float(os.environ.get('SUMMITMAP_REPORT_TIMEOUT', 25))
+# Time left to return the response before the Lambda function's own timeout.
+DEADLINE_MARGIN_SECONDS = 2.
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+_token_secret = os.environ.get('SUMMITMAP_TOKEN_SECRET', '').encode()
+if not _token_secret:
+    logger.warning('SUMMITMAP_TOKEN_SECRET is not set, so tokens are only valid within the container that issued them')
+    _token_secret = os.urandom(32)
+
+# Reused by warm invocations.
+_client = None
+_report_generator = None
+_templates = None
+_report_executor = None
+_reports_in_progress: Dict[int, Future] = {}
+
+PENDING_PAGE = '''<!DOCTYPE html>
+<html>
+<head><meta http-equiv="refresh" content="3"><title>SummitMap</title></head>
+<body><p>Generating your summit map...</p></body>
+</html>'''
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from src.strava.client import create_strava_client
+        _client = create_strava_client()
+    return _client
+
+
+def get_report_generator():
+    """
+    Import the report stack and load the summit reference and its index, once per container.
+    """
+    global _report_generator
+    if _report_generator is None:
+        with span('load_report_stack'):
+            from src.cache import ReportCache
+            from src.report import SummitReportGenerator
+            from src.summits.compact import CompactSummitReference
+            from src.strava.helpers import LocalFileActivityCache
+            from src.summits.spatial_index import SummitIndex
+            from src.summits.store import LocalFileVisitStore
+            from src.summits.summits import MemoryMappedSummitReference
+
+            reference_source = MemoryMappedSummitReference(REFERENCE_DIRECTORY)
+            _report_generator = SummitReportGenerator(
+                client=get_client(),
+                reference_source=CompactSummitReference(reference_source),
+                summit_index=SummitIndex(reference_source),
+                visit_store=LocalFileVisitStore(os.path.join(STATE_DIRECTORY, 'visit_store')),
+                activity_cache=LocalFileActivityCache(os.path.join(STATE_DIRECTORY, 'activity_cache')),
+                report_cache=ReportCache(max_memory_bytes=32 * 1024 ** 2,
+                                         directory=os.path.join(STATE_DIRECTORY, 'report_cache'),
+                                         max_disk_bytes=256 * 1024 ** 2),
+                render_template=render_template)
+    return _report_generator
+
+
+def render_template(name: str, **context) -> str:
+    global _templates
+    if _templates is None:
+        import jinja2
+        _templates = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE_DIRECTORY),
+                                        autoescape=jinja2.select_autoescape())
+    return _templates.get_template(name.lstrip('/')).render(**context)
+
+
+def issue_token(athlete_id: int) -> str:
+    """
+    Return a token identifying the athlete for TOKEN_TTL_SECONDS, signed so that any container can verify it.
+    """
+    payload = f'{athlete_id}.{int(time.time()) + TOKEN_TTL_SECONDS}'
+    return f'{payload}.{_sign(payload)}'
+
+
+def resolve_token(token: Union[str, None]) -> Union[int, None]:
+    """
+    Return the athlete ID of a token issued by issue_token, or None if the token is missing, forged or expired.
+    """
+    payload, _, signature = (token or '').rpartition('.')
+    if not payload or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    athlete_id, expires = payload.split('.')
+    if int(expires) < time.time():
+        return None
+    return int(athlete_id)
+
+
+def _sign(payload: str) -> str:
+    return hmac.new(_token_secret, payload.encode(), hashlib.sha256).hexdigest()
+
+
+def handler(event: Dict, context) -> Dict:
+    """
+    Handle an API Gateway proxy event, with either the REST API (1.0) or HTTP API (2.0) payload format. Mirrors the
+    / route of the Flask app, except that reports are generated by the container serving the request rather than on
+    a job queue.
+    """
+    path, query, cookies = _parse_event(event)
+    if path != '/':
+        return _response(event, 404, 'Not found')
+
+    authentication_requested = query.get('authorise') == 'true'
+    authorisation_code = query.get('code')
+    athlete_id = resolve_token(cookies.get('ott'))
+
+    if athlete_id is not None:
+        page = _wait_for_report(athlete_id, context)
+        if page is None:
+            # The token cookie is kept, so that the refresh finds the report.
+            return _response(event, 200, PENDING_PAGE)
+        return _response(event, 200, page, cookies=['ott=; Max-Age=0'])
+
+    if not authentication_requested and authorisation_code is None:
+        return _response(event, 200, render_template('login.html', login=True))
+
+    if authentication_requested:
+        url = get_client().authorisation.generate_authorisation_url(
+            redirect_uri=REDIRECT_URI,
+            scope='read_all,activity:read_all,activity:write')
+        return _response(event, 302, '', headers={'Location': url})
+
+    athlete_id = get_client().authorisation.post_athlete_auth_code(authorisation_code)
+    logger.info('athlete authenticated', extra={'fields': {'athlete_id': athlete_id}})
+    cookie = f'ott={issue_token(athlete_id)}; Max-Age={TOKEN_TTL_SECONDS}; HttpOnly; SameSite=Lax'
+    if REDIRECT_URI.startswith('https://'):
+        cookie += '; Secure'
+    return _response(event, 200, render_template('login.html'), cookies=[cookie])
+
+
+def _wait_for_report(athlete_id: int, context) -> Union[str, None]:
+    """
+    Generate the athlete's report on a background thread, and wait for it until REPORT_TIMEOUT_SECONDS, or shortly
+    before the Lambda function times out. Returns None if the report is not ready by then. Lambda freezes the container
+    between invocations, so the thread carries on during later invocations of this container, and a refresh served by
+    it waits for the same report.
+    """
+    global _report_executor
+    if _report_executor is None:
+        _report_executor = ThreadPoolExecutor(max_workers=1)
+    future = _reports_in_progress.get(athlete_id)
+    if future is None:
+        logger.info('generating map', extra={'fields': {'athlete_id': athlete_id}})
+        future = _reports_in_progress[athlete_id] = _report_executor.submit(_generate_report, athlete_id)
+
+    timeout = REPORT_TIMEOUT_SECONDS
+    if context is not None:
+        timeout = min(timeout, context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN_SECONDS)
+    try:
+        return future.result(timeout=max(timeout, 0.))
+    except TimeoutError:
+        logger.info('report still generating', extra={'fields': {'athlete_id': athlete_id}})
+        return None
+    finally:
+        if future.done():
+            _reports_in_progress.pop(athlete_id, None)
+
+
+def _generate_report(athlete_id: int) -> str:
+    with span('report', athlete_id=athlete_id):
+        return get_report_generator().generate(athlete_id)
+
+
+def _parse_event(event: Dict) -> Tuple[str, Dict[str, str], Dict[str, str]]:
+    path = event.get('rawPath') or event.get('path') or '/'
+    query = event.get('queryStringParameters') or {}
+    cookie = SimpleCookie()
+    if event.get('version') == '2.0':
+        cookie.load('; '.join(event.get('cookies') or []))
+    else:
+        headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+        cookie.load(headers.get('cookie', ''))
+    return path, query, {key: morsel.value for key, morsel in cookie.items()}
+
+
+def _response(event: Dict, status_code: int, body: str, headers: Dict[str, str] = None,
+              cookies: List[str] = None) -> Dict:
+    response = {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'text/html; charset=utf-8', **(headers or {})},
+        'body': body,
+    }
+    if cookies:
+        if event.get('version') == '2.0':
+            response['cookies'] = cookies
+        else:
+            response['multiValueHeaders'] = {'Set-Cookie': cookies}
+    return response
+
+
+if os.environ.get('SUMMITMAP_PRELOAD') == '1':
+    get_report_generator()
@@ -0,0 +1,57 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+def decode_polylines(polyline_strs: List[str], precision: int = 5) -> Tuple[np.array, np.array, np.array]:
+    """
+    Decode many Google encoded polylines in a single vectorised pass, directly into contiguous coordinate buffers. See
+    https://developers.google.com/maps/documentation/utilities/polylinealgorithm for details of the format.
+
+    Each encoded value is a run of 5-bit chunks offset by 63, with the 0x20 bit set on every chunk except the last.
+    The characters of all polylines are concatenated and the chunk runs are reduced with np.add.reduceat, giving a
+    zigzag encoded delta for each latitude and longitude. Deltas are then accumulated per polyline.
+
+    :param polyline_strs: list of encoded polylines
+    :param precision: number of decimal places encoded
+    :return: tuple containing the latitude and longitude coordinates of every polyline concatenated in order, and an
+    offsets array such that polyline i occupies offsets[i]:offsets[i + 1]
+    """
+    char_offsets = np.zeros(len(polyline_strs) + 1, dtype='int64')
+    np.cumsum([len(polyline_str) for polyline_str in polyline_strs], out=char_offsets[1:])
+    # 32-bit arithmetic is sufficient: a coordinate at precision 5 is encoded in at most 6 chunks, or 30 bits.
+    chunks = np.frombuffer(''.join(polyline_strs).encode('ascii'), dtype=np.uint8).astype('int32') - 63
+
+    terminators = (chunks & 0x20) == 0
+    terminator_count = np.zeros(len(chunks) + 1, dtype='int64')
+    np.cumsum(terminators, out=terminator_count[1:])
+
+    # Each polyline encodes a latitude and longitude value per point.
+    point_offsets = terminator_count[char_offsets] // 2
+    if not len(chunks) or not point_offsets[-1]:
+        return np.array([]), np.array([]), point_offsets
+
+    value_starts = np.concatenate([[0], np.flatnonzero(terminators)[:-1] + 1])
+    chunk_position = (np.arange(len(chunks)) - value_starts[terminator_count[:-1]]).astype('int32')
+    values = np.add.reduceat((chunks & 0x1f) << (5 * chunk_position), value_starts).astype('int64')
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    points_per_polyline = np.diff(point_offsets)
+    latitude = _cumsum_per_polyline(deltas[0::2], point_offsets, points_per_polyline)
+    longitude = _cumsum_per_polyline(deltas[1::2], point_offsets, points_per_polyline)
+    factor = 10 ** precision
+    return latitude / factor, longitude / factor, point_offsets
+
+
+def decode_polyline(polyline_str: str, precision: int = 5) -> Tuple[np.array, np.array]:
+    """
+    Decode a single Google encoded polyline into latitude and longitude arrays.
+    """
+    latitude, longitude, _ = decode_polylines([polyline_str], precision=precision)
+    return latitude, longitude
+
+
+def _cumsum_per_polyline(deltas: np.array, point_offsets: np.array, points_per_polyline: np.array) -> np.array:
+    total = np.zeros(len(deltas) + 1, dtype='int64')
+    np.cumsum(deltas, out=total[1:])
+    return total[1:] - np.repeat(total[point_offsets[:-1]], points_per_polyline)
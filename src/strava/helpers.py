@@ -1,35 +1,124 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import pandas as pd
 from stravaclient import StravaClient
-from typing import List, Dict
+from typing import List, Dict, Iterator, Protocol, Tuple, Union
 import numpy as np
 from scipy.interpolate import interp1d
 import polyline
+from src.instrumentation import span
+from src.strava.decoding import decode_polyline, decode_polylines
+from src.summits.locator import haversine_distance
 from dataclasses import dataclass
 import datetime as dt
 
+logger = logging.getLogger(__name__)
+
+
+class Route:
+    """
+    Lightweight view of the coordinates of a single route. Routes decoded in bulk share the buffers of a RouteStore.
+    """
+    __slots__ = ('latitude', 'longitude')
 
-class Route(pd.DataFrame):
     def __init__(self, lat: np.array, lng: np.array):
-        super(Route, self).__init__(data={
-            'lat': lat,
-            'lng': lng
-        })
+        self.latitude = np.asarray(lat, dtype=float)
+        self.longitude = np.asarray(lng, dtype=float)
+
+    def __len__(self):
+        return len(self.latitude)
 
     @property
-    def latitude(self):
-        return self['lat'].values
+    def coordinates(self) -> np.array:
+        return np.column_stack([self.latitude, self.longitude])
+
+    @classmethod
+    def from_polyline(cls, polyline_str: str):
+        lat, lng = decode_polyline(polyline_str)
+        return Route(lat=lat, lng=lng)
+
+
+class RouteStore:
+    """
+    Columnar storage for many routes: the coordinates of every route are held in one contiguous latitude buffer and
+    one contiguous longitude buffer, with route i occupying offsets[i]:offsets[i + 1].
+    """
+    __slots__ = ('latitude', 'longitude', 'offsets')
+
+    def __init__(self, latitude: np.array, longitude: np.array, offsets: np.array):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> Route:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return Route(lat=self.latitude[start:end], lng=self.longitude[start:end])
+
+    def __iter__(self) -> Iterator[Route]:
+        return (self[index] for index in range(len(self)))
 
     @property
-    def longitude(self):
-        return self['lng'].values
+    def lengths(self) -> np.array:
+        return np.diff(self.offsets)
+
+    def segments(self) -> Tuple[np.array, np.array, np.array]:
+        """
+        Index the line segments between consecutive points of each route. A route with a single point is represented
+        by a zero length segment, so it can still be searched.
+
+        :return: tuple containing the start and end point indices of each segment, and the route index of each segment
+        """
+        route_index = np.repeat(np.arange(len(self)), self.lengths)
+        starts = np.flatnonzero(route_index[:-1] == route_index[1:])
+        single_points = self.offsets[:-1][self.lengths == 1]
+        starts = np.sort(np.concatenate([starts, single_points]))
+        ends = np.where(np.isin(starts, single_points), starts, starts + 1)
+        return starts, ends, route_index[starts]
+
+    def take(self, indices: np.array) -> 'RouteStore':
+        """
+        Return a RouteStore holding a copy of the routes at the given indices, in order.
+        """
+        lengths = self.lengths[indices]
+        offsets = np.zeros(len(lengths) + 1, dtype='int64')
+        np.cumsum(lengths, out=offsets[1:])
+        points = np.repeat(self.offsets[:-1][indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return RouteStore(latitude=self.latitude[points], longitude=self.longitude[points], offsets=offsets)
+
+    def extents(self) -> np.array:
+        """
+        Bounding box of each route, as an (n_routes x 4) array of minimum latitude, maximum latitude, minimum
+        longitude and maximum longitude. Empty routes have NaN extents.
+        """
+        extents = np.full((len(self), 4), np.nan)
+        # reduceat cannot reduce empty ranges, so reduce over the non-empty routes only.
+        non_empty = self.lengths > 0
+        starts = self.offsets[:-1][non_empty]
+        if len(starts):
+            extents[non_empty] = np.column_stack([np.minimum.reduceat(self.latitude, starts),
+                                                  np.maximum.reduceat(self.latitude, starts),
+                                                  np.minimum.reduceat(self.longitude, starts),
+                                                  np.maximum.reduceat(self.longitude, starts)])
+        return extents
+
+    @classmethod
+    def from_routes(cls, routes: List[Route]) -> 'RouteStore':
+        offsets = np.zeros(len(routes) + 1, dtype='int64')
+        np.cumsum([len(route) for route in routes], out=offsets[1:])
+        return RouteStore(latitude=np.concatenate([route.latitude for route in routes] + [np.array([])]),
+                          longitude=np.concatenate([route.longitude for route in routes] + [np.array([])]),
+                          offsets=offsets)
 
     @classmethod
-    def from_polyline(cls, polyline_str: Dict):
-        coords = np.array(polyline.decode(polyline_str)).T
-        if len(coords) == 2:
-            return Route(lat=coords[0], lng=coords[1])
-        else:
-            return Route(lat=np.array([]), lng=np.array([]))
+    def from_polylines(cls, polyline_strs: List[str]) -> 'RouteStore':
+        latitude, longitude, offsets = decode_polylines(polyline_strs)
+        return RouteStore(latitude=latitude, longitude=longitude, offsets=offsets)
 
 
 @dataclass
@@ -51,43 +140,228 @@ class Activity:
                         elapsed_time=strava_activity['elapsed_time'])
 
 
-def download_all_activities(client: StravaClient, athlete_id: int) -> List[Activity]:
-    all_activities = []
-    page = 1
-    end = False
+def activities_from_json(strava_activities: List[Dict]) -> List[Activity]:
+    """
+    Convert a list of Strava activity JSON dictionaries to Activities, decoding every route into a single RouteStore
+    so the activities share contiguous coordinate buffers.
+    """
+    with span('decode', items=len(strava_activities)):
+        routes = RouteStore.from_polylines([activity['map']['summary_polyline'] for activity in strava_activities])
+        dates = pd.to_datetime([activity['start_date'] for activity in strava_activities])
+        return [Activity(id=strava_activity['id'],
+                         date=date,
+                         route=route,
+                         distance=strava_activity['distance'],
+                         moving_time=strava_activity['moving_time'],
+                         elapsed_time=strava_activity['elapsed_time'])
+                for strava_activity, date, route in zip(strava_activities, dates, routes)]
+
+
+class ActivityCache(Protocol):
+    def load(self, athlete_id: int) -> List[Dict]:
+        pass
+
+    def save(self, athlete_id: int, activities: List[Dict]):
+        pass
+
+
+class LocalFileActivityCache:
+    """
+    Stores the raw activity JSON downloaded for each athlete as a JSON file in a local directory.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def load(self, athlete_id: int) -> List[Dict]:
+        filepath = self._filepath(athlete_id)
+        if not os.path.exists(filepath):
+            return []
+        with open(filepath, 'r') as f:
+            return json.load(f)
+
+    def save(self, athlete_id: int, activities: List[Dict]):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_filepath = f'{self._filepath(athlete_id)}.tmp'
+        with open(temporary_filepath, 'w') as f:
+            json.dump(activities, f)
+        os.replace(temporary_filepath, self._filepath(athlete_id))
+
+    def _filepath(self, athlete_id: int) -> str:
+        return os.path.join(self.directory, f'{athlete_id}.json')
+
+
+def download_all_activities(client: StravaClient,
+                            athlete_id: int,
+                            max_in_flight: int = 4,
+                            activity_cache: Union[ActivityCache, None] = None) -> List[Activity]:
+    """
+    Download every activity belonging to an athlete.
 
-    while not end:
-        print(f'requesting page {page}')
-        activities = client.list_activities(athlete_id=athlete_id,
-                                            page=page,
-                                            per_page=200)
+    :param client: client exposing the Strava list activities endpoint
+    :param athlete_id: athlete whose activities are downloaded
+    :param max_in_flight: maximum number of pages requested concurrently
+    :param activity_cache: optional ActivityCache. If provided, only activities started after the most recent cached
+    activity are downloaded, and the cache is updated with them.
+    :return: list of all the athlete's activities
+    """
+    cached_activities = activity_cache.load(athlete_id) if activity_cache is not None else []
+    new_activities = download_activity_pages(client=client,
+                                             athlete_id=athlete_id,
+                                             max_in_flight=max_in_flight,
+                                             after=latest_start_timestamp(cached_activities))
 
-        if not len(activities):
-            end = True
-        else:
-            all_activities += activities
-            page += 1
+    all_activities = merge_activities(cached_activities, new_activities)
+    if activity_cache is not None and new_activities:
+        activity_cache.save(athlete_id, all_activities)
 
-    final_activities = []
-    for activity in all_activities:
-        final_activities.append(Activity.from_json(activity))
+    return activities_from_json(all_activities)
 
-    return final_activities
+
+def latest_start_timestamp(activities: List[Dict]) -> Union[int, None]:
+    """
+    Epoch timestamp of the most recent activity start, or None if there are no activities.
+    """
+    if not activities:
+        return None
+    return int(pd.to_datetime([activity['start_date'] for activity in activities]).max().timestamp())
+
+
+def merge_activities(cached_activities: List[Dict], new_activities: List[Dict]) -> List[Dict]:
+    # Key by id so that activities returned again by an overlapping request are not duplicated.
+    return list({activity['id']: activity for activity in cached_activities + new_activities}.values())
+
+
+def download_activity_pages(client: StravaClient,
+                            athlete_id: int,
+                            per_page: int = 200,
+                            max_in_flight: int = 4,
+                            after: Union[int, None] = None) -> List[Dict]:
+    """
+    Request pages of activities concurrently, keeping up to max_in_flight requests outstanding until a page shorter
+    than per_page marks the end of the athlete's activities.
+
+    :param client: client exposing the Strava list activities endpoint
+    :param athlete_id: athlete whose activities are downloaded
+    :param per_page: number of activities requested per page
+    :param max_in_flight: maximum number of pages requested concurrently
+    :param after: optional epoch timestamp. If provided, only activities started after it are requested.
+    :return: list of activity JSON dictionaries, in page order
+    """
+    pages = dict(iter_activity_pages(client=client,
+                                     athlete_id=athlete_id,
+                                     per_page=per_page,
+                                     max_in_flight=max_in_flight,
+                                     after=after))
+    return [activity for page in sorted(pages) for activity in pages[page]]
+
+
+def iter_activity_pages(client: StravaClient,
+                        athlete_id: int,
+                        per_page: int = 200,
+                        max_in_flight: int = 4,
+                        after: Union[int, None] = None) -> Iterator[Tuple[int, List[Dict]]]:
+    """
+    Generator version of download_activity_pages, yielding (page number, activities) pairs in the order the requests
+    complete. New requests are only submitted while the generator is being consumed, so a slow consumer holds at most
+    max_in_flight pages in memory.
+    """
+    last_page = None
+    next_page = 1
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight = {}
+        while True:
+            while len(in_flight) < max_in_flight and (last_page is None or next_page <= last_page):
+                future = executor.submit(request_activity_page, client, athlete_id, next_page, per_page, after)
+                in_flight[future] = next_page
+                next_page += 1
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = in_flight.pop(future)
+                activities = future.result()
+                if len(activities) < per_page and (last_page is None or page < last_page):
+                    last_page = page
+                if activities:
+                    yield page, activities
+
+
+def request_activity_page(client: StravaClient,
+                          athlete_id: int,
+                          page: int,
+                          per_page: int,
+                          after: Union[int, None] = None,
+                          max_retries: int = 5) -> List[Dict]:
+    """
+    Request a single page of activities, backing off and retrying when the request is rate limited or fails with a
+    server error.
+    """
+    kwargs = {} if after is None else {'after': after}
+    for attempt in range(max_retries + 1):
+        try:
+            with span('download_page', athlete_id=athlete_id, page=page, attempt=attempt) as download:
+                activities = client.list_activities(athlete_id=athlete_id,
+                                                    page=page,
+                                                    per_page=per_page,
+                                                    **kwargs)
+                download.items = len(activities)
+            return activities
+        except Exception as error:
+            delay = retry_delay(error, attempt)
+            if delay is None or attempt == max_retries:
+                raise
+            logger.warning('page request failed, retrying',
+                           extra={'fields': {'athlete_id': athlete_id, 'page': page, 'delay_seconds': delay}})
+            time.sleep(delay)
+
+
+def retry_delay(error: Exception, attempt: int, backoff: float = 1.) -> Union[float, None]:
+    """
+    Determine how long to wait before retrying a failed request, using the Strava rate limit headers where available.
+    Strava enforces a short term limit per 15 minutes and a long term limit per day, reported as comma separated
+    values in the X-RateLimit-Limit and X-RateLimit-Usage headers.
+
+    :param error: exception raised by the request
+    :param attempt: number of previous retries
+    :param backoff: base delay in seconds for exponential backoff
+    :return: delay in seconds, or None if the request should not be retried
+    """
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is None or (status_code != 429 and status_code < 500):
+        return None
+
+    headers = getattr(response, 'headers', {}) or {}
+    if 'Retry-After' in headers:
+        return float(headers['Retry-After'])
+
+    if status_code == 429 and 'X-RateLimit-Limit' in headers and 'X-RateLimit-Usage' in headers:
+        short_limit, long_limit = (int(value) for value in headers['X-RateLimit-Limit'].split(','))
+        short_usage, long_usage = (int(value) for value in headers['X-RateLimit-Usage'].split(','))
+        if long_usage >= long_limit:
+            return None
+        if short_usage >= short_limit:
+            # Short term limits reset at natural 15-minute intervals.
+            return 900 - time.time() % 900
+
+    return backoff * 2 ** attempt
 
 
 def extract_polyline(strava_activity: Dict) -> pd.DataFrame:
     return pd.DataFrame(polyline.decode(strava_activity['map']['summary_polyline']), columns=['lat', 'lng'])
 
 
-def interpolate_polyline(route_df: pd.DataFrame, interpolation_points: int) -> pd.DataFrame:
-    route_df = route_df.drop_duplicates()
-    if len(route_df) < 2:
-        return pd.DataFrame(columns=['lat', 'lng'])
-
-    route_df = route_df.drop_duplicates()
-    # Define some points:
-    points = np.array([route_df['lat'].values,
-                       route_df['lng'].values]).T  # a (no_points x no_dim) array
+def interpolate_polyline(route: Route, interpolation_points: int) -> Route:
+    points = route.coordinates
+    # Remove repeated coordinates, retaining the first occurrence of each in route order.
+    _, first_occurrences = np.unique(points, axis=0, return_index=True)
+    points = points[np.sort(first_occurrences)]
+    if len(points) < 2:
+        return Route(lat=np.array([]), lng=np.array([]))
 
     # Linear length along the line:
     distance = np.cumsum(np.sqrt(np.sum(np.diff(points, axis=0) ** 2, axis=1)))
@@ -96,4 +370,39 @@ def interpolate_polyline(route_df: pd.DataFrame, interpolation_points: int) -> p
     alpha = np.linspace(0, 1, interpolation_points)
     interpolator = interp1d(distance, points, kind='slinear', axis=0)
     interpolated_points = interpolator(alpha)
-    return pd.DataFrame(interpolated_points, columns=['lat', 'lng'])
+    return Route(lat=interpolated_points[:, 0], lng=interpolated_points[:, 1])
+
+
+def densify_routes(routes: RouteStore, spacing: float) -> RouteStore:
+    """
+    Insert evenly spaced points along every route segment longer than spacing, so that consecutive points are never
+    more than spacing metres apart. Segment lengths are great circle distances, and all routes are densified in a
+    single array pass. Existing points are retained, so segments already shorter than spacing are left untouched.
+
+    :param routes: RouteStore of routes to densify
+    :param spacing: maximum distance in metres between consecutive points
+    :return: RouteStore of the densified routes
+    """
+    latitude, longitude, offsets = routes.latitude, routes.longitude, routes.offsets
+    if len(latitude) < 2:
+        return routes
+
+    segment_lengths = haversine_distance(np.radians(longitude[:-1]), np.radians(latitude[:-1]),
+                                         np.radians(longitude[1:]), np.radians(latitude[1:]))
+    inserted_points = np.ceil(segment_lengths / spacing).astype('int64') - 1
+    inserted_points = np.append(np.maximum(inserted_points, 0), 0)
+    # The segment from the last point of one route to the first point of the next does not exist.
+    inserted_points[offsets[1:-1][offsets[1:-1] > 0] - 1] = 0
+
+    points_per_source = inserted_points + 1
+    output_offsets = np.zeros(len(latitude) + 1, dtype='int64')
+    np.cumsum(points_per_source, out=output_offsets[1:])
+
+    source = np.repeat(np.arange(len(latitude)), points_per_source)
+    step = np.arange(output_offsets[-1]) - output_offsets[source]
+    fraction = step / points_per_source[source]
+    following = np.minimum(source + 1, len(latitude) - 1)
+
+    return RouteStore(latitude=latitude[source] + fraction * (latitude[following] - latitude[source]),
+                      longitude=longitude[source] + fraction * (longitude[following] - longitude[source]),
+                      offsets=output_offsets[offsets])
@@ -0,0 +1,99 @@
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.summits.summits import SummitReference
+
+CLASSES_COLUMN = 'classes'
+# Summit classifications, named by their flag column in the summit reference.
+CLASSIFICATIONS = ['W', 'F', 'D', 'G', 'C', 'M']
+# Bit of each classification in the classes bitmask, in the order of CLASSIFICATIONS.
+CLASSIFICATION_BITS = {classification: np.uint8(1 << bit) for bit, classification in enumerate(CLASSIFICATIONS)}
+
+
+def classification_bitmask(df: pd.DataFrame) -> np.array:
+    """
+    Return the classifications of each summit as a uint8 bitmask, read from the classes column of a compact summit
+    DataFrame, or built from the classification flag columns of the summit reference.
+    """
+    if CLASSES_COLUMN in df.columns:
+        return df[CLASSES_COLUMN].to_numpy(dtype=np.uint8)
+    bitmask = np.zeros(len(df), dtype=np.uint8)
+    for classification, bit in CLASSIFICATION_BITS.items():
+        bitmask[df[classification].to_numpy() == 1] |= bit
+    return bitmask
+
+
+def classification_flags(df: pd.DataFrame) -> np.array:
+    """
+    Return the classifications of each summit as an (n_summits x n_classifications) boolean matrix, with columns in
+    the order of CLASSIFICATIONS.
+    """
+    bits = np.array(list(CLASSIFICATION_BITS.values()), dtype=np.uint8)
+    return (classification_bitmask(df)[:, np.newaxis] & bits) > 0
+
+
+def classification_indices(df: pd.DataFrame) -> Dict[str, np.array]:
+    """
+    Return the row positions of the summits of each classification.
+    """
+    bitmask = classification_bitmask(df)
+    return {classification: np.flatnonzero(bitmask & bit) for classification, bit in CLASSIFICATION_BITS.items()}
+
+
+def compact_summits(df: pd.DataFrame,
+                    latitude_column: str = 'Latitude',
+                    longitude_column: str = 'Longitude',
+                    altitude_column: str = 'Metres') -> pd.DataFrame:
+    """
+    Convert a summit reference DataFrame to a compact form: the classification flag columns are replaced by a uint8
+    classes bitmask, coordinates are stored as float32, heights as int16 and names as a categorical. Other columns are
+    kept as they are. float32 coordinates are precise to within a metre, so are suitable for display but not for
+    summit detection.
+    """
+    compact = df.drop(columns=[column for column in ['index', *CLASSIFICATION_BITS] if column in df.columns])
+    compact[CLASSES_COLUMN] = classification_bitmask(df)
+    compact[latitude_column] = df[latitude_column].to_numpy(dtype=np.float32)
+    compact[longitude_column] = df[longitude_column].to_numpy(dtype=np.float32)
+    compact[altitude_column] = np.round(df[altitude_column].to_numpy(dtype=float)).astype(np.int16)
+    compact['Name'] = df['Name'].astype('category')
+    return compact.reset_index(drop=True)
+
+
+class CompactSummitReference:
+    """
+    SummitReference holding a compact copy of another reference in memory, as converted by compact_summits. It shares
+    the version of the reference it was loaded from, so visit histories computed against one are valid for the other.
+
+    Use it to build reports. Summit detection should use the full precision reference the copy was loaded from.
+    """
+
+    def __init__(self, reference_source: SummitReference):
+        self.reference_source = reference_source
+        self.altitude_column = reference_source.altitude_column
+        self.latitude_column = reference_source.latitude_column
+        self.longitude_column = reference_source.longitude_column
+        self.df = compact_summits(reference_source.load(),
+                                  latitude_column=self.latitude_column,
+                                  longitude_column=self.longitude_column,
+                                  altitude_column=self.altitude_column)
+
+    @property
+    def version(self) -> str:
+        return self.reference_source.version
+
+    def load(self,
+             latitude_window: Tuple[float, float] = None,
+             longitude_window: Tuple[float, float] = None) -> pd.DataFrame:
+        if latitude_window is None and longitude_window is None:
+            return self.df.copy(deep=False)
+
+        keep = np.ones(len(self.df), dtype=bool)
+        if latitude_window is not None:
+            latitude = self.df[self.latitude_column].to_numpy()
+            keep &= (latitude >= latitude_window[0]) & (latitude <= latitude_window[1])
+        if longitude_window is not None:
+            longitude = self.df[self.longitude_column].to_numpy()
+            keep &= (longitude >= longitude_window[0]) & (longitude <= longitude_window[1])
+        return self.df.loc[keep]
@@ -0,0 +1,129 @@
+import hashlib
+import threading
+from typing import Callable, Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+from src.instrumentation import metrics
+from src.strava.helpers import RouteStore
+
+METRES_PER_DEGREE = 111320
+
+# Searches a RouteStore for summit visits, given the activity id and date of each route, as find_route_visits.
+RouteSearch = Callable[[RouteStore, np.array, pd.DatetimeIndex], pd.DataFrame]
+
+
+class RouteDeduplicator:
+    """
+    Searches each unique route once, however many activities repeat it, e.g. a daily commute. The summits visited by
+    every unique route searched so far are remembered, so a deduplicator shared between batches, such as the pages of a
+    streamed download, also skips routes repeated across batches. Thread safe.
+
+    By default, routes are keyed by a hash of their coordinates. These are decoded from the summary polyline, so two
+    activities share a key exactly when their polylines encode the same track, and their visits are identical to
+    searching each separately. If near_duplicate_distance is given, routes are instead keyed by their start point, end
+    point and bounding box, quantised to a grid of that spacing, which also matches repeats recorded with slightly
+    different GPS traces. Longitudes are scaled by the cosine of the route's mean latitude, rounded to a whole degree so
+    that near duplicates share a scale, so cells span roughly near_duplicate_distance in both directions. This is
+    approximate: different routes sharing endpoints and extent are given the visits of whichever was searched first.
+    """
+
+    def __init__(self, near_duplicate_distance: Union[float, None] = None):
+        """
+        :param near_duplicate_distance: optional grid spacing in metres for near duplicate matching
+        """
+        self.near_duplicate_distance = near_duplicate_distance
+        self.summits: Dict[bytes, np.array] = {}
+        self.lock = threading.Lock()
+
+    def route_keys(self, routes: RouteStore) -> List[bytes]:
+        """
+        Key each route of a RouteStore, such that duplicate routes share a key.
+        """
+        if self.near_duplicate_distance is None:
+            return [hashlib.blake2b(routes.latitude[start:end].tobytes() + routes.longitude[start:end].tobytes(),
+                                    digest_size=16).digest()
+                    for start, end in zip(routes.offsets[:-1], routes.offsets[1:])]
+
+        # reduceat cannot reduce empty ranges, so reduce over the non-empty routes; empty routes share the empty key.
+        non_empty = routes.lengths > 0
+        starts, ends = routes.offsets[:-1][non_empty], routes.offsets[1:][non_empty] - 1
+        features = np.zeros((0, 8))
+        if len(starts):
+            mean_latitude = np.add.reduceat(routes.latitude, starts) / routes.lengths[non_empty]
+            longitude_scale = np.cos(np.radians(np.round(mean_latitude)))
+            features = np.column_stack([routes.latitude[starts],
+                                        routes.longitude[starts] * longitude_scale,
+                                        routes.latitude[ends],
+                                        routes.longitude[ends] * longitude_scale,
+                                        np.minimum.reduceat(routes.latitude, starts),
+                                        np.minimum.reduceat(routes.longitude, starts) * longitude_scale,
+                                        np.maximum.reduceat(routes.latitude, starts),
+                                        np.maximum.reduceat(routes.longitude, starts) * longitude_scale])
+        cells = np.floor(features * METRES_PER_DEGREE / self.near_duplicate_distance).astype('int64')
+        keys = [b''] * len(routes)
+        for route, cell in zip(np.flatnonzero(non_empty), cells):
+            keys[route] = cell.tobytes()
+        return keys
+
+    def find_visits(self,
+                    search: RouteSearch,
+                    routes: RouteStore,
+                    activity_ids: np.array,
+                    activity_dates: pd.DatetimeIndex) -> pd.DataFrame:
+        """
+        Search the unique routes of a RouteStore for summit visits, and fan the visits out to every activity repeating
+        each route, with the activity's own id and date.
+
+        :param search: function searching a RouteStore for summit visits
+        :param routes: RouteStore of the routes to search
+        :param activity_ids: activity id of each route
+        :param activity_dates: activity date of each route
+        :return: pd.DataFrame of visits, with one row per (activity, visited summit) pair, in the order search returns
+        """
+        keys = self.route_keys(routes)
+        unique_keys: Dict[bytes, int] = {}
+        inverse = np.array([unique_keys.setdefault(key, len(unique_keys)) for key in keys], dtype='int64')
+        # The first route with each key is searched.
+        _, representatives = np.unique(inverse, return_index=True)
+        unique_keys = list(unique_keys)
+
+        with self.lock:
+            missing = [unique for unique, key in enumerate(unique_keys) if key not in self.summits]
+        metrics.increment('routes_searched', len(missing))
+        metrics.increment('routes_deduplicated', len(keys) - len(missing))
+        if missing:
+            searched = representatives[missing]
+            visits = search(RouteStore.from_routes([routes[route] for route in searched]),
+                            np.arange(len(missing), dtype='int64'),
+                            activity_dates[searched])
+            order = np.argsort(visits['activity'].to_numpy(), kind='stable')
+            visit_routes = visits['activity'].to_numpy()[order]
+            visit_summits = visits['visited_summits'].to_numpy()[order]
+            boundaries = np.searchsorted(visit_routes, np.arange(len(missing) + 1))
+            with self.lock:
+                for index, unique in enumerate(missing):
+                    self.summits[unique_keys[unique]] = visit_summits[boundaries[index]:boundaries[index + 1]]
+
+        with self.lock:
+            unique_summits = [self.summits[key] for key in unique_keys]
+        return _fan_out_visits(unique_summits, inverse, activity_ids, activity_dates)
+
+
+def _fan_out_visits(unique_summits: List[np.array],
+                    inverse: np.array,
+                    activity_ids: np.array,
+                    activity_dates: pd.DatetimeIndex) -> pd.DataFrame:
+    # Copy the visited summits of each unique route to every route repeating it, in route order.
+    unique_counts = np.array([len(summits) for summits in unique_summits], dtype='int64')
+    unique_starts = np.cumsum(unique_counts) - unique_counts
+    counts = unique_counts[inverse]
+    visit_routes = np.repeat(np.arange(len(inverse)), counts)
+    within_route = np.arange(len(visit_routes)) - np.repeat(np.cumsum(counts) - counts, counts)
+    summits = np.concatenate([np.array([], dtype='int64')] + unique_summits)
+    return pd.DataFrame({
+        'activity': activity_ids[visit_routes],
+        'date': activity_dates[visit_routes],
+        'visited_summits': summits[unique_starts[inverse][visit_routes] + within_route]
+    })
@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 from typing import Union
 from src.summits.summits import SummitReference
+from src.summits.spatial_index import SummitIndex
 from src.utils import CoordinateSet
 from typing import Tuple
 
@@ -11,7 +12,8 @@ EARTH_RADIUS = 6371.
 def find_visited_summits(summit_reference_data: SummitReference,
                          gpx_trail: CoordinateSet,
                          distance_proximity: float = 20,
-                         search_window_width: Union[float, None] = 0.1) -> pd.DataFrame:
+                         search_window_width: Union[float, None] = 0.1,
+                         summit_index: Union[SummitIndex, None] = None) -> pd.DataFrame:
     """
     Given a GPX trail, extract from the reference data source all entries corresponding to summits that were visited,
     where a visit is an approach within distance_proximity of the summit location.
@@ -21,8 +23,15 @@ def find_visited_summits(summit_reference_data: SummitReference,
     :param distance_proximity: maximum approach distance in metres required to qualify a visit to a summit
     :param search_window_width: A margin in decimal degrees applied around the extent of the gpx_trail coordinates, used
     to reduce the summit search area. If None, the whole of the reference dataset is searched for visited summits.
-    :return: pd.DataFrame loaded from summit reference, corresponding to the visited summits only.
+    :param summit_index: optional SummitIndex built over summit_reference_data. If provided, the spatial index is
+    queried directly and search_window_width is ignored; otherwise a dense nearest neighbour search is run against
+    the trimmed search area.
+    :return: pd.DataFrame loaded from summit reference, corresponding to the visited summits only. If summit_index is
+    provided, only the Number, latitude and longitude columns are returned.
     """
+    if summit_index is not None:
+        _, summit_indices, _ = summit_index.query_radius(coordinates=gpx_trail, distance=distance_proximity)
+        return summit_index.visited_summits(summit_indices)
 
     candidate_summits = trim_search_area(summit_reference_data=summit_reference_data,
                                          gpx_trail=gpx_trail,
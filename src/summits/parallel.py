@@ -0,0 +1,219 @@
+import functools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src.strava.helpers import Activity, RouteStore
+from src.summits.dedup import RouteDeduplicator
+from src.summits.spatial_index import OccupancyGrid, SummitIndex
+from src.summits.store import empty_visits
+from src.summits.summits import SummitReference
+from src.summits.timeline import to_timestamps
+from src.utils import CoordinateSet
+from src.summits.visited import (DISTANCE_PROXIMITY, find_route_visits, record_rejection_savings,
+                                 reject_distant_routes)
+
+
+class SharedSummitReference:
+    """
+    The summit numbers and coordinates of a summit reference, held in a shared memory block so that worker processes
+    can read them without each receiving a pickled copy. The block holds the latitude and longitude columns as
+    float64, followed by the summit numbers as int64. The columns are exposed as views of the block in the columns
+    dictionary, so a SummitIndex built over the reference does not copy them.
+    """
+    altitude_column = 'Metres'
+    latitude_column = 'Latitude'
+    longitude_column = 'Longitude'
+
+    def __init__(self, shared_memory: SharedMemory, n_summits: int, version: str):
+        self.shared_memory = shared_memory
+        self.n_summits = n_summits
+        self.version = version
+        self.latitude = np.ndarray((n_summits,), dtype='float64', buffer=shared_memory.buf)
+        self.longitude = np.ndarray((n_summits,), dtype='float64', buffer=shared_memory.buf, offset=8 * n_summits)
+        self.number = np.ndarray((n_summits,), dtype='int64', buffer=shared_memory.buf, offset=16 * n_summits)
+        self.columns = {'Number': self.number,
+                        self.latitude_column: self.latitude,
+                        self.longitude_column: self.longitude}
+
+    @classmethod
+    def create(cls, reference_source: SummitReference) -> 'SharedSummitReference':
+        summits = reference_source.load()
+        n_summits = len(summits)
+        shared_memory = SharedMemory(create=True, size=max(24 * n_summits, 1))
+        reference = SharedSummitReference(shared_memory, n_summits, reference_source.version)
+        reference.latitude[:] = summits[reference_source.latitude_column].to_numpy()
+        reference.longitude[:] = summits[reference_source.longitude_column].to_numpy()
+        reference.number[:] = summits['Number'].to_numpy()
+        return reference
+
+    @classmethod
+    def attach(cls, name: str, n_summits: int, version: str) -> 'SharedSummitReference':
+        return SharedSummitReference(SharedMemory(name=name), n_summits, version)
+
+    def load(self,
+             latitude_window: Tuple[float, float] = None,
+             longitude_window: Tuple[float, float] = None) -> pd.DataFrame:
+        keep = np.ones(self.n_summits, dtype=bool)
+        if latitude_window is not None:
+            keep &= (self.latitude >= latitude_window[0]) & (self.latitude <= latitude_window[1])
+        if longitude_window is not None:
+            keep &= (self.longitude >= longitude_window[0]) & (self.longitude <= longitude_window[1])
+        return pd.DataFrame({'Number': self.number[keep],
+                             self.latitude_column: self.latitude[keep],
+                             self.longitude_column: self.longitude[keep]})
+
+    def close(self):
+        # Release the array views before the buffer they point into.
+        self.latitude = self.longitude = self.number = self.columns = None
+        self.shared_memory.close()
+
+
+# Set in each worker process by _initialise_worker.
+_worker_reference: Union[SharedSummitReference, None] = None
+_worker_index: Union[SummitIndex, None] = None
+
+
+def _initialise_worker(name: str, n_summits: int, version: str):
+    global _worker_reference, _worker_index
+    _worker_reference = SharedSummitReference.attach(name, n_summits, version)
+    # The index holds views of the shared columns, so only the KD-tree is private to the worker.
+    _worker_index = SummitIndex(_worker_reference)
+
+
+def _search_chunk(latitude: np.array,
+                  longitude: np.array,
+                  offsets: np.array,
+                  activity_ids: np.array,
+                  timestamps: np.array,
+                  exact: bool) -> Tuple[np.array, np.array, np.array]:
+    visits = find_route_visits(summit_index=_worker_index,
+                               routes=RouteStore(latitude=latitude, longitude=longitude, offsets=offsets - offsets[0]),
+                               activity_ids=activity_ids,
+                               activity_dates=pd.to_datetime(timestamps, utc=True),
+                               exact=exact)
+    return (visits['activity'].to_numpy(dtype='int64'),
+            to_timestamps(visits['date']),
+            visits['visited_summits'].to_numpy(dtype='int64'))
+
+
+class ParallelSummitSearch:
+    """
+    Searches activities for summit visits on a pool of worker processes. Activities are partitioned into chunks of
+    roughly equal point count, and each chunk is sent to a worker as flat route coordinate, offset, id and timestamp
+    arrays. Workers build their own SummitIndex over a SharedSummitReference, and return their visits as arrays, which
+    are merged into a single visits pd.DataFrame. Routes passing nowhere near a summit are rejected against an
+    OccupancyGrid in the calling process, and never sent to the workers.
+
+    Workers are started when the search is created, so create it before starting any threads.
+    """
+
+    def __init__(self,
+                 reference_source: SummitReference,
+                 workers: Union[int, None] = None,
+                 chunk_points: int = 200000):
+        """
+        :param reference_source: SummitReference datasource defining the summits
+        :param workers: number of worker processes. Defaults to the number of CPUs.
+        :param chunk_points: maximum number of route points in each chunk sent to a worker
+        """
+        self.workers = workers or os.cpu_count()
+        self.chunk_points = chunk_points
+        self.shared_reference = SharedSummitReference.create(reference_source)
+        self.occupancy_grid = OccupancyGrid(CoordinateSet(latitude=self.shared_reference.latitude,
+                                                          longitude=self.shared_reference.longitude),
+                                            distance=DISTANCE_PROXIMITY)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            initializer=_initialise_worker,
+                                            initargs=(self.shared_reference.shared_memory.name,
+                                                      self.shared_reference.n_summits,
+                                                      self.shared_reference.version))
+        self.executor.submit(int).result()
+
+    def calculate_visits(self,
+                         activities: List[Activity],
+                         exact: bool = False,
+                         deduplicator: Union[RouteDeduplicator, None] = None,
+                         early_rejection: bool = True) -> pd.DataFrame:
+        """
+        Parallel equivalent of calculate_visits_batch. Distant routes are rejected, and repeated routes deduplicated,
+        before they are sent to the workers.
+
+        :param activities: activities to search for summit visits
+        :param exact: if True, visits are found by exact distance to the route segments rather than by sampling points
+        :param deduplicator: optional RouteDeduplicator. If None, routes are deduplicated within the activities.
+        :param early_rejection: if False, every route is searched
+        :return: pd.DataFrame of visits, with one row per (activity, visited summit) pair
+        """
+        if not activities:
+            return empty_visits()
+
+        routes = RouteStore.from_routes([activity.route for activity in activities])
+        activity_ids = np.array([activity.id for activity in activities], dtype='int64')
+        activity_dates = pd.to_datetime([activity.date for activity in activities], utc=True)
+        rejected_points = 0
+        if early_rejection:
+            near = reject_distant_routes(routes, self.occupancy_grid)
+            rejected_points = len(routes.latitude)
+            routes, activity_ids, activity_dates = routes.take(near), activity_ids[near], activity_dates[near]
+            rejected_points -= len(routes.latitude)
+
+        deduplicator = deduplicator if deduplicator is not None else RouteDeduplicator()
+        start = time.perf_counter()
+        visits = deduplicator.find_visits(search=functools.partial(self._search_routes, exact=exact),
+                                          routes=routes,
+                                          activity_ids=activity_ids,
+                                          activity_dates=activity_dates)
+        record_rejection_savings(rejected_points, len(routes.latitude), time.perf_counter() - start)
+        return visits
+
+    def _search_routes(self,
+                       routes: RouteStore,
+                       activity_ids: np.array,
+                       activity_dates: pd.DatetimeIndex,
+                       exact: bool) -> pd.DataFrame:
+        if not len(routes):
+            return empty_visits()
+        timestamps = to_timestamps(pd.Series(activity_dates))
+
+        futures = []
+        for start, end in self._chunks(routes):
+            point_start, point_end = routes.offsets[start], routes.offsets[end]
+            futures.append(self.executor.submit(_search_chunk,
+                                                routes.latitude[point_start:point_end],
+                                                routes.longitude[point_start:point_end],
+                                                routes.offsets[start:end + 1],
+                                                activity_ids[start:end],
+                                                timestamps[start:end],
+                                                exact))
+
+        results = [future.result() for future in futures]
+        return pd.DataFrame({
+            'activity': np.concatenate([activity for activity, _, _ in results]),
+            'date': pd.to_datetime(np.concatenate([timestamp for _, timestamp, _ in results]), utc=True),
+            'visited_summits': np.concatenate([summit for _, _, summit in results]),
+        })
+
+    def _chunks(self, routes: RouteStore) -> List[Tuple[int, int]]:
+        # At least one chunk per worker, and more if needed to respect chunk_points, split at route boundaries.
+        n_chunks = max(self.workers, int(np.ceil(routes.offsets[-1] / self.chunk_points)))
+        targets = np.linspace(0, routes.offsets[-1], n_chunks + 1)
+        boundaries = np.unique(np.concatenate([[0], np.searchsorted(routes.offsets, targets), [len(routes)]]))
+        boundaries = boundaries[boundaries <= len(routes)]
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def close(self):
+        self.executor.shutdown()
+        self.shared_reference.close()
+        self.shared_reference.shared_memory.unlink()
+
+    def __enter__(self) -> 'ParallelSummitSearch':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,235 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+from src.instrumentation import span
+from src.strava.helpers import ActivityCache, activities_from_json
+from src.summits.spatial_index import EARTH_RADIUS_METRES, SummitIndex
+from src.summits.store import VisitHistory, VisitStore
+from src.summits.summits import SummitReference, open_summit_reference
+from src.summits.visited import DISTANCE_PROXIMITY, activity_extents, calculate_visits_batch
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReferenceDiff:
+    """
+    Difference between two versions of the summit reference, by summit Number. Reclassified summits only change
+    attributes other than their coordinates, so do not change visits.
+
+    Sampled detection credits each route point to its nearest summit only, so a change of location also changes the
+    visits of routes near where a summit used to be: once a summit is removed or moved away, a neighbouring summit
+    within the visit distance may be credited instead.
+    """
+    old_version: str
+    new_version: str
+    added: np.array
+    removed: np.array
+    moved: np.array
+    reclassified: np.array
+    # Locations changed between the references, which activities must be searched near: the new coordinates of added
+    # and moved summits, and the old coordinates of removed and moved summits.
+    latitude: np.array
+    longitude: np.array
+
+
+def diff_references(old_reference: SummitReference, new_reference: SummitReference) -> ReferenceDiff:
+    """
+    Compare two versions of the summit reference.
+
+    :param old_reference: SummitReference the stored visit histories were computed against
+    :param new_reference: updated SummitReference
+    :return: ReferenceDiff
+    """
+    old = old_reference.load().drop(columns='index', errors='ignore').set_index('Number')
+    new = new_reference.load().drop(columns='index', errors='ignore').set_index('Number')
+    coordinates = [new_reference.latitude_column, new_reference.longitude_column]
+
+    common = old.index.intersection(new.index)
+    moved = (old.loc[common, coordinates].to_numpy() != new.loc[common, coordinates].to_numpy()).any(axis=1)
+    attributes = [column for column in new.columns if column in old.columns and column not in coordinates]
+    old_attributes = old.loc[common, attributes].reset_index(drop=True)
+    new_attributes = new.loc[common, attributes].reset_index(drop=True)
+    reclassified = ~(old_attributes.eq(new_attributes) | (old_attributes.isna() & new_attributes.isna())).all(axis=1)
+
+    added = new.index.difference(old.index).to_numpy(dtype='int64')
+    removed = old.index.difference(new.index).to_numpy(dtype='int64')
+    moved = common[moved].to_numpy(dtype='int64')
+    locations = np.concatenate([new.loc[np.concatenate([added, moved]), coordinates].to_numpy(dtype=float),
+                                old.loc[np.concatenate([removed, moved]), coordinates].to_numpy(dtype=float)])
+    return ReferenceDiff(old_version=old_reference.version,
+                         new_version=new_reference.version,
+                         added=added,
+                         removed=removed,
+                         moved=moved,
+                         reclassified=common[reclassified.to_numpy() & ~np.isin(common, moved)].to_numpy(dtype='int64'),
+                         latitude=locations[:, 0],
+                         longitude=locations[:, 1])
+
+
+def affected_activities(extents: np.array,
+                        latitude: np.array,
+                        longitude: np.array,
+                        distance: float = DISTANCE_PROXIMITY,
+                        chunk_size: int = 256) -> np.array:
+    """
+    Find the activities whose route extent, widened by distance, contains any of a set of summits. Only these
+    activities can visit the summits.
+
+    :param extents: route extents of the activities, as returned by RouteStore.extents
+    :param latitude: latitude of the summits, in decimal degrees
+    :param longitude: longitude of the summits, in decimal degrees
+    :param distance: maximum approach distance in metres required to qualify a visit to a summit
+    :param chunk_size: number of summits tested against every extent at once
+    :return: boolean mask of the affected activities. Activities with empty routes are never affected.
+    """
+    # Widen the extents by slightly more than distance, converting metres to degrees of longitude at the latitude
+    # furthest from the equator.
+    margin = 1.1 * np.degrees(distance / EARTH_RADIUS_METRES)
+    furthest_latitude = np.minimum(np.maximum(np.abs(extents[:, 0]), np.abs(extents[:, 1])) + margin, 89.)
+    longitude_margin = margin / np.cos(np.radians(furthest_latitude))
+
+    affected = np.zeros(len(extents), dtype=bool)
+    for start in range(0, len(latitude), chunk_size):
+        summit_latitude = latitude[start:start + chunk_size, np.newaxis]
+        summit_longitude = longitude[start:start + chunk_size, np.newaxis]
+        affected |= ((summit_latitude >= extents[:, 0] - margin) & (summit_latitude <= extents[:, 1] + margin) &
+                     (summit_longitude >= extents[:, 2] - longitude_margin) &
+                     (summit_longitude <= extents[:, 3] + longitude_margin)).any(axis=0)
+    return affected
+
+
+def recompute_visit_history(athlete_id: int,
+                            diff: ReferenceDiff,
+                            summit_index: SummitIndex,
+                            visit_store: VisitStore,
+                            activity_cache: ActivityCache) -> Dict[str, int]:
+    """
+    Update the stored visit history of an athlete from the old to the new version of the summit reference, in place.
+    Visits to removed and moved summits are dropped, and only the activities whose route extent is near a changed
+    location, as listed by the ReferenceDiff, are searched again, against the new reference. The result is the same as
+    recomputing the history from scratch.
+
+    Histories computed against another version of the reference are left to be recomputed in full on the athlete's
+    next report, as are histories whose affected activities are missing from the activity cache.
+
+    :param athlete_id: athlete whose visit history is updated
+    :param diff: ReferenceDiff between the reference version of the stored history and the new version
+    :param summit_index: SummitIndex built over the new reference
+    :param visit_store: VisitStore persisting the per-activity visits of each athlete
+    :param activity_cache: ActivityCache holding the raw activity JSON the history was computed from
+    :return: dictionary counting the activities of the athlete, the activities searched, and whether the history
+    was updated
+    """
+    result = {'activities': 0, 'searched': 0, 'updated': 0}
+    history = visit_store.load(athlete_id)
+    if history is None:
+        return result
+    result['activities'] = len(history.processed_activities)
+    exact = history.reference_version.endswith('-exact')
+    old_version, new_version = (f'{diff.old_version}-exact', f'{diff.new_version}-exact') if exact \
+        else (diff.old_version, diff.new_version)
+    if history.reference_version != old_version:
+        logger.info('visit history not computed against the old reference, skipping',
+                    extra={'fields': {'athlete_id': athlete_id, 'reference_version': history.reference_version}})
+        return result
+
+    extents = history.activity_extents
+    if extents is None:
+        # Histories saved before extents were recorded are indexed from the activity cache, once.
+        activities = _cached_activities(activity_cache, athlete_id, history.processed_activities)
+        if activities is None:
+            return result
+        extents = activity_extents(activities_from_json(activities))
+
+    affected_ids = history.processed_activities[affected_activities(extents, diff.latitude, diff.longitude)]
+    new_visits = history.visits.iloc[:0]
+    if len(affected_ids):
+        activities = _cached_activities(activity_cache, athlete_id, affected_ids)
+        if activities is None:
+            return result
+        new_visits = calculate_visits_batch(activities=activities_from_json(activities),
+                                            summit_index=summit_index,
+                                            exact=exact)
+
+    visits = history.visits
+    changed_summits = np.concatenate([diff.removed, diff.moved])
+    stale = visits['activity'].isin(affected_ids) | visits['visited_summits'].isin(changed_summits)
+    visit_store.save(athlete_id, VisitHistory(reference_version=new_version,
+                                              processed_activities=history.processed_activities,
+                                              visits=pd.concat([visits.loc[~stale], new_visits], ignore_index=True),
+                                              activity_extents=extents))
+    result.update(searched=len(affected_ids), updated=1)
+    return result
+
+
+def recompute_visit_histories(athlete_ids: List[int],
+                              diff: ReferenceDiff,
+                              reference_path: str,
+                              visit_store: VisitStore,
+                              activity_cache: ActivityCache,
+                              workers: Union[int, None] = None) -> Dict[str, int]:
+    """
+    Update the stored visit histories of many athletes with recompute_visit_history, on a pool of worker processes.
+    Each worker opens the new reference and builds its own SummitIndex once.
+
+    :param athlete_ids: athletes whose visit histories are updated
+    :param diff: ReferenceDiff between the old and new versions of the summit reference
+    :param reference_path: path of the new summit reference, as accepted by open_summit_reference
+    :param visit_store: VisitStore persisting the per-activity visits of each athlete
+    :param activity_cache: ActivityCache holding the raw activity JSON of each athlete
+    :param workers: number of worker processes. Defaults to the number of CPUs.
+    :return: dictionary of the counts returned by recompute_visit_history, summed over the athletes
+    """
+    totals = {'athletes': len(athlete_ids), 'activities': 0, 'searched': 0, 'updated': 0}
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_initialise_worker,
+                             initargs=(diff, reference_path, visit_store, activity_cache)) as executor:
+        for result in executor.map(_recompute_athlete, athlete_ids, chunksize=16):
+            for key, value in result.items():
+                totals[key] += value
+    return totals
+
+
+# Set in each worker process by _initialise_worker.
+_worker_diff: Union[ReferenceDiff, None] = None
+_worker_index: Union[SummitIndex, None] = None
+_worker_visit_store: Union[VisitStore, None] = None
+_worker_activity_cache: Union[ActivityCache, None] = None
+
+
+def _initialise_worker(diff: ReferenceDiff, reference_path: str, visit_store: VisitStore,
+                       activity_cache: ActivityCache):
+    global _worker_diff, _worker_index, _worker_visit_store, _worker_activity_cache
+    _worker_diff, _worker_visit_store, _worker_activity_cache = diff, visit_store, activity_cache
+    # The index is only queried if some activities need searching again.
+    if len(diff.latitude):
+        _worker_index = SummitIndex(open_summit_reference(reference_path))
+
+
+def _recompute_athlete(athlete_id: int) -> Dict[str, int]:
+    with span('recompute_visit_history', athlete_id=athlete_id) as recompute:
+        result = recompute_visit_history(athlete_id=athlete_id,
+                                         diff=_worker_diff,
+                                         summit_index=_worker_index,
+                                         visit_store=_worker_visit_store,
+                                         activity_cache=_worker_activity_cache)
+        recompute.items = result['searched']
+    return result
+
+
+def _cached_activities(activity_cache: ActivityCache,
+                       athlete_id: int,
+                       activity_ids: np.array) -> Union[List[Dict], None]:
+    # Return the cached JSON of the given activities, in order, or None if any are missing from the cache.
+    cached_activities = {activity['id']: activity for activity in activity_cache.load(athlete_id)}
+    if not all(activity_id in cached_activities for activity_id in activity_ids.tolist()):
+        logger.warning('activities missing from the activity cache, skipping',
+                       extra={'fields': {'athlete_id': athlete_id}})
+        return None
+    return [cached_activities[activity_id] for activity_id in activity_ids.tolist()]
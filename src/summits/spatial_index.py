@@ -0,0 +1,349 @@
+import threading
+from typing import Dict, Protocol, Tuple, Type
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from src.summits.summits import SummitReference, load_summit_columns
+from src.utils import CoordinateSet
+
+EARTH_RADIUS_METRES = 6371. * 1000.
+
+
+class SpatialIndex(Protocol):
+    def __init__(self, reference_points: CoordinateSet):
+        pass
+
+    def query_radius(self,
+                     coordinates: CoordinateSet,
+                     distance: float) -> Tuple[np.array, np.array, np.array]:
+        pass
+
+    def query_segments(self,
+                       segment_starts: CoordinateSet,
+                       segment_ends: CoordinateSet,
+                       distance: float) -> Tuple[np.array, np.array, np.array]:
+        pass
+
+
+def to_unit_vectors(latitude: np.array, longitude: np.array) -> np.array:
+    """
+    Convert latitude and longitude coordinates (decimal degrees) to 3D-Cartesian points on the unit sphere.
+
+    :param latitude: latitude coordinates in decimal degrees
+    :param longitude: longitude coordinates in decimal degrees
+    :return: (n x 3) array of unit vectors
+    """
+    lat = np.radians(np.asarray(latitude, dtype=float))
+    lng = np.radians(np.asarray(longitude, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)])
+
+
+def segment_distances(start_latitude: np.array,
+                      start_longitude: np.array,
+                      end_latitude: np.array,
+                      end_longitude: np.array,
+                      point_latitude: np.array,
+                      point_longitude: np.array) -> np.array:
+    """
+    Calculate the minimum distance from each point to the corresponding line segment, using a local equirectangular
+    projection centred on the point. Coordinates are specified in decimal degrees. The projection error is negligible
+    for segments of the length found in route polylines.
+
+    :return: distances in metres
+    """
+    scale = np.cos(np.radians(point_latitude))
+    start_x = np.radians(start_longitude - point_longitude) * scale
+    start_y = np.radians(start_latitude - point_latitude)
+    dx = np.radians(end_longitude - start_longitude) * scale
+    dy = np.radians(end_latitude - start_latitude)
+
+    squared_length = dx ** 2 + dy ** 2
+    fraction = -(start_x * dx + start_y * dy) / np.where(squared_length > 0, squared_length, 1.)
+    fraction = np.clip(fraction, 0., 1.)
+    return np.hypot(start_x + fraction * dx, start_y + fraction * dy) * EARTH_RADIUS_METRES
+
+
+def metres_to_chord(distance: float) -> float:
+    """
+    Convert a great circle distance in metres to the equivalent straight-line (chord) distance on the unit sphere.
+    """
+    return 2 * np.sin(0.5 * distance / EARTH_RADIUS_METRES)
+
+
+def chord_to_metres(chord: np.array) -> np.array:
+    """
+    Convert a straight-line (chord) distance on the unit sphere to the equivalent great circle distance in metres.
+    """
+    return 2 * EARTH_RADIUS_METRES * np.arcsin(np.clip(0.5 * chord, 0., 1.))
+
+
+class KDTreeSpatialIndex:
+    """
+    Nearest neighbour index over reference points embedded as 3D-Cartesian unit vectors. Euclidean (chord) distance
+    on the unit sphere is monotonic in great circle distance, so a KD-tree query returns the same neighbours as a
+    haversine search.
+    """
+
+    def __init__(self, reference_points: CoordinateSet):
+        self.reference_points = reference_points
+        self.tree = cKDTree(to_unit_vectors(reference_points.latitude, reference_points.longitude))
+
+    def query_radius(self,
+                     coordinates: CoordinateSet,
+                     distance: float) -> Tuple[np.array, np.array, np.array]:
+        """
+        For each coordinate, find the nearest reference point, retaining only those coordinates whose nearest
+        reference point lies within distance.
+
+        :param coordinates: CoordinateSet of input coordinates
+        :param distance: maximum great circle distance in metres
+        :return: tuple containing the indices of the retained coordinates, the indices of their nearest reference
+        points, and the distances to them in metres
+        """
+        if not coordinates.length or not self.tree.n:
+            return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+
+        chords, reference_indices = self.tree.query(to_unit_vectors(coordinates.latitude, coordinates.longitude),
+                                                    k=1,
+                                                    distance_upper_bound=metres_to_chord(distance))
+        distances = chord_to_metres(np.where(np.isfinite(chords), chords, 2.))
+        coordinate_indices = np.flatnonzero(np.isfinite(chords) & (distances < distance))
+        return coordinate_indices, reference_indices[coordinate_indices], distances[coordinate_indices]
+
+    def query_segments(self,
+                       segment_starts: CoordinateSet,
+                       segment_ends: CoordinateSet,
+                       distance: float) -> Tuple[np.array, np.array, np.array]:
+        """
+        Find every (segment, reference point) pair where the reference point lies within distance of the segment.
+        Candidates are found with a ball query around the midpoint of each segment, with a radius covering the whole
+        segment plus distance, and the exact point-to-segment distance is calculated for the candidates only.
+
+        :param segment_starts: CoordinateSet of segment start coordinates
+        :param segment_ends: CoordinateSet of segment end coordinates
+        :param distance: maximum distance in metres
+        :return: tuple containing the segment indices, the reference point indices, and the distances between them in
+        metres
+        """
+        if not segment_starts.length or not self.tree.n:
+            return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+
+        starts = to_unit_vectors(segment_starts.latitude, segment_starts.longitude)
+        ends = to_unit_vectors(segment_ends.latitude, segment_ends.longitude)
+        midpoints = starts + ends
+        midpoints /= np.linalg.norm(midpoints, axis=1)[:, None]
+        # Allow a small margin for the difference between the projected segment and the great circle arc.
+        radii = 1.01 * (np.linalg.norm(starts - midpoints, axis=1) + metres_to_chord(distance))
+
+        # Most segments pass nowhere near a summit. A nearest neighbour query is much cheaper than a ball query, and
+        # identifies the segments with at least one candidate.
+        nearest, _ = self.tree.query(midpoints, k=1, distance_upper_bound=radii.max())
+        searched = np.flatnonzero(nearest <= radii)
+        if not len(searched):
+            return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+
+        candidates = self.tree.query_ball_point(midpoints[searched], r=radii[searched], return_sorted=False)
+        candidate_counts = np.fromiter((len(candidate) for candidate in candidates), dtype=int, count=len(candidates))
+        segment_indices = np.repeat(searched, candidate_counts)
+        reference_indices = np.concatenate([candidate for candidate in candidates if len(candidate)]).astype(int)
+        return _filter_segment_distances(segment_starts, segment_ends, self.reference_points,
+                                         segment_indices, reference_indices, distance)
+
+
+class BruteForceSpatialIndex:
+    """
+    Dense haversine distance matrix search, retained as a reference implementation for parity testing against
+    KDTreeSpatialIndex.
+    """
+
+    def __init__(self, reference_points: CoordinateSet):
+        self.reference_points = reference_points
+
+    def query_radius(self,
+                     coordinates: CoordinateSet,
+                     distance: float) -> Tuple[np.array, np.array, np.array]:
+        from src.summits.locator import nearest_neighbour_search
+
+        if not coordinates.length or not self.reference_points.length:
+            return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+
+        distances, reference_indices = nearest_neighbour_search(coordinates=coordinates,
+                                                                reference_points=self.reference_points)
+        coordinate_indices = np.flatnonzero(distances < distance)
+        return coordinate_indices, reference_indices[coordinate_indices], distances[coordinate_indices]
+
+    def query_segments(self,
+                       segment_starts: CoordinateSet,
+                       segment_ends: CoordinateSet,
+                       distance: float) -> Tuple[np.array, np.array, np.array]:
+        segment_indices, reference_indices = np.meshgrid(np.arange(segment_starts.length),
+                                                         np.arange(self.reference_points.length))
+        return _filter_segment_distances(segment_starts, segment_ends, self.reference_points,
+                                         segment_indices.ravel(), reference_indices.ravel(), distance)
+
+
+def _filter_segment_distances(segment_starts: CoordinateSet,
+                              segment_ends: CoordinateSet,
+                              reference_points: CoordinateSet,
+                              segment_indices: np.array,
+                              reference_indices: np.array,
+                              distance: float) -> Tuple[np.array, np.array, np.array]:
+    distances = segment_distances(np.asarray(segment_starts.latitude)[segment_indices],
+                                  np.asarray(segment_starts.longitude)[segment_indices],
+                                  np.asarray(segment_ends.latitude)[segment_indices],
+                                  np.asarray(segment_ends.longitude)[segment_indices],
+                                  np.asarray(reference_points.latitude)[reference_indices],
+                                  np.asarray(reference_points.longitude)[reference_indices])
+    within = distances < distance
+    return segment_indices[within], reference_indices[within], distances[within]
+
+
+class OccupancyGrid:
+    """
+    Coarse grid over latitude and longitude, marking every cell that could hold a point within distance of any
+    reference point. Cells are cell_size metres tall, and the same number of degrees wide. Occupied cells are held as a
+    sorted array of cell keys, so a batch of points is tested with a single binary search.
+
+    Most routes pass nowhere near a summit, and can be rejected by testing their points, and samples along their
+    segments, against the grid, before any densification or spatial query. The test is conservative: a route with no
+    sample in an occupied cell has no point within distance of any reference point.
+    """
+
+    def __init__(self, reference_points: CoordinateSet, distance: float, cell_size: float = 1000.):
+        """
+        :param reference_points: CoordinateSet of reference points, e.g. summits
+        :param distance: maximum distance in metres from a reference point that must be covered by occupied cells
+        :param cell_size: height of each cell in metres
+        """
+        self.cell_degrees = np.degrees(cell_size / EARTH_RADIUS_METRES)
+        latitude = np.asarray(reference_points.latitude, dtype=float)
+        longitude = np.asarray(reference_points.longitude, dtype=float)
+        if not len(latitude):
+            self.cells = np.array([], dtype='int64')
+            return
+
+        # Allow a small margin for the difference between the equirectangular cells and great circle distance.
+        # Cells are narrower than cell_size east to west, by the cosine of latitude, so reach further in longitude.
+        reach = 1.01 * distance / cell_size
+        furthest_latitude = min(np.abs(latitude).max() + np.degrees(distance / EARTH_RADIUS_METRES), 89.)
+        # A route point within reach of a reference point lies within floor(reach) + 1 cells of it, and route samples
+        # are up to one cell apart, so occupy a further cell in each direction.
+        reach_y = int(np.floor(reach)) + 2
+        reach_x = int(np.floor(reach / np.cos(np.radians(furthest_latitude)))) + 2
+
+        cell_y, cell_x = self._cell_indices(latitude, longitude)
+        offset_y, offset_x = np.meshgrid(np.arange(-reach_y, reach_y + 1), np.arange(-reach_x, reach_x + 1))
+        self.cells = np.unique(self._cell_keys(cell_y[:, np.newaxis] + offset_y.ravel(),
+                                               cell_x[:, np.newaxis] + offset_x.ravel()))
+
+    def query_routes(self,
+                     latitude: np.array,
+                     longitude: np.array,
+                     offsets: np.array,
+                     chunk_segments: int = 100000) -> np.array:
+        """
+        Test concatenated routes against the grid. Every point of each route is tested, then samples at intervals of
+        at most one cell along the segments of the routes without an occupied point.
+
+        :param latitude: concatenated latitude coordinates of all routes
+        :param longitude: concatenated longitude coordinates of all routes
+        :param offsets: offsets of the routes, route i occupying offsets[i]:offsets[i + 1]
+        :param chunk_segments: number of segments sampled at once
+        :return: boolean array, True for the routes passing through an occupied cell
+        """
+        n_routes = len(offsets) - 1
+        point_route = np.repeat(np.arange(n_routes), np.diff(offsets))
+        y = np.asarray(latitude, dtype=float) / self.cell_degrees
+        x = np.asarray(longitude, dtype=float) / self.cell_degrees
+
+        hits = np.zeros(n_routes, dtype=bool)
+        hits[point_route[self._occupied(y, x)]] = True
+
+        starts = np.flatnonzero(point_route[:-1] == point_route[1:])
+        starts = starts[~hits[point_route[starts]]]
+        for chunk in range(0, len(starts), chunk_segments):
+            start = starts[chunk:chunk + chunk_segments]
+            dy, dx = y[start + 1] - y[start], x[start + 1] - x[start]
+            steps = np.ceil(np.maximum(np.abs(dy), np.abs(dx))).astype('int64')
+            # Segment end points have been tested already, so only segments longer than a cell need samples.
+            long_segments = steps > 1
+            start, dy, dx, steps = start[long_segments], dy[long_segments], dx[long_segments], steps[long_segments]
+
+            counts = steps - 1
+            segment = np.repeat(np.arange(len(start)), counts)
+            step = np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+            fraction = step / steps[segment]
+            occupied = self._occupied(y[start][segment] + fraction * dy[segment],
+                                      x[start][segment] + fraction * dx[segment])
+            hits[point_route[start[segment[occupied]]]] = True
+        return hits
+
+    def _occupied(self, y: np.array, x: np.array) -> np.array:
+        if not len(self.cells):
+            return np.zeros(len(y), dtype=bool)
+        keys = self._cell_keys(np.floor(y).astype('int64'), np.floor(x).astype('int64'))
+        positions = np.minimum(np.searchsorted(self.cells, keys), len(self.cells) - 1)
+        return self.cells[positions] == keys
+
+    def _cell_indices(self, latitude: np.array, longitude: np.array) -> Tuple[np.array, np.array]:
+        return (np.floor(latitude / self.cell_degrees).astype('int64'),
+                np.floor(longitude / self.cell_degrees).astype('int64'))
+
+    @staticmethod
+    def _cell_keys(cell_y: np.array, cell_x: np.array) -> np.array:
+        return cell_y * 2 ** 32 + cell_x
+
+
+class SummitIndex:
+    """
+    A spatial index over the complete summit reference dataset, built once and reused for every trail searched.
+    Reference indices returned by the backend are row positions in the reference, and in SummitIndex.numbers.
+
+    Only the summit numbers and coordinates are held, as loaded by load_summit_columns, so the index of a memory-mapped
+    reference shares the pages of its column files rather than copying them.
+    """
+
+    def __init__(self,
+                 summit_reference_data: SummitReference,
+                 backend: Type[SpatialIndex] = KDTreeSpatialIndex):
+        self.latitude_column = summit_reference_data.latitude_column
+        self.longitude_column = summit_reference_data.longitude_column
+        columns = load_summit_columns(summit_reference_data, ['Number', self.latitude_column, self.longitude_column])
+        self.numbers = columns['Number']
+        self.coordinates = CoordinateSet(latitude=columns[self.latitude_column],
+                                         longitude=columns[self.longitude_column])
+        self.index = backend(self.coordinates)
+        self.occupancy_grids: Dict[float, OccupancyGrid] = {}
+        self.lock = threading.Lock()
+
+    def query_radius(self,
+                     coordinates: CoordinateSet,
+                     distance: float) -> Tuple[np.array, np.array, np.array]:
+        return self.index.query_radius(coordinates=coordinates, distance=distance)
+
+    def query_segments(self,
+                       segment_starts: CoordinateSet,
+                       segment_ends: CoordinateSet,
+                       distance: float) -> Tuple[np.array, np.array, np.array]:
+        return self.index.query_segments(segment_starts=segment_starts, segment_ends=segment_ends, distance=distance)
+
+    def occupancy_grid(self, distance: float) -> OccupancyGrid:
+        """
+        Return an OccupancyGrid of the summits for the given distance, built on first use.
+        """
+        with self.lock:
+            if distance not in self.occupancy_grids:
+                self.occupancy_grids[distance] = OccupancyGrid(self.coordinates, distance=distance)
+            return self.occupancy_grids[distance]
+
+    def visited_summits(self, summit_indices: np.array) -> pd.DataFrame:
+        """
+        Return the Number and coordinates of the summits at the given reference indices, in order of first appearance.
+        """
+        positions = pd.unique(np.asarray(summit_indices))
+        return pd.DataFrame({'Number': self.numbers[positions],
+                             self.latitude_column: self.coordinates.latitude[positions],
+                             self.longitude_column: self.coordinates.longitude[positions]})
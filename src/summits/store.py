@@ -0,0 +1,72 @@
+import os
+from dataclasses import dataclass
+from typing import List, Protocol, Union
+
+import numpy as np
+import pandas as pd
+
+
+def empty_visits() -> pd.DataFrame:
+    return pd.DataFrame({
+        'activity': pd.Series([], dtype='int64'),
+        'date': pd.Series([], dtype='datetime64[ns, UTC]'),
+        'visited_summits': pd.Series([], dtype='int64')
+    })
+
+
+@dataclass
+class VisitHistory:
+    reference_version: str
+    processed_activities: np.array
+    visits: pd.DataFrame
+    # Bounding box of the route of each processed activity, as returned by RouteStore.extents, used to find the
+    # activities affected by a change to the summit reference. None for histories saved before extents were recorded.
+    activity_extents: Union[np.array, None] = None
+
+    @classmethod
+    def empty(cls, reference_version: str) -> 'VisitHistory':
+        return VisitHistory(reference_version=reference_version,
+                            processed_activities=np.array([], dtype='int64'),
+                            visits=empty_visits())
+
+
+class VisitStore(Protocol):
+    def load(self, athlete_id: int) -> Union[VisitHistory, None]:
+        pass
+
+    def save(self, athlete_id: int, history: VisitHistory):
+        pass
+
+    def athletes(self) -> List[int]:
+        pass
+
+
+class LocalFileVisitStore:
+    """
+    Persists the visit history of each athlete as a pickle file in a local directory.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def load(self, athlete_id: int) -> Union[VisitHistory, None]:
+        filepath = self._filepath(athlete_id)
+        if not os.path.exists(filepath):
+            return None
+        return pd.read_pickle(filepath)
+
+    def save(self, athlete_id: int, history: VisitHistory):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first, so a concurrent reader never sees a partially written history.
+        temporary_filepath = f'{self._filepath(athlete_id)}.tmp'
+        pd.to_pickle(history, temporary_filepath)
+        os.replace(temporary_filepath, self._filepath(athlete_id))
+
+    def athletes(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(filename[:-len('.pkl')]) for filename in os.listdir(self.directory)
+                      if filename.endswith('.pkl'))
+
+    def _filepath(self, athlete_id: int) -> str:
+        return os.path.join(self.directory, f'{athlete_id}.pkl')
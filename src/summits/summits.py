@@ -1,12 +1,22 @@
-from typing import Protocol, Tuple
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Protocol, Tuple
 
+import numpy as np
 import pandas as pd
 
+from src.instrumentation import span
+
+logger = logging.getLogger(__name__)
+
 
 class SummitReference(Protocol):
     altitude_column: str
     latitude_column: str
     longitude_column: str
+    version: str
 
     def load(self,
              latitude_window: Tuple[float, float] = None,
@@ -21,6 +31,17 @@ class LocalFileSummitReference:
 
     def __init__(self, filepath):
         self.filepath = filepath
+        self._version = None
+
+    @property
+    def version(self) -> str:
+        """
+        Content hash of the reference file, used to invalidate results computed against a previous version.
+        """
+        if self._version is None:
+            with open(self.filepath, 'rb') as f:
+                self._version = hashlib.md5(f.read()).hexdigest()
+        return self._version
 
     def load(self,
              latitude_window: Tuple[float, float] = None,
@@ -37,8 +58,10 @@ class LocalFileSummitReference:
         return df.reset_index()
 
     def _load_from_file(self):
-        print('Loading...')
-        df = pd.read_pickle(self.filepath)
+        logger.info('loading summit reference', extra={'fields': {'filepath': self.filepath}})
+        with span('load_summit_reference') as load:
+            df = pd.read_pickle(self.filepath)
+            load.items = len(df)
         return df
 
 
@@ -62,3 +85,117 @@ class PersistentLocalFileSummitReference(LocalFileSummitReference):
             df = df.loc[(df[self.longitude_column] >= longitude_window[0]) &
                         (df[self.longitude_column] <= longitude_window[1])]
         return df.reset_index()
+
+
+class MemoryMappedSummitReference:
+    """
+    Summit reference stored as a directory of NumPy .npy column files, written by write_columnar_reference with rows
+    sorted by latitude. Columns are memory-mapped rather than read, so opening the reference is near instant, and
+    processes on the same host share the physical pages of the file through the page cache. DataFrame rows are only
+    materialised for the summits inside a window, and the memory-mapped columns are exposed as the columns dictionary.
+    """
+    altitude_column = 'Metres'
+    latitude_column = 'Latitude'
+    longitude_column = 'Longitude'
+    metadata_filename = 'columns.json'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, self.metadata_filename), 'r') as f:
+            metadata = json.load(f)
+        self.version = metadata['version']
+        self.columns = {column: np.load(os.path.join(directory, filename), mmap_mode='r')
+                        for column, filename in metadata['columns'].items()}
+        self.index = np.load(os.path.join(directory, metadata['index']), mmap_mode='r')
+
+    def load(self,
+             latitude_window: Tuple[float, float] = None,
+             longitude_window: Tuple[float, float] = None) -> pd.DataFrame:
+        if latitude_window is None and longitude_window is None:
+            return self._materialise(slice(None))
+        return self._materialise(self.window_indices(latitude_window, longitude_window))
+
+    def window_indices(self,
+                       latitude_window: Tuple[float, float] = None,
+                       longitude_window: Tuple[float, float] = None) -> np.array:
+        """
+        Find the summits within a bounding box.
+
+        :param latitude_window: (min, max) latitude in decimal degrees. If None, latitude is unbounded.
+        :param longitude_window: (min, max) longitude in decimal degrees. If None, longitude is unbounded.
+        :return: sorted array of the row positions of the summits within the window
+        """
+        latitude = self.columns[self.latitude_column]
+        start, end = 0, len(latitude)
+        if latitude_window is not None:
+            start = np.searchsorted(latitude, latitude_window[0], side='left')
+            end = np.searchsorted(latitude, latitude_window[1], side='right')
+
+        positions = np.arange(start, end)
+        if longitude_window is not None:
+            longitude = self.columns[self.longitude_column][start:end]
+            positions = positions[(longitude >= longitude_window[0]) & (longitude <= longitude_window[1])]
+        return positions
+
+    def _materialise(self, rows) -> pd.DataFrame:
+        data = {'index': self.index[rows]}
+        for column, values in self.columns.items():
+            values = values[rows]
+            # Strings are stored as fixed width unicode so they can be memory-mapped, and restored as objects.
+            data[column] = values.astype(object) if values.dtype.kind == 'U' else np.array(values)
+        return pd.DataFrame(data)
+
+
+def load_summit_columns(reference_source: SummitReference, columns: List[str]) -> Dict[str, np.array]:
+    """
+    Load some columns of a summit reference as arrays, in row order. References holding their columns as arrays, such
+    as MemoryMappedSummitReference, expose them as a columns dictionary, and these are returned as views without
+    copying. Other references are loaded, and the rest of their columns discarded.
+
+    :param reference_source: SummitReference to load the columns of
+    :param columns: names of the columns to load
+    :return: dictionary of the column arrays, by name
+    """
+    reference_columns = getattr(reference_source, 'columns', None)
+    if isinstance(reference_columns, dict):
+        return {column: reference_columns[column] for column in columns}
+    summits = reference_source.load()
+    return {column: summits[column].to_numpy() for column in columns}
+
+
+def write_columnar_reference(df: pd.DataFrame, directory: str, latitude_column: str = 'Latitude'):
+    """
+    Write a summit reference DataFrame as a directory of .npy column files, sorted by latitude, which can be opened
+    with MemoryMappedSummitReference.
+
+    :param df: summit reference DataFrame, e.g. loaded from the reference pickle
+    :param directory: directory to write the column files to
+    :param latitude_column: name of the latitude column rows are sorted by
+    """
+    os.makedirs(directory, exist_ok=True)
+    df = df.iloc[np.argsort(df[latitude_column].values, kind='stable')]
+    content_hash = hashlib.md5()
+    filenames = {}
+
+    for position, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype.kind == 'O':
+            values = values.astype(str)
+        filenames[column] = f'column_{position}.npy'
+        np.save(os.path.join(directory, filenames[column]), values)
+        content_hash.update(str(column).encode())
+        content_hash.update(values.tobytes())
+
+    np.save(os.path.join(directory, 'index.npy'), df.index.values)
+    with open(os.path.join(directory, MemoryMappedSummitReference.metadata_filename), 'w') as f:
+        json.dump({'version': content_hash.hexdigest(), 'columns': filenames, 'index': 'index.npy'}, f)
+
+
+def open_summit_reference(path: str) -> SummitReference:
+    """
+    Open a summit reference, either a directory of column files written by write_columnar_reference, or a reference
+    pickle.
+    """
+    if os.path.isdir(path):
+        return MemoryMappedSummitReference(path)
+    return PersistentLocalFileSummitReference(path)
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+
+def to_timestamps(dates: pd.Series) -> np.array:
+    """
+    Convert visit dates to int64 nanoseconds since the epoch, UTC.
+    """
+    dates = pd.to_datetime(dates, utc=True).dt.tz_localize(None)
+    return dates.to_numpy().astype('datetime64[ns]').astype('int64')
+
+
+class VisitTimeline:
+    """
+    Compact, indexed table of summit visits: one row per summit per activity, held as int64 arrays of summit number,
+    activity id and visit timestamp (nanoseconds since the epoch, UTC).
+
+    Rows are sorted by summit and then by timestamp, so the visits of a summit are a contiguous range. The first visit,
+    latest visit and number of visits of every visited summit are computed once, by a single sort and reduce.
+    """
+
+    def __init__(self, summits: np.array, activities: np.array, timestamps: np.array):
+        """
+        :param summits: summit number of each visit
+        :param activities: id of the activity each visit was made on
+        :param timestamps: start time of the activity, as int64 nanoseconds since the epoch
+        """
+        order = np.lexsort((timestamps, summits))
+        self.summits = np.asarray(summits, dtype='int64')[order]
+        self.activities = np.asarray(activities, dtype='int64')[order]
+        self.timestamps = np.asarray(timestamps, dtype='int64')[order]
+
+        starts = np.flatnonzero(np.concatenate([[True], self.summits[1:] != self.summits[:-1]])) \
+            if len(self.summits) else np.array([], dtype='int64')
+        self.offsets = np.append(starts, len(self.summits))
+        self.visited_summits = self.summits[starts]
+        self.first_visits = self.timestamps[starts]
+        self.latest_visits = self.timestamps[self.offsets[1:] - 1]
+        self.visit_counts = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.summits)
+
+    @classmethod
+    def from_visits(cls, visits: pd.DataFrame) -> 'VisitTimeline':
+        """
+        Build a VisitTimeline from a pd.DataFrame of visits, with activity, date and visited_summits columns.
+        """
+        return VisitTimeline(summits=visits['visited_summits'].to_numpy(dtype='int64'),
+                             activities=visits['activity'].to_numpy(dtype='int64'),
+                             timestamps=to_timestamps(visits['date']))
+
+    def aggregates(self) -> pd.DataFrame:
+        """
+        Return the first visit date, latest visit date and number of visits of every visited summit.
+
+        :return: pd.DataFrame indexed by summit number, with first_visit, latest_visit and visit_count columns
+        """
+        return pd.DataFrame(index=pd.Index(self.visited_summits, name='visited_summits'),
+                            data={'first_visit': pd.to_datetime(self.first_visits, utc=True).date,
+                                  'latest_visit': pd.to_datetime(self.latest_visits, utc=True).date,
+                                  'visit_count': self.visit_counts})
@@ -1,31 +1,46 @@
+import time
+
+import numpy as np
 import pandas as pd
-from typing import List
-from src.strava.helpers import interpolate_polyline
+from typing import List, Union
+from src.strava.helpers import densify_routes, interpolate_polyline
 
 from src.summits.locator import find_visited_summits
 from src.utils import CoordinateSet
 
-from src.strava.helpers import Activity, Route
+from src.strava.helpers import Activity, Route, RouteStore
+from src.summits.dedup import RouteDeduplicator
 from src.summits.summits import SummitReference
+from src.summits.spatial_index import OccupancyGrid, SummitIndex, segment_distances
+from src.summits.store import VisitHistory, VisitStore, empty_visits
+from src.summits.timeline import VisitTimeline
+from src.instrumentation import metrics, span
+
+
+DISTANCE_PROXIMITY = 100
+SAMPLING_DISTANCE_INVERSE = 2 / DISTANCE_PROXIMITY
+# Batch searches only densify segments longer than the visit distance, and widen the search radius around each point to
+# cover the segments either side of it, rather than oversampling.
+SAMPLING_DISTANCE = DISTANCE_PROXIMITY
 
 
 def calculate_summit_history(activities: List[Activity],
-                             reference_source: SummitReference):
+                             reference_source: SummitReference,
+                             summit_index: Union[SummitIndex, None] = None):
     visit_col = []
     date_col = []
     activity_id_col = []
-    distance_proximity = 100
-    sampling_distance_inverse = 2 / distance_proximity
 
     for activity in activities:
-        sample_points = int(activity.distance * sampling_distance_inverse)
+        sample_points = int(activity.distance * SAMPLING_DISTANCE_INVERSE)
         route = interpolate_polyline(activity.route,
                                      interpolation_points=sample_points)
 
         visited_summits = find_visited_summits(reference_source,
-                                               CoordinateSet(latitude=route['lat'],
-                                                             longitude=route['lng']),
-                                               distance_proximity=distance_proximity)
+                                               CoordinateSet(latitude=route.latitude,
+                                                             longitude=route.longitude),
+                                               distance_proximity=DISTANCE_PROXIMITY,
+                                               summit_index=summit_index)
 
         visit_col += list(visited_summits['Number'].values)
         date_col += [pd.to_datetime(activity.date)] * len(visited_summits)
@@ -36,8 +51,374 @@ def calculate_summit_history(activities: List[Activity],
         'date': date_col,
         'visited_summits': visit_col
     })
+    return summarise_visits(visits, reference_source)
+
+
+def calculate_summit_history_batch(activities: List[Activity],
+                                   reference_source: SummitReference,
+                                   summit_index: Union[SummitIndex, None] = None,
+                                   exact: bool = False):
+    """
+    Equivalent to calculate_summit_history, but every densified route is concatenated into a single flat coordinate
+    array and searched against the summit index in one query. Hits are mapped back to activities using the offset of
+    each route within the flat array.
+
+    :param activities: activities to search for summit visits
+    :param reference_source: SummitReference datasource defining the summits
+    :param summit_index: SummitIndex built over reference_source. If None, one is built for this call.
+    :param exact: if True, visits are found by exact distance to the route segments rather than by sampling points
+    :return: pd.DataFrame of the summit reference, with first_visit, latest_visit and visit_count columns
+    """
+    if summit_index is None:
+        summit_index = SummitIndex(reference_source)
+
+    visits = calculate_visits_batch(activities=activities, summit_index=summit_index, exact=exact)
+    return summarise_visits(visits, reference_source)
+
+
+def update_summit_history(athlete_id: int,
+                          activities: List[Activity],
+                          reference_source: SummitReference,
+                          visit_store: VisitStore,
+                          summit_index: Union[SummitIndex, None] = None,
+                          exact: bool = False):
+    """
+    Incremental equivalent of calculate_summit_history_batch. Visits are loaded from the visit store, and only
+    activities that have not previously been processed against the current version of the summit reference are
+    searched. The merged visit history is written back to the store.
+
+    :param athlete_id: athlete the activities belong to
+    :param activities: the complete list of the athlete's activities
+    :param reference_source: SummitReference datasource defining the summits
+    :param visit_store: VisitStore persisting the per-activity visits of each athlete
+    :param summit_index: SummitIndex built over reference_source. If None, one is built if any activities are new.
+    :param exact: if True, visits are found by exact distance to the route segments rather than by sampling points
+    :return: pd.DataFrame of the summit reference, with first_visit, latest_visit and visit_count columns
+    """
+    history = load_visit_history(athlete_id=athlete_id,
+                                 reference_source=reference_source,
+                                 visit_store=visit_store,
+                                 exact=exact)
+
+    activity_ids = np.array([activity.id for activity in activities], dtype='int64')
+    processed = np.isin(activity_ids, history.processed_activities)
+    new_activities = [activity for activity, seen in zip(activities, processed) if not seen]
+    new_visits = empty_visits()
+    if new_activities:
+        if summit_index is None:
+            summit_index = SummitIndex(reference_source)
+        new_visits = calculate_visits_batch(activities=new_activities, summit_index=summit_index, exact=exact)
+
+    history = merge_visit_history(athlete_id=athlete_id,
+                                  history=history,
+                                  activity_ids=activity_ids,
+                                  new_visits=new_visits,
+                                  visit_store=visit_store,
+                                  activity_extents=activity_extents(activities))
+    return summarise_visits(history.visits, reference_source)
+
+
+def load_visit_history(athlete_id: int,
+                       reference_source: SummitReference,
+                       visit_store: VisitStore,
+                       exact: bool = False,
+                       near_duplicate_distance: Union[float, None] = None) -> VisitHistory:
+    """
+    Load the stored visit history of an athlete, discarding it if it was computed against a different version of the
+    summit reference, or with a different detection method.
+    """
+    version = visit_history_version(reference_source=reference_source, exact=exact,
+                                    near_duplicate_distance=near_duplicate_distance)
+    history = visit_store.load(athlete_id)
+    if history is None or history.reference_version != version:
+        history = VisitHistory.empty(reference_version=version)
+    return history
+
+
+def visit_history_version(reference_source: SummitReference,
+                          exact: bool = False,
+                          near_duplicate_distance: Union[float, None] = None) -> str:
+    version = f'{reference_source.version}-exact' if exact else reference_source.version
+    # Near duplicate route matching is approximate, so its visits are not interchangeable with searching every route.
+    return version if near_duplicate_distance is None else f'{version}-near-{near_duplicate_distance:g}'
+
+
+def merge_visit_history(athlete_id: int,
+                        history: VisitHistory,
+                        activity_ids: np.array,
+                        new_visits: pd.DataFrame,
+                        visit_store: VisitStore,
+                        activity_extents: Union[np.array, None] = None) -> VisitHistory:
+    """
+    Merge newly found visits into a visit history, saving the result if it has changed.
+
+    :param athlete_id: athlete the visit history belongs to
+    :param history: previously stored VisitHistory
+    :param activity_ids: ids of all the athlete's current activities. Visits from activities that no longer exist,
+    e.g. deleted by the athlete, are dropped.
+    :param new_visits: visits found in activities not previously processed
+    :param visit_store: VisitStore the merged history is saved to
+    :param activity_extents: optional route extents of the activities, aligned with activity_ids, as returned by
+    activity_extents
+    :return: the merged VisitHistory
+    """
+    if np.array_equal(np.unique(activity_ids), np.unique(history.processed_activities)) and not len(new_visits) \
+            and (activity_extents is None or history.activity_extents is not None):
+        return history
+
+    visits = history.visits.loc[history.visits['activity'].isin(activity_ids)]
+    history = VisitHistory(reference_version=history.reference_version,
+                           processed_activities=np.asarray(activity_ids, dtype='int64'),
+                           visits=pd.concat([visits, new_visits], ignore_index=True),
+                           activity_extents=activity_extents)
+    visit_store.save(athlete_id, history)
+    return history
+
+
+def activity_extents(activities: List[Activity]) -> np.array:
+    """
+    Bounding box of the route of each activity, as returned by RouteStore.extents.
+    """
+    return RouteStore.from_routes([activity.route for activity in activities]).extents()
+
+
+def calculate_visits_batch(activities: List[Activity],
+                           summit_index: SummitIndex,
+                           exact: bool = False,
+                           deduplicator: Union[RouteDeduplicator, None] = None,
+                           early_rejection: bool = True) -> pd.DataFrame:
+    """
+    Search the route of every activity for summit visits in a single batch. Routes passing nowhere near a summit are
+    rejected against the summit occupancy grid before they are searched. Repeated routes are searched once, and their
+    visits copied to each activity repeating them.
+
+    By default, routes are densified so that consecutive points are at most SAMPLING_DISTANCE metres apart, and the
+    points are searched within sampling_radius, so no summit within DISTANCE_PROXIMITY of a segment is missed. If
+    exact, no densification is needed: the distance from each nearby summit to each route segment is calculated. Both
+    find the same visits.
+
+    :param activities: activities to search for summit visits
+    :param summit_index: SummitIndex to query
+    :param exact: if True, visits are found by exact distance to the route segments rather than by sampling points
+    :param deduplicator: optional RouteDeduplicator, e.g. shared with earlier batches so that routes they searched are
+    not searched again. If None, routes are deduplicated within the batch.
+    :param early_rejection: if False, every route is searched
+    :return: pd.DataFrame of visits, with one row per (activity, visited summit) pair
+    """
+    routes = RouteStore.from_routes([activity.route for activity in activities])
+    activity_ids = np.array([activity.id for activity in activities], dtype='int64')
+    activity_dates = pd.to_datetime([activity.date for activity in activities])
+    rejected_points = 0
+    if early_rejection:
+        near = reject_distant_routes(routes, summit_index.occupancy_grid(DISTANCE_PROXIMITY))
+        rejected_points = len(routes.latitude)
+        routes, activity_ids, activity_dates = routes.take(near), activity_ids[near], activity_dates[near]
+        rejected_points -= len(routes.latitude)
+    deduplicator = deduplicator if deduplicator is not None else RouteDeduplicator()
+
+    def search_routes(unique_routes: RouteStore, route_ids: np.array, route_dates: pd.DatetimeIndex) -> pd.DataFrame:
+        return find_route_visits(summit_index=summit_index,
+                                 routes=unique_routes,
+                                 activity_ids=route_ids,
+                                 activity_dates=route_dates,
+                                 exact=exact)
+
+    with span('summit_search', items=len(activities), exact=exact) as search:
+        start = time.perf_counter()
+        visits = deduplicator.find_visits(search=search_routes,
+                                          routes=routes,
+                                          activity_ids=activity_ids,
+                                          activity_dates=activity_dates)
+        seconds_saved = record_rejection_savings(rejected_points, len(routes.latitude), time.perf_counter() - start)
+        search.fields.update(visits=len(visits), rejected_points=rejected_points,
+                             seconds_saved_estimate=round(seconds_saved, 6))
+    return visits
+
+
+def reject_distant_routes(routes: RouteStore, grid: OccupancyGrid) -> np.array:
+    """
+    Test routes against a summit OccupancyGrid, recording the number of activities screened and rejected.
+
+    :param routes: RouteStore of the routes to test
+    :param grid: OccupancyGrid of the summits, built for the visit distance
+    :return: indices of the routes that pass near a summit, and must be searched
+    """
+    with span('early_rejection', items=len(routes)) as screen:
+        near = np.flatnonzero(grid.query_routes(routes.latitude, routes.longitude, routes.offsets))
+        screen.fields['rejected'] = len(routes) - len(near)
+    metrics.increment('activities_screened', len(routes))
+    metrics.increment('activities_rejected', len(routes) - len(near))
+    return near
+
+
+def record_rejection_savings(rejected_points: int, searched_points: int, search_seconds: float) -> float:
+    """
+    Estimate the search time saved by early rejection, and record it in the metrics registry. Rejected route points
+    are assumed to take as long to search as the average point searched since the process started. The per point time
+    is kept across calls, so a batch in which every route was rejected is still credited with the time it saved.
+
+    :param rejected_points: number of route points rejected before the search
+    :param searched_points: number of route points searched
+    :param search_seconds: time taken by the search
+    :return: estimated seconds saved, or 0 if no route points have been searched yet
+    """
+    if searched_points:
+        metrics.increment('route_points_searched', searched_points)
+        metrics.increment('route_search_seconds', search_seconds)
+    total_points = metrics.counter('route_points_searched')
+    seconds_saved = rejected_points * metrics.counter('route_search_seconds') / total_points if total_points else 0.
+    metrics.increment('route_points_rejected', rejected_points)
+    metrics.increment('early_rejection_seconds_saved', seconds_saved)
+    return seconds_saved
+
+
+def find_route_visits(summit_index: SummitIndex,
+                      routes: RouteStore,
+                      activity_ids: np.array,
+                      activity_dates: pd.DatetimeIndex,
+                      exact: bool = False) -> pd.DataFrame:
+    """
+    Search every route of a RouteStore for summit visits, as described in calculate_visits_batch.
+
+    :param summit_index: SummitIndex to query
+    :param routes: RouteStore of the routes to search
+    :param activity_ids: activity id of each route
+    :param activity_dates: activity date of each route
+    :param exact: if True, visits are found by exact distance to the route segments rather than by sampling points
+    :return: pd.DataFrame of visits, with one row per (activity, visited summit) pair
+    """
+    if exact:
+        return find_segment_visits(summit_index=summit_index,
+                                   routes=routes,
+                                   activity_ids=activity_ids,
+                                   activity_dates=activity_dates)
+
+    routes = densify_routes(routes, spacing=SAMPLING_DISTANCE)
+    return find_batch_visits(summit_index=summit_index,
+                             latitude=routes.latitude,
+                             longitude=routes.longitude,
+                             route_lengths=routes.lengths,
+                             activity_ids=activity_ids,
+                             activity_dates=activity_dates,
+                             spacing=SAMPLING_DISTANCE)
+
+
+def find_segment_visits(summit_index: SummitIndex,
+                        routes: RouteStore,
+                        activity_ids: np.array,
+                        activity_dates: pd.DatetimeIndex,
+                        distance_proximity: float = DISTANCE_PROXIMITY) -> pd.DataFrame:
+    """
+    Find every summit within distance_proximity of any segment of any route, in a single spatial query.
+
+    :param summit_index: SummitIndex to query
+    :param routes: RouteStore of the routes to search
+    :param activity_ids: activity id of each route
+    :param activity_dates: activity date of each route
+    :param distance_proximity: maximum approach distance in metres required to qualify a visit to a summit
+    :return: pd.DataFrame of visits, with one row per (activity, visited summit) pair
+    """
+    starts, ends, route_index = routes.segments()
+    segment_indices, summit_indices, _ = summit_index.query_segments(
+        segment_starts=CoordinateSet(latitude=routes.latitude[starts], longitude=routes.longitude[starts]),
+        segment_ends=CoordinateSet(latitude=routes.latitude[ends], longitude=routes.longitude[ends]),
+        distance=distance_proximity)
+    return _visits_from_hits(summit_index=summit_index,
+                             route_indices=route_index[segment_indices],
+                             summit_indices=summit_indices,
+                             activity_ids=activity_ids,
+                             activity_dates=activity_dates)
+
+
+def sampling_radius(distance_proximity: float, spacing: float) -> float:
+    """
+    Radius around each point of a route, with consecutive points at most spacing metres apart, holding every summit
+    within distance_proximity of the segments either side of the point. The nearest point of a segment to a summit is
+    at most spacing / 2 metres from one of its ends, so the radius is the hypotenuse, with a small margin for the
+    difference between great circle and projected distances.
+    """
+    return 1.01 * float(np.hypot(distance_proximity, spacing / 2))
+
+
+def find_batch_visits(summit_index: SummitIndex,
+                      latitude: np.array,
+                      longitude: np.array,
+                      route_lengths: np.array,
+                      activity_ids: np.array,
+                      activity_dates: pd.DatetimeIndex,
+                      spacing: float = SAMPLING_DISTANCE,
+                      distance_proximity: float = DISTANCE_PROXIMITY) -> pd.DataFrame:
+    """
+    Search a flat coordinate array holding many concatenated routes for summit visits in a single spatial query.
+    Every summit within sampling_radius of a point is a candidate, and is visited if it lies within distance_proximity
+    of the segment before or after the point, so the visits are those of find_segment_visits.
+
+    :param summit_index: SummitIndex to query
+    :param latitude: concatenated latitude coordinates of all routes
+    :param longitude: concatenated longitude coordinates of all routes
+    :param route_lengths: number of coordinates belonging to each route, in order
+    :param activity_ids: activity id of each route
+    :param activity_dates: activity date of each route
+    :param spacing: maximum distance in metres between consecutive coordinates of a route, e.g. as densified by
+    densify_routes
+    :param distance_proximity: maximum approach distance in metres required to qualify a visit to a summit
+    :return: pd.DataFrame of visits, with one row per (activity, visited summit) pair
+    """
+    route_index = np.repeat(np.arange(len(route_lengths)), route_lengths)
+    points = CoordinateSet(latitude=latitude, longitude=longitude)
+    # Zero length segments return every summit within the radius of each point, rather than only the nearest.
+    point_indices, summit_indices, _ = summit_index.query_segments(segment_starts=points,
+                                                                   segment_ends=points,
+                                                                   distance=sampling_radius(distance_proximity,
+                                                                                            spacing))
+
+    # The first and last points of a route have a single neighbour, and a single point route none.
+    previous = np.maximum(point_indices - 1, 0)
+    previous = np.where(route_index[previous] == route_index[point_indices], previous, point_indices)
+    following = np.minimum(point_indices + 1, len(latitude) - 1)
+    following = np.where(route_index[following] == route_index[point_indices], following, point_indices)
+    summit_latitude = np.asarray(summit_index.coordinates.latitude)[summit_indices]
+    summit_longitude = np.asarray(summit_index.coordinates.longitude)[summit_indices]
+    distances = np.minimum(
+        segment_distances(latitude[previous], longitude[previous], latitude[point_indices],
+                          longitude[point_indices], summit_latitude, summit_longitude),
+        segment_distances(latitude[point_indices], longitude[point_indices], latitude[following],
+                          longitude[following], summit_latitude, summit_longitude))
+
+    within = distances < distance_proximity
+    return _visits_from_hits(summit_index=summit_index,
+                             route_indices=route_index[point_indices[within]],
+                             summit_indices=summit_indices[within],
+                             activity_ids=activity_ids,
+                             activity_dates=activity_dates)
+
+
+def _visits_from_hits(summit_index: SummitIndex,
+                      route_indices: np.array,
+                      summit_indices: np.array,
+                      activity_ids: np.array,
+                      activity_dates: pd.DatetimeIndex) -> pd.DataFrame:
+    # Reduce the (route, summit) hits to unique pairs, one visit per summit per activity.
+    visit_keys = np.unique(route_indices * len(summit_index.numbers) + summit_indices)
+    visit_routes, visit_summits = np.divmod(visit_keys, len(summit_index.numbers))
+
+    return pd.DataFrame({
+        'activity': activity_ids[visit_routes],
+        'date': activity_dates[visit_routes],
+        'visited_summits': summit_index.numbers[visit_summits]
+    })
+
+
+def summarise_visits(visits: pd.DataFrame, reference_source: SummitReference) -> pd.DataFrame:
+    """
+    Merge the first visit date, latest visit date and number of visits of each summit onto the summit reference
+    dataset.
 
-    latest_visit = visits.groupby('visited_summits')['date'].max().dt.date
-    latest_visit.name = 'latest_visit'
-    summit_dataset = reference_source.load().merge(latest_visit, left_on='Number', right_index=True, how='left')
+    :param visits: pd.DataFrame of visits, with activity, date and visited_summits columns
+    :param reference_source: SummitReference datasource defining the summits
+    :return: pd.DataFrame of the summit reference, with first_visit, latest_visit and visit_count columns
+    """
+    aggregates = VisitTimeline.from_visits(visits).aggregates()
+    summit_dataset = reference_source.load().merge(aggregates, left_on='Number', right_index=True, how='left')
+    summit_dataset['visit_count'] = summit_dataset['visit_count'].fillna(0).astype('int64')
     return summit_dataset
@@ -1,35 +1,87 @@
+from dataclasses import dataclass
+from typing import List, Union
+
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.graph_objs import Layout
 import numpy as np
 
+from src.summits.compact import CLASSIFICATIONS, classification_flags
 from src.visualisation.classification_mappings import summit_visualisation_config as summit_config
 
 
-def count_visits(df: pd.DataFrame, classification: str):
-    visited = len(df.loc[(df['latest_visit'].notnull()) & (df[classification] == 1)])
-    total = len(df.loc[df[classification] == 1])
-    return visited, total
-
-
-def compute_compleation_report(df: pd.DataFrame) -> pd.DataFrame:
-    visited_column = []
-    total_column = []
-    names = []
-    for classification, config in summit_config.items():
-        visited, total = count_visits(df, classification)
-        names.append(config.name)
-        visited_column.append(visited)
-        total_column.append(total)
-
-    return pd.DataFrame(index=names,
-                        data={'total': total_column,
-                              'visited': visited_column})
-
-
-def plot_compleation_report(df: pd.DataFrame):
-    df['visited'] = False
-    df.loc[df['latest_visit'].notnull(), 'visited'] = True
+@dataclass
+class CompletionSummary:
+    """
+    Visited and total summit counts for every classification, computed once and shared by the report table and chart.
+
+    classifications: pd.DataFrame indexed by classification name, with total and visited columns
+    by_year: pd.DataFrame indexed by year, with a column per classification name counting the summits whose latest
+    visit fell in that year. Each visited summit is counted once, in the year of its latest visit, so a summit visited
+    in 2019 and 2021 is counted in 2021 only and the columns sum to the visited counts. This is not the number of
+    summits visited in each year, which needs the individual visits rather than the summit history.
+    by_region: pd.DataFrame indexed by region and classification name, with total and visited columns. None if the
+    summit reference has no Region column.
+    first_visits_by_year: pd.DataFrame as by_year, counting each visited summit once, in the year of its first visit.
+    None if the summits have no first_visit column.
+    """
+    classifications: pd.DataFrame
+    by_year: pd.DataFrame
+    by_region: Union[pd.DataFrame, None] = None
+    first_visits_by_year: Union[pd.DataFrame, None] = None
+
+
+def summarise_completion(df: pd.DataFrame) -> CompletionSummary:
+    """
+    Count visited and total summits for every classification in a single pass over the classification flag matrix,
+    with breakdowns by year of latest visit and, if df has a Region column, by region. df is not modified.
+
+    :param df: summit reference pd.DataFrame with a latest_visit column, as returned by summarise_visits. Either
+    classification flag columns or a compact classes bitmask.
+    :return: CompletionSummary
+    """
+    names = [summit_config[classification].name for classification in CLASSIFICATIONS]
+    flags = classification_flags(df).astype('int64')
+    visited = df['latest_visit'].notnull().to_numpy()
+
+    classifications = pd.DataFrame(index=names,
+                                   data={'total': flags.sum(axis=0),
+                                         'visited': visited.astype('int64') @ flags})
+
+    by_year = _count_by_year(df['latest_visit'], flags, visited, names)
+    first_visits_by_year = None
+    if 'first_visit' in df.columns:
+        first_visits_by_year = _count_by_year(df['first_visit'], flags, visited, names)
+
+    by_region = None
+    if 'Region' in df.columns:
+        region_codes, regions = pd.factorize(df['Region'], sort=True)
+        region_totals = np.zeros((len(regions), len(names)), dtype='int64')
+        region_visited = np.zeros((len(regions), len(names)), dtype='int64')
+        # Summits without a region have code -1, and are only counted in the overall totals.
+        has_region = region_codes >= 0
+        np.add.at(region_totals, region_codes[has_region], flags[has_region])
+        np.add.at(region_visited, region_codes[has_region & visited], flags[has_region & visited])
+        by_region = pd.DataFrame(index=pd.MultiIndex.from_product([regions, names], names=['region', 'classification']),
+                                 data={'total': region_totals.ravel(), 'visited': region_visited.ravel()})
+
+    return CompletionSummary(classifications=classifications,
+                             by_year=by_year,
+                             by_region=by_region,
+                             first_visits_by_year=first_visits_by_year)
+
+
+def _count_by_year(dates: pd.Series, flags: np.array, visited: np.array, names: List[str]) -> pd.DataFrame:
+    years = pd.to_datetime(dates.loc[visited]).dt.year.to_numpy()
+    year_values, year_codes = np.unique(years, return_inverse=True)
+    counts = np.zeros((len(year_values), len(names)), dtype='int64')
+    np.add.at(counts, year_codes.ravel(), flags[visited])
+    return pd.DataFrame(counts, index=pd.Index(year_values, name='year'), columns=names)
+
+
+def plot_compleation_report(summary: Union[CompletionSummary, pd.DataFrame]):
+    if isinstance(summary, pd.DataFrame):
+        summary = summarise_completion(summary)
 
     layout = Layout(
         paper_bgcolor='rgba(0,0,0,0)',
@@ -38,8 +90,8 @@ def plot_compleation_report(df: pd.DataFrame):
 
     fig = go.Figure(layout=layout)
 
-    for classification, config in summit_config.items():
-        visited, total = count_visits(df, classification)
+    for config in summit_config.values():
+        total, visited = summary.classifications.loc[config.name, ['total', 'visited']]
         left_to_go = total - visited
 
         customdata = np.array([[config.name, visited, total]])
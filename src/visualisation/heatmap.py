@@ -0,0 +1,290 @@
+import json
+import os
+import shutil
+import struct
+import threading
+import uuid
+import zlib
+from dataclasses import dataclass
+from typing import Iterator, Protocol, Tuple, Union
+
+import numpy as np
+
+from src.strava.helpers import RouteStore
+
+TILE_SIZE = 256
+MIN_ZOOM = 0
+MAX_ZOOM = 13
+
+# Colour ramp from the lowest to the highest route density, as RGBA stops.
+COLOUR_STOPS = np.array([0., 0.35, 0.7, 1.])
+COLOUR_RAMP = np.array([[160, 0, 200, 110],
+                        [255, 40, 0, 170],
+                        [255, 160, 0, 220],
+                        [255, 255, 180, 255]])
+# Index 0 is transparent, and indices 1 to 255 sample the colour ramp.
+PALETTE = np.zeros((256, 4), dtype=np.uint8)
+PALETTE[1:] = np.stack([np.interp(np.linspace(0., 1., 255), COLOUR_STOPS, COLOUR_RAMP[:, channel])
+                        for channel in range(4)], axis=-1).round()
+
+
+@dataclass
+class DensityGrid:
+    """
+    Sparse count of the routes passing through each pixel of the web mercator pixel grid at one zoom level. Pixel keys
+    are sorted and ordered by tile, so the pixels of a tile are a contiguous range.
+    """
+    zoom: int
+    pixels: np.array
+    counts: np.array
+
+    def tiles(self) -> Iterator[Tuple[int, int, np.array]]:
+        """
+        Iterate over the non-empty tiles of the grid.
+
+        :return: iterator of tuples containing the tile x and y indices, and a (TILE_SIZE x TILE_SIZE) array of counts
+        """
+        tile_keys = self.pixels // TILE_SIZE ** 2
+        boundaries = np.flatnonzero(np.diff(tile_keys)) + 1
+        for start, end in zip(np.concatenate([[0], boundaries]), np.concatenate([boundaries, [len(tile_keys)]])):
+            counts = np.zeros(TILE_SIZE ** 2, dtype='int64')
+            counts[self.pixels[start:end] % TILE_SIZE ** 2] = self.counts[start:end]
+            tile_y, tile_x = divmod(int(tile_keys[start]), 2 ** self.zoom)
+            yield tile_x, tile_y, counts.reshape(TILE_SIZE, TILE_SIZE)
+
+
+class TileCache(Protocol):
+    def get(self, layer: str, zoom: int, x: int, y: int) -> Union[bytes, None]:
+        pass
+
+    def put(self, layer: str, zoom: int, x: int, y: int, tile: bytes):
+        pass
+
+    def athlete_layer(self, athlete_id: int, fingerprint: str) -> Union[str, None]:
+        pass
+
+    def publish(self, athlete_id: int, fingerprint: str, layer: str):
+        pass
+
+
+def new_layer_name() -> str:
+    """
+    Generate an unguessable tile layer name. Tile URLs are not authenticated, so the layer name is the only protection
+    of an athlete's route heatmap.
+    """
+    return uuid.uuid4().hex
+
+
+class LocalFileTileCache:
+    """
+    Stores rendered PNG tiles in a local directory, as {layer}/{zoom}/{x}/{y}.png. Each athlete has at most one
+    published layer, recorded with the fingerprint of the activities it was rendered from in athletes/{athlete}.json.
+    Publishing a new layer for an athlete deletes their previous layer, and the least recently published layers are
+    deleted once the published layers exceed max_bytes in total.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def get(self, layer: str, zoom: int, x: int, y: int) -> Union[bytes, None]:
+        filepath = self._filepath(layer, zoom, x, y)
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, 'rb') as f:
+            return f.read()
+
+    def put(self, layer: str, zoom: int, x: int, y: int, tile: bytes):
+        filepath = self._filepath(layer, zoom, x, y)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'wb') as f:
+            f.write(tile)
+
+    def athlete_layer(self, athlete_id: int, fingerprint: str) -> Union[str, None]:
+        """
+        Return the published layer of an athlete, if it was rendered from activities with the given fingerprint.
+        """
+        record = self._read_record(athlete_id)
+        if record is None or record['fingerprint'] != fingerprint:
+            return None
+        return record['layer']
+
+    def publish(self, athlete_id: int, fingerprint: str, layer: str):
+        """
+        Record a fully written layer as the athlete's layer, deleting their previous layer, then prune the least
+        recently published layers of other athletes to within max_bytes.
+        """
+        layer_directory = os.path.join(self.directory, os.path.basename(layer))
+        layer_bytes = sum(os.path.getsize(os.path.join(root, filename))
+                          for root, _, filenames in os.walk(layer_directory) for filename in filenames)
+        with self.lock:
+            previous = self._read_record(athlete_id)
+            os.makedirs(self._athletes_directory(), exist_ok=True)
+            temporary_filepath = f'{self._record_filepath(athlete_id)}.{uuid.uuid4().hex}.tmp'
+            with open(temporary_filepath, 'w') as f:
+                json.dump({'fingerprint': fingerprint, 'layer': layer, 'bytes': layer_bytes}, f)
+            os.replace(temporary_filepath, self._record_filepath(athlete_id))
+            if previous is not None and previous['layer'] != layer:
+                self._delete_layer(previous['layer'])
+            self._prune(athlete_id)
+
+    def _prune(self, athlete_id: int):
+        records = []
+        for filename in os.listdir(self._athletes_directory()):
+            if not filename.endswith('.json'):
+                continue
+            filepath = os.path.join(self._athletes_directory(), filename)
+            with open(filepath, 'r') as f:
+                records.append((os.path.getmtime(filepath), filepath, json.load(f)))
+        total_bytes = sum(record['bytes'] for _, _, record in records)
+        for _, filepath, record in sorted(records, key=lambda entry: entry[0]):
+            if total_bytes <= self.max_bytes:
+                break
+            if filepath == self._record_filepath(athlete_id):
+                continue
+            os.remove(filepath)
+            self._delete_layer(record['layer'])
+            total_bytes -= record['bytes']
+
+    def _delete_layer(self, layer: str):
+        shutil.rmtree(os.path.join(self.directory, os.path.basename(layer)), ignore_errors=True)
+
+    def _read_record(self, athlete_id: int) -> Union[dict, None]:
+        filepath = self._record_filepath(athlete_id)
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, 'r') as f:
+            return json.load(f)
+
+    def _athletes_directory(self) -> str:
+        return os.path.join(self.directory, 'athletes')
+
+    def _record_filepath(self, athlete_id: int) -> str:
+        return os.path.join(self._athletes_directory(), f'{int(athlete_id)}.json')
+
+    def _filepath(self, layer: str, zoom: int, x: int, y: int) -> str:
+        # Layer names are supplied in tile URLs, so guard against path traversal.
+        return os.path.join(self.directory, os.path.basename(layer), str(int(zoom)), str(int(x)), f'{int(y)}.png')
+
+
+def to_mercator(latitude: np.array, longitude: np.array) -> Tuple[np.array, np.array]:
+    """
+    Project latitude and longitude coordinates (decimal degrees) to web mercator coordinates normalised to [0, 1], with
+    y increasing southwards. Multiply by TILE_SIZE * 2 ** zoom for pixel coordinates at a zoom level.
+    """
+    lat = np.radians(np.clip(latitude, -85.0511, 85.0511))
+    x = (np.asarray(longitude, dtype=float) + 180.) / 360.
+    y = (1. - np.log(np.tan(lat) + 1. / np.cos(lat)) / np.pi) / 2.
+    return x, y
+
+
+def route_density(routes: RouteStore, zoom: int, chunk_segments: int = 100000) -> DensityGrid:
+    """
+    Rasterise routes into a DensityGrid at a zoom level. Each route segment is sampled at intervals of at most one
+    pixel, and the samples are binned into pixels with NumPy. Consecutive samples of a route in the same pixel are
+    counted once, so counts approximate the number of passes through each pixel. Segments are processed in chunks to
+    bound the memory used by the samples.
+
+    :param routes: RouteStore of the routes to rasterise
+    :param zoom: web mercator zoom level
+    :param chunk_segments: number of segments sampled at once
+    :return: DensityGrid
+    """
+    scale = TILE_SIZE * 2 ** zoom
+    x, y = to_mercator(routes.latitude, routes.longitude)
+    x, y = x * scale, y * scale
+    starts, ends, route_index = routes.segments()
+
+    pixels, counts = [], []
+    for chunk in range(0, len(starts), chunk_segments):
+        start, end = starts[chunk:chunk + chunk_segments], ends[chunk:chunk + chunk_segments]
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        samples = np.maximum(np.ceil(np.hypot(dx, dy)), 1).astype('int64')
+
+        sample_offsets = np.zeros(len(samples), dtype='int64')
+        np.cumsum(samples[:-1], out=sample_offsets[1:])
+        segment = np.repeat(np.arange(len(samples)), samples)
+        fraction = (np.arange(len(segment)) - sample_offsets[segment]) / samples[segment]
+        pixel_x = np.clip((x[start][segment] + fraction * dx[segment]).astype('int64'), 0, scale - 1)
+        pixel_y = np.clip((y[start][segment] + fraction * dy[segment]).astype('int64'), 0, scale - 1)
+
+        # Order pixels by tile, then by row and column within the tile.
+        tile_key = (pixel_y // TILE_SIZE) * 2 ** zoom + pixel_x // TILE_SIZE
+        pixel = tile_key * TILE_SIZE ** 2 + (pixel_y % TILE_SIZE) * TILE_SIZE + pixel_x % TILE_SIZE
+        route = route_index[chunk:chunk + chunk_segments][segment]
+        entered = np.ones(len(pixel), dtype=bool)
+        entered[1:] = (pixel[1:] != pixel[:-1]) | (route[1:] != route[:-1])
+
+        chunk_pixels, chunk_counts = np.unique(pixel[entered], return_counts=True)
+        pixels.append(chunk_pixels)
+        counts.append(chunk_counts)
+
+    if not pixels:
+        return DensityGrid(zoom=zoom, pixels=np.array([], dtype='int64'), counts=np.array([], dtype='int64'))
+    pixels, inverse = np.unique(np.concatenate(pixels), return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=np.concatenate(counts)).astype('int64')
+    return DensityGrid(zoom=zoom, pixels=pixels, counts=counts)
+
+
+def render_tile(counts: np.array, max_count: int) -> bytes:
+    """
+    Render a tile of route counts as a PNG heatmap. Counts are log scaled against max_count and quantised to the
+    levels of PALETTE; empty pixels are transparent.
+    """
+    levels = np.zeros(max(max_count, 1) + 1, dtype=np.uint8)
+    levels[1:] = 1 + np.round(254 * np.log1p(np.arange(1, len(levels))) / np.log1p(len(levels) - 1))
+    return encode_png(levels[np.minimum(counts, len(levels) - 1)], PALETTE)
+
+
+def encode_png(pixels: np.array, palette: np.array) -> bytes:
+    """
+    Encode an (height x width) uint8 array of palette indices as an indexed colour PNG image.
+
+    :param pixels: (height x width) uint8 array of indices into palette
+    :param palette: (256 x 4) uint8 array of RGBA colours
+    :return: PNG image bytes
+    """
+    height, width = pixels.shape
+    # Each scanline is preceded by its filter type, 0 (none).
+    scanlines = np.zeros((height, width + 1), dtype=np.uint8)
+    scanlines[:, 1:] = pixels
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+            + chunk(b'PLTE', palette[:, :3].tobytes())
+            + chunk(b'tRNS', palette[:, 3].tobytes())
+            + chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 1))
+            + chunk(b'IEND', b''))
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint8), PALETTE)
+
+
+def render_heatmap_tiles(routes: RouteStore,
+                         tile_cache: TileCache,
+                         layer: str,
+                         min_zoom: int = MIN_ZOOM,
+                         max_zoom: int = MAX_ZOOM) -> int:
+    """
+    Rasterise routes at every zoom level from min_zoom to max_zoom, and write the non-empty heatmap tiles to a
+    TileCache. Tiles beyond max_zoom are scaled up by the map from max_zoom, and absent tiles are empty.
+
+    :param routes: RouteStore of the routes to rasterise
+    :param tile_cache: TileCache the tiles are written to
+    :param layer: name of the tile layer, e.g. generated by new_layer_name
+    :param min_zoom: lowest zoom level rendered
+    :param max_zoom: highest zoom level rendered
+    :return: number of tiles written
+    """
+    tiles_written = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        grid = route_density(routes, zoom)
+        max_count = int(grid.counts.max()) if len(grid.counts) else 0
+        for x, y, counts in grid.tiles():
+            tile_cache.put(layer, zoom, x, y, render_tile(counts, max_count))
+            tiles_written += 1
+    return tiles_written
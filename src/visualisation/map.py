@@ -1,29 +1,35 @@
 import folium
+import numpy as np
 import pandas as pd
-from typing import List
+from typing import List, Union
 
-from src.strava.helpers import Activity
+from src.strava.helpers import Activity, Route, RouteStore
+from src.summits.compact import classification_indices
 from src.visualisation.classification_mappings import summit_visualisation_config as summit_config
+from src.visualisation.heatmap import MAX_ZOOM
 
 
 class SummitMap:
     def __init__(self):
         self.map = folium.Map(tiles="Stamen Terrain")
 
-    def add_polyine(self, polyline: pd.DataFrame):
+    def add_polyine(self, polyline: Route):
         if len(polyline):
-            folium.PolyLine(polyline, color="blue", weight=3.5, opacity=.5).add_to(self.map)
+            folium.PolyLine(polyline.coordinates, color="blue", weight=3.5, opacity=.5).add_to(self.map)
 
     def add_visited_summits(self, summits: pd.DataFrame, color: str):
         for idx, summit in summits.iterrows():
             last_visit = summit['latest_visit']
             height = summit['Metres']
             name = summit['Name']
+            popup = f'{name} ({height} m)<br>Last visited: {last_visit}'
+            if 'visit_count' in summit:
+                popup += f"<br>First visited: {summit['first_visit']}<br>Visits: {summit['visit_count']}"
 
             folium.CircleMarker(
                 radius=7.5,
                 location=(summit['Latitude'], summit['Longitude']),
-                popup=f'{name} ({height} m)<br>Last visited: {last_visit}',
+                popup=popup,
                 color='black',
                 opacity=0.5,
                 fill_color=color,
@@ -43,25 +49,211 @@ class SummitMap:
                 opacity=0.5
             ).add_to(self.map)
 
+    def add_routes(self, routes: RouteStore, tolerance: float):
+        """
+        Add every route to the map as a single MultiLineString GeoJSON layer, simplified with the Douglas-Peucker
+        algorithm. One layer is far cheaper to build and render than a PolyLine per route.
+
+        :param routes: RouteStore of the routes to draw
+        :param tolerance: simplification tolerance in decimal degrees of latitude
+        """
+        routes = simplify_routes(routes, tolerance)
+        coordinates = np.column_stack([routes.longitude, routes.latitude]).tolist()
+        lines = [coordinates[start:end] for start, end in zip(routes.offsets[:-1], routes.offsets[1:])
+                 if end - start > 1]
+        if not lines:
+            return
+        feature = {
+            'type': 'Feature',
+            'geometry': {'type': 'MultiLineString', 'coordinates': lines},
+            'properties': {},
+        }
+        folium.GeoJson(feature,
+                       style_function=lambda _: {'color': 'blue', 'weight': 3.5, 'opacity': .5}).add_to(self.map)
+
+    def add_heatmap_tiles(self, tiles_url: str, max_native_zoom: int = MAX_ZOOM):
+        """
+        Add a server-rendered route heatmap to the map as a tile layer, in place of the routes themselves.
+
+        :param tiles_url: tile URL template, containing {z}, {x} and {y} placeholders
+        :param max_native_zoom: highest zoom level tiles are rendered for. The map scales up tiles beyond it.
+        """
+        folium.TileLayer(tiles=tiles_url,
+                         attr='SummitMap',
+                         name='Routes',
+                         overlay=True,
+                         max_native_zoom=max_native_zoom,
+                         max_zoom=18).add_to(self.map)
+
+    def add_summit_layer(self, summits: pd.DataFrame, color: str, visited: bool):
+        """
+        Add summits to the map as a single GeoJSON layer of circle markers, styled as add_visited_summits and
+        add_unvisited_summits.
+        """
+        if not len(summits):
+            return
+        popups = summits['Name'].astype(str) + ' (' + summits['Metres'].astype(str) + ' m)'
+        if visited:
+            popups = popups + '<br>Last visited: ' + summits['latest_visit'].astype(str)
+            if 'visit_count' in summits.columns:
+                popups = (popups + '<br>First visited: ' + summits['first_visit'].astype(str)
+                          + '<br>Visits: ' + summits['visit_count'].astype(str))
+            style = {'color': 'black', 'opacity': 0.5, 'fillColor': color, 'fillOpacity': 1., 'radius': 7.5}
+        else:
+            style = {'color': color, 'opacity': 0.5, 'fillColor': color, 'fillOpacity': 0.3, 'radius': 7.5}
+
+        # Round coordinates to a tenth of a metre, so float32 coordinates are not written with spurious digits.
+        latitude = np.round(summits['Latitude'].to_numpy(dtype=float), 6)
+        longitude = np.round(summits['Longitude'].to_numpy(dtype=float), 6)
+        features = {
+            'type': 'FeatureCollection',
+            'features': [{'type': 'Feature',
+                          'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                          'properties': {'popup': popup}}
+                         for latitude, longitude, popup in zip(latitude.tolist(), longitude.tolist(),
+                                                               popups.tolist())],
+        }
+        folium.GeoJson(features,
+                       marker=folium.CircleMarker(radius=7.5),
+                       style_function=lambda _: style,
+                       popup=folium.GeoJsonPopup(fields=['popup'], labels=False)).add_to(self.map)
+
+
+def route_tolerance(zoom: int) -> float:
+    """
+    Simplification tolerance in decimal degrees equal to half a pixel at the given zoom level, so simplified routes
+    are indistinguishable from the originals at that zoom and below.
+    """
+    return 0.5 * 360. / (256 * 2 ** zoom)
+
+
+def simplify_routes(routes: RouteStore, tolerance: float) -> RouteStore:
+    """
+    Simplify every route with the Douglas-Peucker algorithm, removing points that lie within tolerance of the line
+    between the points retained either side of them. Longitude is scaled by the cosine of each route's mean latitude,
+    so tolerance is in decimal degrees of latitude in both directions.
+
+    Rather than recursing per route, the algorithm proceeds one level at a time over every unresolved interval of every
+    route at once, so the number of numpy passes grows with the recursion depth rather than the number of points.
+
+    :param routes: RouteStore of routes to simplify
+    :param tolerance: simplification tolerance in decimal degrees of latitude
+    :return: RouteStore of simplified routes
+    """
+    lengths = routes.lengths
+    scale = np.cos(np.radians(np.repeat(_route_means(routes.latitude, routes.offsets), lengths)))
+    x = routes.longitude * scale
+    y = routes.latitude
+
+    non_empty = lengths > 0
+    keep = np.zeros(len(x), dtype=bool)
+    keep[routes.offsets[:-1][non_empty]] = True
+    keep[routes.offsets[1:][non_empty] - 1] = True
+
+    starts = routes.offsets[:-1][lengths > 2]
+    ends = routes.offsets[1:][lengths > 2] - 1
+    while len(starts):
+        # Interior points of every interval, flattened, with the interval each belongs to.
+        counts = ends - starts - 1
+        interval = np.repeat(np.arange(len(starts)), counts)
+        first_interior = np.zeros(len(counts), dtype='int64')
+        np.cumsum(counts[:-1], out=first_interior[1:])
+        points = np.arange(len(interval)) - first_interior[interval] + starts[interval] + 1
+
+        start, end = starts[interval], ends[interval]
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        offset_x, offset_y = x[points] - x[start], y[points] - y[start]
+        length = np.hypot(dx, dy)
+        distances = np.where(length > 0,
+                             np.abs(dx * offset_y - dy * offset_x) / np.where(length > 0, length, 1.),
+                             np.hypot(offset_x, offset_y))
+
+        furthest = np.maximum.reduceat(distances, first_interior)
+        is_furthest = np.flatnonzero(distances == furthest[interval])
+        _, first = np.unique(interval[is_furthest], return_index=True)
+        splits = points[is_furthest[first]]
+
+        split = furthest > tolerance
+        keep[splits[split]] = True
+        starts, ends = np.concatenate([starts[split], splits[split]]), np.concatenate([splits[split], ends[split]])
+        unresolved = ends - starts > 1
+        starts, ends = starts[unresolved], ends[unresolved]
+
+    kept = np.zeros(len(keep) + 1, dtype='int64')
+    np.cumsum(keep, out=kept[1:])
+    return RouteStore(latitude=routes.latitude[keep], longitude=routes.longitude[keep], offsets=kept[routes.offsets])
+
+
+def _route_means(values: np.array, offsets: np.array) -> np.array:
+    total = np.zeros(len(values) + 1)
+    np.cumsum(values, out=total[1:])
+    return (total[offsets[1:]] - total[offsets[:-1]]) / np.maximum(np.diff(offsets), 1)
+
 
 def plot_activities(activities: List[Activity],
                     visited_summits: pd.DataFrame,
-                    unvisited_summits: pd.DataFrame):
+                    unvisited_summits: pd.DataFrame,
+                    geojson: bool = False,
+                    simplify_zoom: int = 14,
+                    heatmap_tiles: Union[str, None] = None):
+    """
+    Plot activity routes and summits on a folium map.
+
+    :param activities: activities whose routes are drawn
+    :param visited_summits: summits with a latest_visit
+    :param unvisited_summits: summits without a latest_visit
+    :param geojson: if True, routes are drawn as one simplified GeoJSON layer and summits as one GeoJSON layer per
+    classification and visit status, rather than one folium object per route and per summit
+    :param simplify_zoom: zoom level the GeoJSON route simplification tolerance is chosen for
+    :param heatmap_tiles: optional URL template of pre-rendered heatmap tiles. If provided, routes are drawn as a tile
+    layer rather than sent to the browser, and activities are not read.
+    :return: folium.Map
+    """
     map = SummitMap()
+    if heatmap_tiles is not None:
+        map.add_heatmap_tiles(heatmap_tiles)
+        activities = []
+    if geojson:
+        return _plot_geojson_layers(map, activities, visited_summits, unvisited_summits, simplify_zoom)
+
     for activity in activities:
         map.add_polyine(activity.route)
 
+    visited_indices = classification_indices(visited_summits)
+    unvisited_indices = classification_indices(unvisited_summits)
     for classification, config in summit_config.items():
-        visited_summits_of_classification = visited_summits.loc[visited_summits[classification] == 1]
+        visited_summits_of_classification = visited_summits.iloc[visited_indices[classification]]
         map.add_visited_summits(color=config.color,
                                 summits=visited_summits_of_classification)
 
-        unvisited_summits_of_classification = unvisited_summits.loc[unvisited_summits[classification] == 1]
+        unvisited_summits_of_classification = unvisited_summits.iloc[unvisited_indices[classification]]
         map.add_unvisited_summits(color=config.color,
                                   summits=unvisited_summits_of_classification)
 
     return map.map
 
 
+def _plot_geojson_layers(map: SummitMap,
+                         activities: List[Activity],
+                         visited_summits: pd.DataFrame,
+                         unvisited_summits: pd.DataFrame,
+                         simplify_zoom: int) -> folium.Map:
+    if activities:
+        map.add_routes(RouteStore.from_routes([activity.route for activity in activities]),
+                       tolerance=route_tolerance(simplify_zoom))
+
+    visited_indices = classification_indices(visited_summits)
+    unvisited_indices = classification_indices(unvisited_summits)
+    for classification, config in summit_config.items():
+        map.add_summit_layer(visited_summits.iloc[visited_indices[classification]],
+                             color=config.color,
+                             visited=True)
+        map.add_summit_layer(unvisited_summits.iloc[unvisited_indices[classification]],
+                             color=config.color,
+                             visited=False)
+
+    return map.map
+
+
 def generate_summit_map():
     pass
@@ -0,0 +1,102 @@
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.helpers import RouteStore, activities_from_json
+from src.summits.spatial_index import SummitIndex
+from src.summits.summits import PersistentLocalFileSummitReference
+from src.utils import CoordinateSet
+
+
+class FakeStravaClient:
+    """
+    Serves a fixed list of activities from the list activities endpoint, recording each request and the largest number
+    of requests in flight at once.
+    """
+
+    def __init__(self, activities: List[Dict], delay: float = 0.):
+        self.activities = activities
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def list_activities(self, athlete_id: int, page: int, per_page: int, after: int = None) -> List[Dict]:
+        with self.lock:
+            self.requests.append((page, after))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+
+        activities = sorted(self.activities, key=lambda activity: activity['start_date'])
+        if after is not None:
+            activities = [activity for activity in activities
+                          if pd.Timestamp(activity['start_date']).timestamp() > after]
+        return activities[(page - 1) * per_page:page * per_page]
+
+    def get_athlete_info(self, athlete_id: int) -> Dict:
+        return {'firstname': 'Test', 'lastname': 'Athlete'}
+
+
+@pytest.fixture(scope='session')
+def summit_reference(tmp_path_factory) -> PersistentLocalFileSummitReference:
+    """
+    Sparse synthetic summit reference, so that routes pass both near and far from summits.
+    """
+    filepath = tmp_path_factory.mktemp('reference') / 'database.pkl'
+    generate_summit_reference(300, seed=0).to_pickle(filepath)
+    return PersistentLocalFileSummitReference(str(filepath))
+
+
+@pytest.fixture(scope='session')
+def summit_index(summit_reference) -> SummitIndex:
+    return SummitIndex(summit_reference)
+
+
+@pytest.fixture(scope='session')
+def activities():
+    """
+    Random walks with long steps starting anywhere in the summit region, with repeated routes.
+    """
+    starts = generate_summit_reference(500, seed=1)
+    activities = generate_activities(300, starts, route_points=50, step=0.01, seed=2)
+    repeats = [dict(activity, id=len(activities) + number + 1) for number, activity in enumerate(activities[:50])]
+    return activities_from_json(activities + repeats)
+
+
+def assert_visits_equal(visits: pd.DataFrame, expected: pd.DataFrame):
+    """
+    Compare two visits pd.DataFrames, ignoring row order and the resolution of the visit dates.
+    """
+    keys = ['activity', 'visited_summits']
+    visits, expected = (df.astype({'date': 'datetime64[ns, UTC]'}) for df in (visits, expected))
+    pd.testing.assert_frame_equal(visits.sort_values(keys).reset_index(drop=True),
+                                  expected.sort_values(keys).reset_index(drop=True))
+
+
+def random_coordinates(n: int, seed: int, region=(56.5, 57.0, -4.5, -3.5)) -> CoordinateSet:
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, lng_min, lng_max = region
+    return CoordinateSet(latitude=rng.uniform(lat_min, lat_max, n), longitude=rng.uniform(lng_min, lng_max, n))
+
+
+def random_routes(n_routes: int, seed: int, max_points: int = 30) -> RouteStore:
+    """
+    Random walks with short steps near 57N 4W, including empty routes.
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(0, max_points, n_routes)
+    offsets = np.zeros(n_routes + 1, dtype='int64')
+    np.cumsum(lengths, out=offsets[1:])
+    latitude = np.concatenate([57. + np.cumsum(rng.normal(0, 0.005, length)) for length in lengths])
+    longitude = np.concatenate([-4. + np.cumsum(rng.normal(0, 0.005, length)) for length in lengths])
+    return RouteStore(latitude=latitude, longitude=longitude, offsets=offsets)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.summits.compact import CompactSummitReference
+from src.visualisation.bar_chart import plot_compleation_report, summarise_completion
+from src.visualisation.classification_mappings import summit_visualisation_config as summit_config
+
+
+@pytest.fixture
+def summit_dataset(summit_reference) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = summit_reference.load()
+    visited = rng.random(len(df)) < 0.4
+    latest_visit = pd.to_datetime('2018-01-01') + pd.to_timedelta(rng.integers(0, 4 * 365, len(df)), unit='D')
+    df['latest_visit'] = pd.Series(latest_visit, index=df.index).where(visited)
+    df['first_visit'] = df['latest_visit'] - pd.to_timedelta(rng.integers(0, 2 * 365, len(df)), unit='D')
+    df['Region'] = np.where(df['Latitude'] > 57, 'North', 'South')
+    return df
+
+
+def test_summarise_completion_counts_every_classification(summit_dataset):
+    summary = summarise_completion(summit_dataset)
+    visited = summit_dataset['latest_visit'].notnull()
+
+    for classification, config in summit_config.items():
+        in_classification = summit_dataset[classification] == 1
+        assert summary.classifications.loc[config.name, 'total'] == in_classification.sum()
+        assert summary.classifications.loc[config.name, 'visited'] == (in_classification & visited).sum()
+
+        years = summit_dataset.loc[in_classification & visited, 'latest_visit'].dt.year.value_counts()
+        pd.testing.assert_series_equal(summary.by_year[config.name].loc[lambda counts: counts > 0],
+                                       years.sort_index(), check_names=False, check_index_type=False)
+        years = summit_dataset.loc[in_classification & visited, 'first_visit'].dt.year.value_counts()
+        assert summary.first_visits_by_year[config.name].loc[years.index].tolist() == years.tolist()
+
+        for region in ['North', 'South']:
+            in_region = in_classification & (summit_dataset['Region'] == region)
+            assert summary.by_region.loc[(region, config.name)].tolist() == [in_region.sum(),
+                                                                             (in_region & visited).sum()]
+
+    # Each visited summit is counted once, in the year of its latest visit.
+    pd.testing.assert_series_equal(summary.by_year.sum(), summary.classifications['visited'], check_names=False)
+
+
+def test_summarise_completion_of_compact_reference(summit_reference, summit_dataset):
+    compact = CompactSummitReference(summit_reference).load()
+    compact['latest_visit'] = summit_dataset['latest_visit'].to_numpy()
+    compact_summary = summarise_completion(compact)
+    summary = summarise_completion(summit_dataset)
+
+    pd.testing.assert_frame_equal(compact_summary.classifications, summary.classifications)
+    pd.testing.assert_frame_equal(compact_summary.by_year, summary.by_year)
+    assert compact_summary.by_region is None and compact_summary.first_visits_by_year is None
+
+
+def test_plot_compleation_report_does_not_modify_summits(summit_dataset):
+    columns = summit_dataset.columns.tolist()
+    summary = summarise_completion(summit_dataset)
+    fig = plot_compleation_report(summary)
+
+    assert summit_dataset.columns.tolist() == columns
+    assert [bar.y[0] for bar in fig.data[::2]] == summary.classifications['visited'].tolist()
+    assert [bar.y[0] for bar in fig.data[1::2]] == (summary.classifications['total']
+                                                    - summary.classifications['visited']).tolist()
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from src.summits.compact import (CLASSES_COLUMN, CLASSIFICATIONS, CompactSummitReference, classification_flags,
+                                 classification_indices, compact_summits)
+from src.visualisation.classification_mappings import summit_visualisation_config
+
+
+def test_compact_summits_keep_classifications(summit_reference):
+    df = summit_reference.load()
+    compact = compact_summits(df)
+
+    assert not set(CLASSIFICATIONS) & set(compact.columns)
+    assert compact[CLASSES_COLUMN].dtype == np.uint8
+    assert (compact['Latitude'].dtype, compact['Metres'].dtype, compact['Name'].dtype.name) == \
+        (np.float32, np.int16, 'category')
+    np.testing.assert_array_equal(classification_flags(compact), df[CLASSIFICATIONS].to_numpy() == 1)
+    np.testing.assert_allclose(compact['Latitude'], df['Latitude'], atol=1e-5)
+
+    indices = classification_indices(compact)
+    for classification in CLASSIFICATIONS:
+        np.testing.assert_array_equal(indices[classification], np.flatnonzero(df[classification] == 1))
+
+
+def test_compact_reference_loads_windows(summit_reference):
+    reference = CompactSummitReference(summit_reference)
+    assert reference.version == summit_reference.version
+
+    window = reference.load(latitude_window=(57., 58.), longitude_window=(-5., -4.))
+    expected = summit_reference.load(latitude_window=(57., 58.), longitude_window=(-5., -4.))
+    assert 0 < len(window) < len(reference.load())
+    assert sorted(window['Number']) == sorted(expected['Number'])
+
+
+def test_every_classification_is_visualised():
+    assert list(summit_visualisation_config) == CLASSIFICATIONS
+
+
+def test_compact_reference_does_not_import_visualisation():
+    code = ('import sys, src.summits.compact; '
+            'sys.exit(any(module.startswith("src.visualisation") for module in sys.modules))')
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, '-c', code], cwd=repository).returncode == 0
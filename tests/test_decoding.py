@@ -0,0 +1,62 @@
+import numpy as np
+import polyline
+import pytest
+
+from benchmarks.synthetic import generate_activities, generate_summit_reference
+from src.strava.decoding import decode_polyline, decode_polylines
+from src.strava.helpers import RouteStore
+
+EDGE_CASES = [
+    '',
+    polyline.encode([(0., 0.)]),
+    polyline.encode([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]),
+    polyline.encode([(-89.99999, -179.99999), (89.99999, 179.99999), (-89.99999, -179.99999)]),
+    polyline.encode([(57.1, -3.5)] * 10),
+    polyline.encode([(0.00001, -0.00001), (-0.00001, 0.00001)]),
+]
+
+
+def expected_coordinates(polyline_str: str, precision: int = 5) -> np.array:
+    return np.array(polyline.decode(polyline_str, precision)).reshape(-1, 2)
+
+
+@pytest.mark.parametrize('polyline_str', EDGE_CASES)
+def test_decode_polyline_matches_polyline_package(polyline_str):
+    latitude, longitude = decode_polyline(polyline_str)
+    expected = expected_coordinates(polyline_str)
+    np.testing.assert_allclose(latitude, expected[:, 0], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(longitude, expected[:, 1], rtol=0, atol=1e-9)
+
+
+def test_decode_polylines_matches_polyline_package():
+    activities = generate_activities(50, generate_summit_reference(100), route_points=100)
+    polyline_strs = EDGE_CASES + [activity['map']['summary_polyline'] for activity in activities] + EDGE_CASES
+    latitude, longitude, offsets = decode_polylines(polyline_strs)
+
+    assert len(offsets) == len(polyline_strs) + 1
+    for index, polyline_str in enumerate(polyline_strs):
+        expected = expected_coordinates(polyline_str)
+        np.testing.assert_allclose(latitude[offsets[index]:offsets[index + 1]], expected[:, 0], rtol=0, atol=1e-9)
+        np.testing.assert_allclose(longitude[offsets[index]:offsets[index + 1]], expected[:, 1], rtol=0, atol=1e-9)
+
+
+def test_decode_polylines_precision():
+    polyline_str = polyline.encode([(57.123456, -3.654321), (57.2, -3.7)], precision=6)
+    latitude, longitude = decode_polyline(polyline_str, precision=6)
+    expected = expected_coordinates(polyline_str, precision=6)
+    np.testing.assert_allclose(latitude, expected[:, 0], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(longitude, expected[:, 1], rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('polyline_strs', [[], [''], ['', '']])
+def test_decode_polylines_without_points(polyline_strs):
+    latitude, longitude, offsets = decode_polylines(polyline_strs)
+    assert len(latitude) == len(longitude) == 0
+    np.testing.assert_array_equal(offsets, np.zeros(len(polyline_strs) + 1))
+
+
+def test_route_store_from_polylines():
+    routes = RouteStore.from_polylines(EDGE_CASES)
+    assert len(routes) == len(EDGE_CASES)
+    for route, polyline_str in zip(routes, EDGE_CASES):
+        np.testing.assert_allclose(route.coordinates.reshape(-1, 2), expected_coordinates(polyline_str), atol=1e-9)
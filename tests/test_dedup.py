@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.strava.helpers import RouteStore
+from src.summits.dedup import METRES_PER_DEGREE, RouteDeduplicator
+from src.summits.store import LocalFileVisitStore
+from src.summits.visited import calculate_visits_batch, find_route_visits, load_visit_history, visit_history_version
+from tests.conftest import assert_visits_equal
+from tests.test_visited import search_every_route
+
+
+@pytest.mark.parametrize('exact', [False, True])
+def test_deduplication_does_not_change_visits(activities, summit_index, exact):
+    expected = search_every_route(activities, summit_index, exact)
+    visits = calculate_visits_batch(activities, summit_index, exact=exact, early_rejection=False)
+    assert_visits_equal(visits, expected)
+
+
+def test_shared_deduplicator_searches_repeated_routes_once(activities, summit_index):
+    searched = []
+
+    def search(routes, route_ids, route_dates):
+        searched.append(len(routes))
+        return find_route_visits(summit_index, routes, route_ids, route_dates)
+
+    def find_visits(batch):
+        return deduplicator.find_visits(search=search,
+                                        routes=RouteStore.from_routes([activity.route for activity in batch]),
+                                        activity_ids=np.array([activity.id for activity in batch], dtype='int64'),
+                                        activity_dates=pd.to_datetime([activity.date for activity in batch]))
+
+    deduplicator = RouteDeduplicator()
+    # The fixture repeats the routes of the first 50 activities at its end.
+    first, second = activities[:200], activities[200:]
+    visits = pd.concat([find_visits(first), find_visits(second)], ignore_index=True)
+
+    assert searched == [200, len(second) - 50]
+    assert_visits_equal(visits, search_every_route(activities, summit_index, exact=False))
+
+
+@pytest.mark.parametrize('latitude', [0., 57., 70.])
+@pytest.mark.parametrize('direction', ['east', 'north'])
+def test_near_duplicate_cells_are_square(latitude, direction):
+    # Single point routes, shifted in 10 m steps over 1 km, fall into 10 or 11 cells of 100 m in either direction.
+    distance = 100.
+    shifts = np.arange(0., 1000., 10.) / METRES_PER_DEGREE
+    route_latitude = np.full(len(shifts), latitude)
+    route_longitude = np.full(len(shifts), 10.)
+    if direction == 'east':
+        route_longitude += shifts / np.cos(np.radians(latitude))
+    else:
+        route_latitude += shifts
+    routes = RouteStore(latitude=route_latitude, longitude=route_longitude, offsets=np.arange(len(shifts) + 1))
+
+    keys = RouteDeduplicator(near_duplicate_distance=distance).route_keys(routes)
+    assert 10 <= len(set(keys)) <= 11
+
+
+def test_near_duplicate_matching_has_its_own_visit_history(tmp_path, summit_reference):
+    versions = {visit_history_version(summit_reference, exact=True),
+                visit_history_version(summit_reference, exact=True, near_duplicate_distance=100.),
+                visit_history_version(summit_reference, exact=True, near_duplicate_distance=200.)}
+    assert len(versions) == 3
+
+    visit_store = LocalFileVisitStore(str(tmp_path))
+    visit_store.save(1, load_visit_history(1, summit_reference, visit_store, exact=True))
+    history = load_visit_history(1, summit_reference, visit_store, exact=True, near_duplicate_distance=100.)
+    assert history.reference_version == visit_history_version(summit_reference, exact=True,
+                                                              near_duplicate_distance=100.)
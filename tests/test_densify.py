@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.strava.helpers import RouteStore, densify_routes
+from src.summits.locator import haversine_distance
+from src.summits.spatial_index import EARTH_RADIUS_METRES
+from src.summits.visited import DISTANCE_PROXIMITY, SAMPLING_DISTANCE, calculate_visits_batch, find_route_visits
+from tests.conftest import random_routes
+
+
+def test_densify_routes_bounds_spacing_and_retains_points():
+    routes = random_routes(100, seed=0)
+    spacing = 50.
+    densified = densify_routes(routes, spacing=spacing)
+
+    assert len(densified) == len(routes)
+    np.testing.assert_array_equal(densified.lengths > 0, routes.lengths > 0)
+    for route, densified_route in zip(routes, densified):
+        if not len(route):
+            continue
+        # Every original point is retained, in order.
+        retained = np.isin(densified_route.latitude, route.latitude) & np.isin(densified_route.longitude,
+                                                                               route.longitude)
+        np.testing.assert_array_equal(densified_route.latitude[retained], route.latitude)
+        gaps = haversine_distance(*np.radians([densified_route.longitude[:-1], densified_route.latitude[:-1],
+                                               densified_route.longitude[1:], densified_route.latitude[1:]]))
+        # Points are interpolated linearly in degrees, so are evenly spaced to within a small fraction of a metre.
+        assert gaps.max(initial=0) <= spacing * 1.0001
+
+
+def test_densify_routes_leaves_short_segments_untouched():
+    routes = random_routes(100, seed=1)
+    densified = densify_routes(routes, spacing=1e6)
+    np.testing.assert_array_equal(densified.latitude, routes.latitude)
+    np.testing.assert_array_equal(densified.offsets, routes.offsets)
+
+
+@pytest.mark.parametrize('offset, visited', [(DISTANCE_PROXIMITY - 1, True), (DISTANCE_PROXIMITY + 1, False)])
+def test_sampled_search_finds_summits_between_points(summit_index, offset, visited):
+    # A straight route passing offset metres west of a summit, with the summit midway between two points.
+    summit_latitude = summit_index.coordinates.latitude[0]
+    summit_longitude = summit_index.coordinates.longitude[0]
+    metres_per_degree = np.radians(EARTH_RADIUS_METRES)
+    longitude = summit_longitude - offset / (metres_per_degree * np.cos(np.radians(summit_latitude)))
+    latitude = summit_latitude + (np.array([-10.5, 10.5]) * SAMPLING_DISTANCE) / metres_per_degree
+    routes = RouteStore(latitude=latitude, longitude=np.full(2, longitude), offsets=np.array([0, 2]))
+
+    visits = find_route_visits(summit_index, routes, np.array([1]), pd.to_datetime(['2020-01-01']))
+    assert (summit_index.numbers[0] in visits['visited_summits'].values) == visited
+
+
+def test_sampled_search_matches_exact_search(activities, summit_index):
+    expected = calculate_visits_batch(activities, summit_index, exact=True)
+    visits = calculate_visits_batch(activities, summit_index)
+    assert len(expected)
+    pd.testing.assert_frame_equal(visits, expected)
@@ -0,0 +1,108 @@
+import datetime as dt
+from typing import Dict, List
+
+import pytest
+
+import src.strava.helpers
+from benchmarks.synthetic import generate_activities
+from src.strava.helpers import (LocalFileActivityCache, download_activity_pages, download_all_activities,
+                                request_activity_page, retry_delay)
+from tests.conftest import FakeStravaClient
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code: int, headers: Dict):
+        super().__init__(status_code)
+        self.response = type('Response', (), {'status_code': status_code, 'headers': headers})()
+
+
+class FailingStravaClient(FakeStravaClient):
+    """
+    Fails the first requests with the given errors, then serves activities.
+    """
+
+    def __init__(self, activities: List[Dict], errors: List[Exception]):
+        super().__init__(activities)
+        self.errors = errors
+
+    def list_activities(self, athlete_id: int, page: int, per_page: int, after: int = None) -> List[Dict]:
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().list_activities(athlete_id, page, per_page, after)
+
+
+@pytest.fixture(scope='module')
+def strava_activities(summit_reference) -> List[Dict]:
+    return generate_activities(450, summit_reference.load(), route_points=5)
+
+
+def start_order(activities: List[Dict]) -> List[int]:
+    return [activity['id'] for activity in sorted(activities, key=lambda activity: activity['start_date'])]
+
+
+@pytest.mark.parametrize('n_activities', [0, 1, 199, 200, 201, 450])
+@pytest.mark.parametrize('max_in_flight', [1, 3])
+def test_download_activity_pages_returns_every_activity_in_order(strava_activities, n_activities, max_in_flight):
+    activities = strava_activities[:n_activities]
+    client = FakeStravaClient(activities)
+    downloaded = download_activity_pages(client, athlete_id=1, per_page=200, max_in_flight=max_in_flight)
+    assert [activity['id'] for activity in downloaded] == start_order(activities)
+
+
+def test_download_activity_pages_bounds_requests_in_flight(strava_activities):
+    client = FakeStravaClient(strava_activities, delay=0.01)
+    downloaded = download_activity_pages(client, athlete_id=1, per_page=20, max_in_flight=4)
+    assert len(downloaded) == len(strava_activities)
+    assert client.max_in_flight == 4
+
+
+def test_download_all_activities_resumes_from_the_cache(tmp_path, strava_activities):
+    activity_cache = LocalFileActivityCache(str(tmp_path))
+    client = FakeStravaClient(strava_activities[:300])
+    assert len(download_all_activities(client, athlete_id=1, activity_cache=activity_cache)) == 300
+    assert all(after is None for _, after in client.requests)
+
+    new_activity = dict(strava_activities[300], start_date=dt.datetime(2030, 1, 1).isoformat() + 'Z')
+    client.activities.append(new_activity)
+    client.requests.clear()
+    activities = download_all_activities(client, athlete_id=1, activity_cache=activity_cache)
+
+    assert len(activities) == 301 and activities[-1].id == new_activity['id']
+    # Only activities started after the latest cached activity are requested.
+    latest_start = max(dt.datetime.fromisoformat(activity['start_date'][:-1]).replace(tzinfo=dt.timezone.utc)
+                       for activity in strava_activities[:300])
+    assert {after for _, after in client.requests} == {int(latest_start.timestamp())}
+    assert [page for page, _ in client.requests].count(1) == 1
+    assert len(activity_cache.load(1)) == 301
+
+
+def test_request_activity_page_retries_rate_limited_requests(monkeypatch, strava_activities):
+    delays = []
+    monkeypatch.setattr(src.strava.helpers.time, 'sleep', delays.append)
+    client = FailingStravaClient(strava_activities, errors=[HTTPError(429, {'Retry-After': '3'}), HTTPError(503, {})])
+    assert len(request_activity_page(client, athlete_id=1, page=1, per_page=200)) == 200
+    assert delays == [3., 2.]
+
+
+def test_request_activity_page_raises_client_errors(monkeypatch, strava_activities):
+    monkeypatch.setattr(src.strava.helpers.time, 'sleep', lambda delay: None)
+    client = FailingStravaClient(strava_activities, errors=[HTTPError(404, {})])
+    with pytest.raises(HTTPError):
+        request_activity_page(client, athlete_id=1, page=1, per_page=200)
+
+    client = FailingStravaClient(strava_activities, errors=[HTTPError(500, {})] * 3)
+    with pytest.raises(HTTPError):
+        request_activity_page(client, athlete_id=1, page=1, per_page=200, max_retries=2)
+
+
+def test_retry_delay():
+    assert retry_delay(ValueError(), attempt=0) is None
+    assert retry_delay(HTTPError(400, {}), attempt=0) is None
+    assert retry_delay(HTTPError(500, {}), attempt=2) == 4.
+    assert retry_delay(HTTPError(429, {'Retry-After': '10'}), attempt=0) == 10.
+    # The daily limit is used up, so there is no point retrying.
+    assert retry_delay(HTTPError(429, {'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '50,1000'}),
+                       attempt=0) is None
+    # The 15 minute limit is used up, so the request waits for the next 15 minute interval.
+    assert 0 < retry_delay(HTTPError(429, {'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '100,500'}),
+                           attempt=0) <= 900
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.instrumentation import metrics
+from src.strava.helpers import RouteStore, densify_routes
+from src.summits.spatial_index import OccupancyGrid, segment_distances
+from src.summits.visited import calculate_visits_batch, record_rejection_savings
+from src.utils import CoordinateSet
+from tests.conftest import random_coordinates, random_routes
+
+
+@pytest.fixture(scope='module')
+def reference_points() -> CoordinateSet:
+    return random_coordinates(200, seed=0)
+
+
+@pytest.fixture
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_route_store_take():
+    routes = random_routes(20, seed=2)
+    indices = np.array([3, 0, 0, 19, 7])
+    taken = routes.take(indices)
+    assert len(taken) == len(indices)
+    for route, index in zip(taken, indices):
+        np.testing.assert_array_equal(route.coordinates, routes[index].coordinates)
+
+
+@pytest.mark.parametrize('cell_size', [100., 1000., 5000.])
+def test_occupancy_grid_never_rejects_a_route_near_a_reference_point(reference_points, cell_size):
+    rng = np.random.default_rng(5)
+    lengths = rng.integers(0, 20, 500)
+    offsets = np.zeros(len(lengths) + 1, dtype='int64')
+    np.cumsum(lengths, out=offsets[1:])
+    starts = random_coordinates(len(lengths), seed=6, region=(56.3, 57.2, -4.8, -3.2))
+    # Long, straight steps, so that routes cross cells between their points.
+    latitude = np.repeat(starts.latitude, lengths) + np.concatenate(
+        [np.cumsum(rng.normal(0, 0.02, length)) for length in lengths] + [np.array([])])
+    longitude = np.repeat(starts.longitude, lengths) + np.concatenate(
+        [np.cumsum(rng.normal(0, 0.02, length)) for length in lengths] + [np.array([])])
+    routes = RouteStore(latitude=latitude, longitude=longitude, offsets=offsets)
+
+    distance = 100.
+    near = OccupancyGrid(reference_points, distance=distance, cell_size=cell_size).query_routes(
+        routes.latitude, routes.longitude, routes.offsets)
+
+    # A route is near a reference point if any of its segments passes within distance of it.
+    starts, ends, route_index = routes.segments()
+    segment_indices, reference_indices = np.meshgrid(np.arange(len(starts)), np.arange(reference_points.length))
+    segment_indices, reference_indices = segment_indices.ravel(), reference_indices.ravel()
+    distances = segment_distances(routes.latitude[starts][segment_indices], routes.longitude[starts][segment_indices],
+                                  routes.latitude[ends][segment_indices], routes.longitude[ends][segment_indices],
+                                  reference_points.latitude[reference_indices],
+                                  reference_points.longitude[reference_indices])
+    expected = np.zeros(len(routes), dtype=bool)
+    expected[route_index[segment_indices[distances < distance]]] = True
+
+    assert expected.any() and not near.all()
+    assert not (expected & ~near).any()
+    assert not near[lengths == 0].any()
+
+
+def test_occupancy_grid_without_reference_points():
+    grid = OccupancyGrid(CoordinateSet(latitude=np.array([]), longitude=np.array([])), distance=100.)
+    routes = densify_routes(RouteStore(latitude=np.array([57., 57.1]), longitude=np.array([-4., -4.1]),
+                                       offsets=np.array([0, 2])), spacing=100.)
+    assert not grid.query_routes(routes.latitude, routes.longitude, routes.offsets).any()
+
+
+@pytest.mark.parametrize('exact', [False, True])
+def test_early_rejection_does_not_change_visits(activities, summit_index, exact):
+    expected = calculate_visits_batch(activities, summit_index, exact=exact, early_rejection=False)
+    visits = calculate_visits_batch(activities, summit_index, exact=exact)
+    assert len(expected)
+    pd.testing.assert_frame_equal(visits, expected)
+
+
+def test_rejection_savings_use_the_rate_of_earlier_searches(reset_metrics):
+    assert record_rejection_savings(rejected_points=100, searched_points=0, search_seconds=0.01) == 0.
+
+    assert record_rejection_savings(rejected_points=100, searched_points=200, search_seconds=2.) == pytest.approx(1.)
+    # Every route of this batch was rejected, so nothing was searched to time.
+    assert record_rejection_savings(rejected_points=50, searched_points=0, search_seconds=0.) == pytest.approx(0.5)
+    assert record_rejection_savings(rejected_points=100, searched_points=200, search_seconds=6.) == pytest.approx(2.)
+
+    counters = metrics.snapshot()['counters']
+    assert counters['route_points_rejected'] == 350
+    assert counters['early_rejection_seconds_saved'] == pytest.approx(3.5)
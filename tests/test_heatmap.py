@@ -0,0 +1,40 @@
+import numpy as np
+
+from src.strava.helpers import RouteStore
+from src.visualisation.heatmap import LocalFileTileCache, new_layer_name, render_heatmap_tiles
+
+
+def render_layer(tile_cache: LocalFileTileCache, athlete_id: int, fingerprint: str) -> str:
+    routes = RouteStore(latitude=np.array([57., 57.1]), longitude=np.array([-4., -4.1]), offsets=np.array([0, 2]))
+    layer = new_layer_name()
+    render_heatmap_tiles(routes, tile_cache=tile_cache, layer=layer, max_zoom=6)
+    tile_cache.publish(athlete_id, fingerprint, layer)
+    return layer
+
+
+def test_publishing_a_layer_replaces_the_previous_layer(tmp_path):
+    tile_cache = LocalFileTileCache(str(tmp_path))
+    first = render_layer(tile_cache, athlete_id=1, fingerprint='a')
+    assert tile_cache.athlete_layer(1, 'a') == first
+    assert tile_cache.athlete_layer(1, 'b') is None
+    assert tile_cache.get(first, 0, 0, 0) is not None
+
+    second = render_layer(tile_cache, athlete_id=1, fingerprint='b')
+    assert tile_cache.athlete_layer(1, 'b') == second
+    assert tile_cache.get(first, 0, 0, 0) is None
+    assert not (tmp_path / first).exists()
+
+
+def test_least_recently_published_layers_are_pruned(tmp_path):
+    tile_cache = LocalFileTileCache(str(tmp_path), max_bytes=0)
+    first = render_layer(tile_cache, athlete_id=1, fingerprint='a')
+    second = render_layer(tile_cache, athlete_id=2, fingerprint='a')
+
+    # The layer just published is always kept.
+    assert tile_cache.athlete_layer(1, 'a') is None and not (tmp_path / first).exists()
+    assert tile_cache.athlete_layer(2, 'a') == second and tile_cache.get(second, 0, 0, 0) is not None
+
+
+def test_layer_names_are_unguessable():
+    assert len({new_layer_name() for _ in range(100)}) == 100
+    assert len(new_layer_name()) == 32
@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+
+import pytest
+
+from src.instrumentation import JsonFormatter, MetricsRegistry, instrumented, metrics, profile_if_slow, span
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_span_records_duration_items_and_errors():
+    with span('decode', items=3) as decode:
+        decode.items += 2
+    with pytest.raises(ValueError):
+        with span('decode'):
+            raise ValueError
+
+    metric = metrics.snapshot()['spans']['decode']
+    assert (metric['count'], metric['errors'], metric['items_total']) == (2, 1, 5)
+    assert metric['seconds_max'] <= metric['seconds_total']
+    assert metric['seconds_mean'] == metric['seconds_total'] / 2
+    assert metric['peak_rss_growth_bytes_max'] >= 0
+    assert decode.peak_rss_growth_bytes is not None
+
+
+def test_span_logs_structured_fields(caplog):
+    with caplog.at_level(logging.INFO, logger='src.instrumentation'):
+        with span('render_map', items=1, athlete_id=7):
+            pass
+    record = json.loads(JsonFormatter().format(caplog.records[-1]))
+    assert record['message'] == 'render_map'
+    assert (record['span'], record['items'], record['athlete_id']) == ('render_map', 1, 7)
+    assert 'peak_rss_growth_bytes' in record
+
+
+def test_instrumented_counts_items():
+    @instrumented('search', count_items=lambda values: len(values))
+    def search(values):
+        return sum(values)
+
+    assert search([1, 2, 3]) == 6
+    metric = metrics.snapshot()['spans']['search']
+    assert (metric['count'], metric['items_total']) == (1, 3)
+
+
+def test_counters_are_snapshots():
+    registry = MetricsRegistry()
+    registry.increment('report_cache_hits')
+    registry.increment('report_cache_hits', 2)
+    snapshot = registry.snapshot()
+    registry.increment('report_cache_hits')
+    assert snapshot['counters'] == {'report_cache_hits': 3}
+
+
+def test_profile_if_slow_only_keeps_slow_profiles(tmp_path):
+    directory = str(tmp_path / 'profiles')
+    with profile_if_slow('report', None):
+        pass
+    with profile_if_slow('report', directory, threshold_seconds=60.):
+        pass
+    assert not os.path.exists(directory)
+
+    with profile_if_slow('report', directory, threshold_seconds=0.):
+        pass
+    assert len(os.listdir(directory)) == 1
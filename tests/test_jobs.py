@@ -0,0 +1,129 @@
+import threading
+import time
+
+from src.jobs import COMPLETE, FAILED, RUNNING, Job, LocalFileResultStore, ReportJobQueue
+
+
+def wait_for(queue: ReportJobQueue, job_id: str):
+    queue.executor.shutdown(wait=True)
+    return queue.status(job_id)
+
+
+def test_job_status_is_shared_between_queues(tmp_path):
+    queue = ReportJobQueue(generate_report=lambda athlete_id: f'report {athlete_id}',
+                           result_store=LocalFileResultStore(str(tmp_path)))
+    job = queue.submit(1)
+    assert wait_for(queue, job.id).status == COMPLETE
+
+    # A queue in another process sharing the directory answers for the job.
+    other_queue = ReportJobQueue(generate_report=lambda athlete_id: '',
+                                 result_store=LocalFileResultStore(str(tmp_path)))
+    assert other_queue.status(job.id).status == COMPLETE
+    assert other_queue.result(job.id) == 'report 1'
+    assert other_queue.status('missing') is None
+
+
+def test_failed_job_records_error(tmp_path):
+    def fail(athlete_id: int) -> str:
+        raise ValueError('no activities')
+
+    queue = ReportJobQueue(generate_report=fail, result_store=LocalFileResultStore(str(tmp_path)))
+    job = wait_for(queue, queue.submit(1).id)
+    assert job.status == FAILED and job.error == 'no activities'
+    assert queue.result(job.id) is None
+
+
+def test_one_active_job_per_athlete(tmp_path):
+    release = threading.Event()
+
+    def generate_report(athlete_id: int) -> str:
+        release.wait()
+        return ''
+
+    queue = ReportJobQueue(generate_report=generate_report, result_store=LocalFileResultStore(str(tmp_path)))
+    # A queue in another process sharing the directory returns the same job.
+    other_queue = ReportJobQueue(generate_report=generate_report, result_store=LocalFileResultStore(str(tmp_path)))
+    first, second, third, other = queue.submit(1), queue.submit(1), other_queue.submit(1), queue.submit(2)
+    release.set()
+    assert first.id == second.id == third.id != other.id
+    assert wait_for(queue, first.id).status == COMPLETE
+    assert not other_queue.active_jobs
+
+    # Once the job has finished, a new report can be generated.
+    assert other_queue.submit(1).id != first.id
+
+
+def test_finished_jobs_expire(tmp_path):
+    store = LocalFileResultStore(str(tmp_path))
+    queue = ReportJobQueue(generate_report=lambda athlete_id: 'report', result_store=store, ttl_seconds=0.)
+    job = queue.submit(1)
+    wait_for(queue, job.id)
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == ['.html', '.json']
+
+    queue.expire()
+    assert queue.status(job.id) is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_jobs_left_unfinished_by_a_stopped_process_fail_and_expire(tmp_path):
+    store = LocalFileResultStore(str(tmp_path))
+    # A job claimed and started by a process that stopped two minutes ago.
+    stale = Job(id='stale', athlete_id=1, status=RUNNING, heartbeat_at=time.time() - 120.)
+    store.put_job(stale)
+    assert store.claim(stale) == stale.id
+
+    queue = ReportJobQueue(generate_report=lambda athlete_id: 'report', result_store=store, stale_seconds=60.,
+                           ttl_seconds=90.)
+    job = queue.status(stale.id)
+    assert job.status == FAILED and job.finished_at == stale.heartbeat_at
+
+    # The athlete's claim was released, so a new job runs.
+    new_job = queue.submit(1)
+    assert new_job.id != stale.id
+    assert wait_for(queue, new_job.id).status == COMPLETE
+
+    queue.expire()
+    assert queue.status(stale.id) is None
+    assert queue.status(new_job.id).status == COMPLETE
+
+
+def test_stale_claims_are_replaced_on_submit(tmp_path):
+    store = LocalFileResultStore(str(tmp_path))
+    stale = Job(id='stale', athlete_id=1, heartbeat_at=time.time() - 120.)
+    store.put_job(stale)
+    store.claim(stale)
+
+    queue = ReportJobQueue(generate_report=lambda athlete_id: 'report', result_store=store, stale_seconds=60.)
+    job = queue.submit(1)
+    assert job.id != stale.id
+    assert wait_for(queue, job.id).status == COMPLETE
+    assert store.get_job(stale.id).status == FAILED
+
+
+def test_heartbeat_keeps_running_jobs_fresh(tmp_path):
+    release = threading.Event()
+
+    def generate_report(athlete_id: int) -> str:
+        release.wait()
+        return ''
+
+    store = LocalFileResultStore(str(tmp_path))
+    queue = ReportJobQueue(generate_report=generate_report, result_store=store, heartbeat_seconds=0.01,
+                           stale_seconds=0.2)
+    job = queue.submit(1)
+    time.sleep(0.5)
+    assert queue.status(job.id).status == RUNNING
+    release.set()
+    assert wait_for(queue, job.id).status == COMPLETE
+
+
+def test_expiry_is_rate_limited(tmp_path):
+    store = LocalFileResultStore(str(tmp_path))
+    listed = []
+    jobs = store.jobs
+    store.jobs = lambda: listed.append(1) or jobs()
+
+    queue = ReportJobQueue(generate_report=lambda athlete_id: '', result_store=store, expiry_seconds=60.)
+    queue.submit(1)
+    queue.submit(2)
+    assert len(listed) == 1
@@ -0,0 +1,88 @@
+import folium
+import numpy as np
+import pytest
+
+from src.summits.compact import classification_flags
+from src.summits.visited import calculate_summit_history_batch
+from src.visualisation.map import plot_activities, route_tolerance, simplify_routes
+from tests.conftest import random_routes
+
+
+def douglas_peucker(x: np.array, y: np.array, tolerance: float) -> np.array:
+    # Recursive reference implementation, returning the indices of the retained points.
+    if len(x) < 3:
+        return np.arange(len(x))
+    dx, dy = x[-1] - x[0], y[-1] - y[0]
+    length = np.hypot(dx, dy)
+    offset_x, offset_y = x[1:-1] - x[0], y[1:-1] - y[0]
+    distances = np.abs(dx * offset_y - dy * offset_x) / length if length > 0 else np.hypot(offset_x, offset_y)
+    furthest = int(np.argmax(distances)) + 1
+    if distances[furthest - 1] <= tolerance:
+        return np.array([0, len(x) - 1])
+    left = douglas_peucker(x[:furthest + 1], y[:furthest + 1], tolerance)
+    right = douglas_peucker(x[furthest:], y[furthest:], tolerance) + furthest
+    return np.concatenate([left, right[1:]])
+
+
+def test_simplify_routes_matches_recursive_douglas_peucker():
+    routes = random_routes(200, seed=1)
+    tolerance = 0.002
+    simplified = simplify_routes(routes, tolerance)
+
+    assert len(simplified) == len(routes)
+    for route, simplified_route in zip(routes, simplified):
+        x = route.longitude * np.cos(np.radians(route.latitude.mean())) if len(route) else route.longitude
+        kept = douglas_peucker(x, route.latitude, tolerance)
+        np.testing.assert_array_equal(simplified_route.latitude, route.latitude[kept])
+        np.testing.assert_array_equal(simplified_route.longitude, route.longitude[kept])
+
+
+def test_simplify_routes_keeps_route_ends():
+    routes = random_routes(100, seed=3)
+    simplified = simplify_routes(routes, tolerance=1.)
+    np.testing.assert_array_equal(simplified.lengths, np.minimum(routes.lengths, 2))
+
+
+def test_route_tolerance_is_half_a_pixel():
+    assert route_tolerance(0) == pytest.approx(180. / 256)
+    assert route_tolerance(14) == pytest.approx(route_tolerance(13) / 2)
+
+
+@pytest.fixture(scope='module')
+def summit_dataset(activities, summit_reference, summit_index):
+    return calculate_summit_history_batch(activities, summit_reference, summit_index)
+
+
+def layers(summit_map: folium.Map, layer_type: type) -> list:
+    return [child for child in summit_map._children.values() if isinstance(child, layer_type)]
+
+
+def test_geojson_layers_hold_every_route_and_summit(activities, summit_dataset):
+    visited = summit_dataset['latest_visit'].notnull()
+    visited_summits, unvisited_summits = summit_dataset.loc[visited], summit_dataset.loc[~visited]
+    summit_map = plot_activities(activities, visited_summits, unvisited_summits, geojson=True)
+
+    route_layer, *summit_layers = layers(summit_map, folium.GeoJson)
+    lines = route_layer.data['features'][0]['geometry']['coordinates']
+    assert len(lines) == sum(len(activity.route) > 1 for activity in activities)
+
+    # One layer per classification and visit status, holding one marker per summit of the classification.
+    expected = [count for visited_flags, unvisited_flags in
+                zip(classification_flags(visited_summits).sum(axis=0),
+                    classification_flags(unvisited_summits).sum(axis=0))
+                for count in (visited_flags, unvisited_flags) if count]
+    assert [len(layer.data['features']) for layer in summit_layers] == expected
+    assert 'Visits: ' in summit_layers[0].data['features'][0]['properties']['popup']
+
+
+def test_geojson_layers_match_markers(activities, summit_dataset):
+    visited = summit_dataset['latest_visit'].notnull()
+    visited_summits, unvisited_summits = summit_dataset.loc[visited], summit_dataset.loc[~visited]
+    markers = layers(plot_activities(activities[:10], visited_summits, unvisited_summits), folium.CircleMarker)
+    summit_layers = layers(plot_activities([], visited_summits, unvisited_summits, geojson=True), folium.GeoJson)
+
+    assert len(markers) == sum(len(layer.data['features']) for layer in summit_layers)
+    marker_locations = sorted(tuple(np.round(marker.location, 6)) for marker in markers)
+    layer_locations = sorted(tuple(np.round(feature['geometry']['coordinates'][::-1], 6))
+                             for layer in summit_layers for feature in layer.data['features'])
+    assert marker_locations == layer_locations
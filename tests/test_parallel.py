@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from src.summits.parallel import ParallelSummitSearch, SharedSummitReference
+from src.summits.spatial_index import SummitIndex
+from src.summits.visited import calculate_visits_batch
+from tests.conftest import assert_visits_equal
+
+
+def test_summit_index_shares_the_shared_reference_columns(summit_reference):
+    reference = SharedSummitReference.create(summit_reference)
+    try:
+        summit_index = SummitIndex(reference)
+        assert np.shares_memory(summit_index.numbers, reference.number)
+        assert np.shares_memory(summit_index.coordinates.latitude, reference.latitude)
+        assert np.shares_memory(summit_index.coordinates.longitude, reference.longitude)
+        np.testing.assert_array_equal(summit_index.numbers, summit_reference.load()['Number'])
+        del summit_index
+    finally:
+        reference.close()
+        reference.shared_memory.unlink()
+
+
+def test_parallel_search_matches_batch_search(summit_reference, summit_index, activities):
+    with ParallelSummitSearch(summit_reference, workers=2, chunk_points=2000) as summit_search:
+        for exact in (False, True):
+            expected = calculate_visits_batch(activities, summit_index, exact=exact)
+            visits = summit_search.calculate_visits(activities, exact=exact)
+            assert_visits_equal(visits, expected)
+            pd.testing.assert_frame_equal(visits, summit_search.calculate_visits(activities, exact=exact,
+                                                                                 early_rejection=False))
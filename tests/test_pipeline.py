@@ -0,0 +1,106 @@
+import datetime as dt
+import threading
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.pipeline
+from benchmarks.synthetic import generate_activities
+from src.pipeline import process_activity_pages, stream_summit_history
+from src.strava.helpers import LocalFileActivityCache, activities_from_json
+from src.summits.store import LocalFileVisitStore
+from src.summits.visited import calculate_summit_history_batch, calculate_visits_batch
+from tests.conftest import FakeStravaClient, assert_visits_equal
+
+
+@pytest.fixture(scope='module')
+def strava_activities(summit_reference) -> List[Dict]:
+    return generate_activities(450, summit_reference.load(), route_points=20)
+
+
+def test_stream_summit_history_matches_batch(tmp_path, strava_activities, summit_reference, summit_index):
+    client = FakeStravaClient(strava_activities)
+    activities, dataset = stream_summit_history(client=client,
+                                                athlete_id=1,
+                                                reference_source=summit_reference,
+                                                summit_index=summit_index,
+                                                visit_store=LocalFileVisitStore(str(tmp_path / 'visits')),
+                                                activity_cache=LocalFileActivityCache(str(tmp_path / 'activities')))
+
+    assert sorted(activity.id for activity in activities) == sorted(activity['id'] for activity in strava_activities)
+    expected = calculate_summit_history_batch(activities_from_json(strava_activities), summit_reference, summit_index)
+    pd.testing.assert_frame_equal(dataset, expected)
+
+
+def test_stream_summit_history_searches_cached_and_new_activities_once(tmp_path, strava_activities,
+                                                                       summit_reference, summit_index):
+    client = FakeStravaClient(strava_activities[:300])
+    pipeline = dict(client=client,
+                    athlete_id=1,
+                    reference_source=summit_reference,
+                    summit_index=summit_index,
+                    visit_store=LocalFileVisitStore(str(tmp_path / 'visits')),
+                    activity_cache=LocalFileActivityCache(str(tmp_path / 'activities')))
+    stream_summit_history(**pipeline)
+
+    new_activity = dict(strava_activities[300], start_date=dt.datetime(2030, 1, 1).isoformat() + 'Z')
+    client.activities.append(new_activity)
+    client.requests.clear()
+    activities, dataset = stream_summit_history(**pipeline)
+
+    assert len(activities) == 301
+    assert all(after is not None for _, after in client.requests)
+    assert len(pipeline['activity_cache'].load(1)) == 301
+    expected = calculate_summit_history_batch(activities_from_json(strava_activities[:300] + [new_activity]),
+                                              summit_reference, summit_index)
+    pd.testing.assert_frame_equal(dataset, expected)
+
+    # Activities brought up to date by the caller are searched without downloading.
+    client.requests.clear()
+    activities, _ = stream_summit_history(current_activities=pipeline['activity_cache'].load(1), **pipeline)
+    assert len(activities) == 301 and not client.requests
+
+
+def test_process_activity_pages_drops_repeated_activities(strava_activities, summit_index):
+    pages = [strava_activities[:200], strava_activities[150:350]]
+    activities, visits = process_activity_pages(pages, summit_index, processed_activities=np.array([], dtype='int64'))
+
+    assert [activity.id for activity in activities] == [activity['id'] for activity in strava_activities[:350]]
+    assert_visits_equal(visits, calculate_visits_batch(activities_from_json(strava_activities[:350]), summit_index))
+
+
+def test_process_activity_pages_skips_processed_activities(strava_activities, summit_index):
+    processed = np.array([activity['id'] for activity in strava_activities[:100]], dtype='int64')
+    activities, visits = process_activity_pages([strava_activities[:200]], summit_index, processed_activities=processed)
+    assert len(activities) == 200
+    assert_visits_equal(visits, calculate_visits_batch(activities_from_json(strava_activities[100:200]), summit_index))
+
+
+def test_process_activity_pages_takes_pages_as_workers_free_up(monkeypatch, strava_activities, summit_index):
+    release = threading.Event()
+    taken = []
+    process_activity_page = src.pipeline.process_activity_page
+
+    def blocking_process_activity_page(*args):
+        release.wait(timeout=10)
+        return process_activity_page(*args)
+
+    def pages():
+        for start in range(0, len(strava_activities), 50):
+            taken.append(start)
+            yield strava_activities[start:start + 50]
+
+    monkeypatch.setattr(src.pipeline, 'process_activity_page', blocking_process_activity_page)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        process_activity_pages(pages(), summit_index, processed_activities=np.array([], dtype='int64'), workers=2)))
+    thread.start()
+    thread.join(timeout=0.5)
+
+    # Two pages are being processed, and a third is waiting for a free worker.
+    assert len(taken) == 3
+    release.set()
+    thread.join()
+    assert len(result[0][0]) == len(strava_activities)
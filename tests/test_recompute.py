@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import polyline
+import pytest
+
+from src.strava.helpers import LocalFileActivityCache, activities_from_json
+from src.summits.recompute import diff_references, recompute_visit_history
+from src.summits.spatial_index import EARTH_RADIUS_METRES, SummitIndex
+from src.summits.store import LocalFileVisitStore
+from src.summits.summits import PersistentLocalFileSummitReference
+from src.summits.visited import calculate_visits_batch, update_summit_history
+
+LATITUDE = 57.
+# Decimal degrees of longitude per metre at LATITUDE.
+LONGITUDE_PER_METRE = np.degrees(1. / (EARTH_RADIUS_METRES * np.cos(np.radians(LATITUDE))))
+LATITUDE_PER_METRE = np.degrees(1. / EARTH_RADIUS_METRES)
+
+
+def write_reference(filepath, numbers, longitude_offsets) -> PersistentLocalFileSummitReference:
+    pd.DataFrame({'Number': numbers,
+                  'Name': [f'Summit {number}' for number in numbers],
+                  'Metres': 900,
+                  'Latitude': LATITUDE,
+                  'Longitude': -4. + np.asarray(longitude_offsets, dtype=float) * LONGITUDE_PER_METRE,
+                  }).to_pickle(filepath)
+    return PersistentLocalFileSummitReference(str(filepath))
+
+
+def north_south_activity(activity_id: int, longitude_offset: float) -> dict:
+    # A straight route passing longitude_offset metres east of the first summit.
+    longitude = -4. + longitude_offset * LONGITUDE_PER_METRE
+    route = [(LATITUDE - 500 * LATITUDE_PER_METRE, longitude), (LATITUDE + 500 * LATITUDE_PER_METRE, longitude)]
+    return {'id': activity_id,
+            'start_date': '2020-01-01T00:00:00Z',
+            'map': {'summary_polyline': polyline.encode(route)},
+            'distance': 1000.,
+            'moving_time': 300,
+            'elapsed_time': 300}
+
+
+@pytest.mark.parametrize('exact', [False, True])
+@pytest.mark.parametrize('numbers, longitude_offsets', [
+    # Summit 1 is removed.
+    ([2, 3], [150, 5000]),
+    # Summit 1 moves away from the route.
+    ([1, 2, 3], [3000, 150, 5000]),
+])
+def test_recompute_matches_full_recompute_when_the_nearest_summit_changes(tmp_path, exact, numbers,
+                                                                          longitude_offsets):
+    # Summits 1 and 2 are 150 m apart, and the route passes 60 m from summit 1 and 90 m from summit 2, so both are
+    # visited until summit 1 changes.
+    old_reference = write_reference(tmp_path / 'old.pkl', [1, 2, 3], [0, 150, 5000])
+    new_reference = write_reference(tmp_path / 'new.pkl', numbers, longitude_offsets)
+    activity_json = [north_south_activity(1, longitude_offset=60), north_south_activity(2, longitude_offset=20000)]
+    activities = activities_from_json(activity_json)
+
+    visit_store = LocalFileVisitStore(str(tmp_path / 'visits'))
+    activity_cache = LocalFileActivityCache(str(tmp_path / 'activities'))
+    activity_cache.save(1, activity_json)
+    update_summit_history(1, activities, old_reference, visit_store, SummitIndex(old_reference), exact=exact)
+    assert set(visit_store.load(1).visits['visited_summits']) == {1, 2}
+
+    new_index = SummitIndex(new_reference)
+    result = recompute_visit_history(athlete_id=1,
+                                     diff=diff_references(old_reference, new_reference),
+                                     summit_index=new_index,
+                                     visit_store=visit_store,
+                                     activity_cache=activity_cache)
+
+    expected = calculate_visits_batch(activities, new_index, exact=exact)
+    assert result == {'activities': 2, 'searched': 1, 'updated': 1}
+    assert sorted(visit_store.load(1).visits['visited_summits']) == sorted(expected['visited_summits']) == [2]
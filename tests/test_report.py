@@ -0,0 +1,42 @@
+import datetime as dt
+
+import pytest
+
+from benchmarks.synthetic import generate_activities
+from src.cache import ReportCache
+from src.strava.helpers import LocalFileActivityCache
+from src.report import SummitReportGenerator
+from src.summits.compact import CompactSummitReference
+from src.summits.store import LocalFileVisitStore
+from tests.conftest import FakeStravaClient
+
+
+@pytest.fixture
+def report_generator(tmp_path, summit_reference, summit_index):
+    activities = generate_activities(20, summit_reference.load(), route_points=20)
+    return SummitReportGenerator(client=FakeStravaClient(activities),
+                                 reference_source=CompactSummitReference(summit_reference),
+                                 summit_index=summit_index,
+                                 visit_store=LocalFileVisitStore(str(tmp_path / 'visits')),
+                                 activity_cache=LocalFileActivityCache(str(tmp_path / 'activities')),
+                                 report_cache=ReportCache(),
+                                 render_template=lambda name, **kwargs: name)
+
+
+def test_new_activities_are_downloaded_once(report_generator, summit_reference):
+    client = report_generator.client
+    report_generator.generate(athlete_id=1)
+    # Pages are requested concurrently, so each download requests page 1 once, and possibly later pages.
+    assert [page for page, _ in client.requests].count(1) == 1
+
+    # A returning athlete with a new activity is checked for new activities once, and the page is regenerated.
+    new_activity = generate_activities(1, summit_reference.load(), route_points=20, seed=1)[0]
+    new_activity.update(id=100, start_date=dt.datetime(2030, 1, 1).isoformat() + 'Z')
+    client.activities.append(new_activity)
+    client.requests.clear()
+    report_generator.generate(athlete_id=1)
+
+    assert [page for page, _ in client.requests].count(1) == 1
+    assert all(after is not None for _, after in client.requests)
+    assert len(report_generator.activity_cache.load(1)) == 21
+    assert 100 in report_generator.visit_store.load(1).processed_activities
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.strava.helpers import RouteStore, densify_routes
+from src.summits.spatial_index import BruteForceSpatialIndex, KDTreeSpatialIndex, segment_distances
+from src.summits.visited import DISTANCE_PROXIMITY, find_segment_visits
+from src.utils import CoordinateSet
+from tests.conftest import random_coordinates
+
+
+@pytest.fixture(scope='module')
+def reference_points() -> CoordinateSet:
+    return random_coordinates(200, seed=0)
+
+
+@pytest.mark.parametrize('distance', [100., 500., 2000.])
+def test_query_segments_matches_brute_force(reference_points, distance):
+    starts = random_coordinates(500, seed=2)
+    ends = CoordinateSet(latitude=starts.latitude + np.random.default_rng(3).normal(0, 0.01, 500),
+                         longitude=starts.longitude + np.random.default_rng(4).normal(0, 0.01, 500))
+    kd_tree = KDTreeSpatialIndex(reference_points).query_segments(starts, ends, distance)
+    brute_force = BruteForceSpatialIndex(reference_points).query_segments(starts, ends, distance)
+
+    def pairs(result):
+        order = np.lexsort((result[1], result[0]))
+        return result[0][order], result[1][order], result[2][order]
+
+    kd_tree, brute_force = pairs(kd_tree), pairs(brute_force)
+    assert len(brute_force[0])
+    np.testing.assert_array_equal(kd_tree[0], brute_force[0])
+    np.testing.assert_array_equal(kd_tree[1], brute_force[1])
+    np.testing.assert_allclose(kd_tree[2], brute_force[2])
+
+
+def test_segment_distances_match_densified_points():
+    starts = random_coordinates(200, seed=8)
+    rng = np.random.default_rng(9)
+    end_latitude = starts.latitude + rng.normal(0, 0.01, 200)
+    end_longitude = starts.longitude + rng.normal(0, 0.01, 200)
+    points = CoordinateSet(latitude=starts.latitude + rng.normal(0, 0.01, 200),
+                           longitude=starts.longitude + rng.normal(0, 0.01, 200))
+    distances = segment_distances(starts.latitude, starts.longitude, end_latitude, end_longitude,
+                                  points.latitude, points.longitude)
+
+    # The nearest of many points along each segment is at most half their spacing further away than the segment.
+    routes = densify_routes(RouteStore(latitude=np.column_stack([starts.latitude, end_latitude]).ravel(),
+                                       longitude=np.column_stack([starts.longitude, end_longitude]).ravel(),
+                                       offsets=np.arange(0, 401, 2)), spacing=1.)
+    for index, route in enumerate(routes):
+        nearest = segment_distances(route.latitude, route.longitude, route.latitude, route.longitude,
+                                    points.latitude[index], points.longitude[index]).min()
+        assert distances[index] - 1e-6 <= nearest <= distances[index] + 0.5
+
+
+def test_find_segment_visits_searches_single_point_routes(summit_index):
+    latitude, longitude = summit_index.coordinates.index(0)
+    routes = RouteStore(latitude=np.array([latitude, latitude + 0.1, latitude + 0.2]),
+                        longitude=np.array([longitude, longitude, longitude]),
+                        offsets=np.array([0, 1, 1, 3]))
+    visits = find_segment_visits(summit_index, routes, np.array([1, 2, 3]),
+                                 pd.to_datetime(['2020-01-01'] * 3), distance_proximity=DISTANCE_PROXIMITY)
+    assert summit_index.numbers[0] in visits.loc[visits['activity'] == 1, 'visited_summits'].values
+    assert not (visits['activity'] == 2).any()
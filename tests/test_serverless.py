@@ -0,0 +1,128 @@
+import threading
+from http.cookies import SimpleCookie
+
+import pytest
+
+import src.serverless as serverless
+
+
+class FakeAuthorisation:
+    def generate_authorisation_url(self, redirect_uri: str, scope: str) -> str:
+        return f'https://www.strava.com/oauth/authorize?redirect_uri={redirect_uri}'
+
+    def post_athlete_auth_code(self, code: str) -> int:
+        return 42
+
+
+class FakeClient:
+    authorisation = FakeAuthorisation()
+
+
+class FakeReportGenerator:
+    def __init__(self, release: threading.Event = None):
+        self.release = release
+        self.generated = []
+
+    def generate(self, athlete_id: int) -> str:
+        if self.release is not None:
+            self.release.wait()
+        self.generated.append(athlete_id)
+        return f'report {athlete_id}'
+
+
+class FakeContext:
+    def __init__(self, remaining_seconds: float):
+        self.remaining_seconds = remaining_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int(1000 * self.remaining_seconds)
+
+
+@pytest.fixture
+def report_generator(monkeypatch):
+    report_generator = FakeReportGenerator()
+    monkeypatch.setattr(serverless, '_client', FakeClient())
+    monkeypatch.setattr(serverless, '_report_generator', report_generator)
+    monkeypatch.setattr(serverless, 'render_template', lambda name, **context: f'{name} {context}')
+    monkeypatch.setattr(serverless, '_reports_in_progress', {})
+    return report_generator
+
+
+def event(version: str, query: dict = None, cookie: str = None) -> dict:
+    if version == '2.0':
+        return {'version': '2.0', 'rawPath': '/', 'queryStringParameters': query,
+                'cookies': [cookie] if cookie else None}
+    return {'path': '/', 'queryStringParameters': query, 'headers': {'Cookie': cookie} if cookie else {}}
+
+
+def response_cookies(response: dict) -> list:
+    return response.get('cookies') or response.get('multiValueHeaders', {}).get('Set-Cookie', [])
+
+
+def token_cookie(response: dict) -> str:
+    cookie = SimpleCookie()
+    cookie.load(response_cookies(response)[0])
+    return f'ott={cookie["ott"].value}'
+
+
+@pytest.mark.parametrize('version', ['1.0', '2.0'])
+def test_login_authorise_and_report(report_generator, version):
+    response = serverless.handler(event(version), None)
+    assert (response['statusCode'], response['body']) == (200, "login.html {'login': True}")
+
+    response = serverless.handler(event(version, {'authorise': 'true'}), None)
+    assert response['statusCode'] == 302
+    assert response['headers']['Location'].startswith('https://www.strava.com/oauth/authorize')
+
+    response = serverless.handler(event(version, {'code': 'code'}), None)
+    assert response['statusCode'] == 200
+    assert 'HttpOnly' in response_cookies(response)[0]
+    cookie = token_cookie(response)
+
+    response = serverless.handler(event(version, cookie=cookie), FakeContext(remaining_seconds=60.))
+    assert (response['statusCode'], response['body']) == (200, 'report 42')
+    assert response_cookies(response) == ['ott=; Max-Age=0']
+    assert report_generator.generated == [42]
+
+
+def test_tokens_are_verified_by_signature(report_generator, monkeypatch):
+    token = serverless.issue_token(42)
+    assert serverless.resolve_token(token) == 42
+
+    athlete_id, expires, signature = token.split('.')
+    for forged in [f'43.{expires}.{signature}', f'{athlete_id}.{int(expires) + 1}.{signature}', 'token', '', None]:
+        assert serverless.resolve_token(forged) is None
+    monkeypatch.setattr(serverless, '_token_secret', b'other secret')
+    assert serverless.resolve_token(token) is None
+
+    response = serverless.handler(event('2.0', cookie=f'ott=43.{expires}.{signature}'), None)
+    assert response['body'] == "login.html {'login': True}"
+    assert report_generator.generated == []
+
+
+def test_expired_tokens_are_rejected(report_generator, monkeypatch):
+    monkeypatch.setattr(serverless, 'TOKEN_TTL_SECONDS', -1)
+    assert serverless.resolve_token(serverless.issue_token(42)) is None
+
+
+def test_slow_report_returns_pending_page(report_generator, monkeypatch):
+    release = threading.Event()
+    report_generator.release = release
+    monkeypatch.setattr(serverless, 'REPORT_TIMEOUT_SECONDS', 0.05)
+    cookie = f'ott={serverless.issue_token(42)}'
+
+    response = serverless.handler(event('2.0', cookie=cookie), None)
+    assert (response['statusCode'], response['body']) == (200, serverless.PENDING_PAGE)
+    # The cookie is kept for the refresh.
+    assert 'cookies' not in response
+    # The wait is also bounded by the time left before the Lambda function times out.
+    response = serverless.handler(event('2.0', cookie=cookie), FakeContext(remaining_seconds=1.))
+    assert response['body'] == serverless.PENDING_PAGE
+
+    release.set()
+    monkeypatch.setattr(serverless, 'REPORT_TIMEOUT_SECONDS', 10.)
+    response = serverless.handler(event('2.0', cookie=cookie), None)
+    assert response['body'] == 'report 42'
+    # The refreshes waited for the report already being generated.
+    assert report_generator.generated == [42]
+    assert serverless._reports_in_progress == {}
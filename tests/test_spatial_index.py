@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from src.summits.locator import find_visited_summits
+from src.summits.spatial_index import BruteForceSpatialIndex, KDTreeSpatialIndex
+from src.utils import CoordinateSet
+from tests.conftest import random_coordinates
+
+
+@pytest.fixture(scope='module')
+def reference_points() -> CoordinateSet:
+    return random_coordinates(200, seed=0)
+
+
+@pytest.mark.parametrize('distance', [100., 500., 2000.])
+def test_query_radius_matches_brute_force(reference_points, distance):
+    coordinates = random_coordinates(2000, seed=1)
+    kd_tree = KDTreeSpatialIndex(reference_points).query_radius(coordinates, distance)
+    brute_force = BruteForceSpatialIndex(reference_points).query_radius(coordinates, distance)
+
+    np.testing.assert_array_equal(kd_tree[0], brute_force[0])
+    np.testing.assert_array_equal(kd_tree[1], brute_force[1])
+    np.testing.assert_allclose(kd_tree[2], brute_force[2], rtol=1e-6)
+
+
+@pytest.mark.parametrize('distance', [20., 100., 500.])
+def test_find_visited_summits_with_index_matches_dense_search(summit_reference, summit_index, distance):
+    # Points scattered around the summits, some within and some beyond each distance.
+    summits = summit_reference.load()
+    rng = np.random.default_rng(7)
+    nearby = rng.integers(0, len(summits), 3000)
+    trail = CoordinateSet(latitude=summits['Latitude'].to_numpy()[nearby] + rng.normal(0, 0.003, len(nearby)),
+                          longitude=summits['Longitude'].to_numpy()[nearby] + rng.normal(0, 0.005, len(nearby)))
+    expected = find_visited_summits(summit_reference, trail, distance_proximity=distance, search_window_width=1.)
+    visited = find_visited_summits(summit_reference, trail, distance_proximity=distance, summit_index=summit_index)
+    assert len(expected)
+    assert sorted(visited['Number']) == sorted(expected['Number'])
+
+
+def test_query_radius_without_points(reference_points):
+    empty = CoordinateSet(latitude=np.array([]), longitude=np.array([]))
+    for index in (KDTreeSpatialIndex(reference_points), BruteForceSpatialIndex(reference_points)):
+        assert all(len(result) == 0 for result in index.query_radius(empty, 100.))
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+import src.summits.visited
+from src.summits.store import LocalFileVisitStore, VisitHistory
+from src.summits.visited import calculate_summit_history_batch, update_summit_history
+
+
+def test_visit_store_round_trip(tmp_path):
+    visit_store = LocalFileVisitStore(str(tmp_path))
+    assert visit_store.load(1) is None and visit_store.athletes() == []
+
+    history = VisitHistory.empty(reference_version='v1')
+    visit_store.save(7, history)
+    visit_store.save(3, history)
+    assert visit_store.athletes() == [3, 7]
+    assert visit_store.load(7).reference_version == 'v1'
+
+
+def test_update_summit_history_only_searches_new_activities(tmp_path, monkeypatch, activities, summit_reference,
+                                                           summit_index):
+    expected = calculate_summit_history_batch(activities, summit_reference, summit_index)
+    searched = []
+    calculate_visits_batch = src.summits.visited.calculate_visits_batch
+
+    def counting_search(activities, *args, **kwargs):
+        searched.append([activity.id for activity in activities])
+        return calculate_visits_batch(activities, *args, **kwargs)
+
+    monkeypatch.setattr(src.summits.visited, 'calculate_visits_batch', counting_search)
+    visit_store = LocalFileVisitStore(str(tmp_path))
+
+    update_summit_history(1, activities[:-10], summit_reference, visit_store, summit_index)
+    dataset = update_summit_history(1, activities, summit_reference, visit_store, summit_index)
+    assert searched == [[activity.id for activity in activities[:-10]],
+                        [activity.id for activity in activities[-10:]]]
+    pd.testing.assert_frame_equal(dataset, expected)
+
+    # Nothing is searched when no activities are new.
+    pd.testing.assert_frame_equal(update_summit_history(1, activities, summit_reference, visit_store, summit_index),
+                                  expected)
+    assert len(searched) == 2
+
+
+def test_update_summit_history_drops_deleted_activities(tmp_path, activities, summit_reference, summit_index):
+    visit_store = LocalFileVisitStore(str(tmp_path))
+    update_summit_history(1, activities, summit_reference, visit_store, summit_index)
+    dataset = update_summit_history(1, activities[:100], summit_reference, visit_store, summit_index)
+
+    pd.testing.assert_frame_equal(dataset, calculate_summit_history_batch(activities[:100], summit_reference,
+                                                                          summit_index))
+    history = visit_store.load(1)
+    np.testing.assert_array_equal(history.processed_activities, [activity.id for activity in activities[:100]])
+    assert history.visits['activity'].isin(history.processed_activities).all()
+
+
+def test_update_summit_history_discards_other_reference_versions(tmp_path, activities, summit_reference,
+                                                                 summit_index):
+    visit_store = LocalFileVisitStore(str(tmp_path))
+    stale = VisitHistory(reference_version='stale',
+                         processed_activities=np.array([activity.id for activity in activities], dtype='int64'),
+                         visits=pd.DataFrame({'activity': [activities[0].id],
+                                              'date': pd.to_datetime(['2020-01-01'], utc=True),
+                                              'visited_summits': [-1]}))
+    visit_store.save(1, stale)
+
+    dataset = update_summit_history(1, activities, summit_reference, visit_store, summit_index)
+    pd.testing.assert_frame_equal(dataset, calculate_summit_history_batch(activities, summit_reference,
+                                                                          summit_index))
+    assert visit_store.load(1).reference_version == summit_reference.version
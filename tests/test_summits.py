@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.summits.locator import trim_search_area
+from src.summits.spatial_index import SummitIndex
+from src.summits.summits import MemoryMappedSummitReference, write_columnar_reference
+from src.summits.visited import calculate_visits_batch
+from src.utils import CoordinateSet
+from tests.conftest import assert_visits_equal
+
+
+def test_summit_index_shares_memory_mapped_columns(tmp_path, summit_reference, summit_index, activities):
+    write_columnar_reference(summit_reference.load().drop(columns='index'), str(tmp_path))
+    reference = MemoryMappedSummitReference(str(tmp_path))
+    memory_mapped_index = SummitIndex(reference)
+
+    for values, column in [(memory_mapped_index.numbers, 'Number'),
+                           (memory_mapped_index.coordinates.latitude, reference.latitude_column),
+                           (memory_mapped_index.coordinates.longitude, reference.longitude_column)]:
+        assert np.shares_memory(values, reference.columns[column])
+    assert_visits_equal(calculate_visits_batch(activities, memory_mapped_index),
+                        calculate_visits_batch(activities, summit_index))
+
+
+def test_visited_summits_in_order_of_first_appearance(summit_reference, summit_index):
+    summits = summit_reference.load()
+    visited = summit_index.visited_summits(np.array([5, 2, 5, 7, 2]))
+    pd.testing.assert_frame_equal(visited, summits.iloc[[5, 2, 7]][['Number', 'Latitude', 'Longitude']]
+                                  .reset_index(drop=True))
+
+
+@pytest.fixture(scope='module')
+def memory_mapped_reference(tmp_path_factory, summit_reference) -> MemoryMappedSummitReference:
+    directory = str(tmp_path_factory.mktemp('columns'))
+    write_columnar_reference(summit_reference.load().drop(columns='index'), directory)
+    return MemoryMappedSummitReference(directory)
+
+
+def in_original_order(summits: pd.DataFrame) -> pd.DataFrame:
+    # Memory-mapped rows are sorted by latitude.
+    return summits.sort_values('index').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('latitude_window, longitude_window', [
+    ((56.5, 57.5), (-5., -4.)),
+    ((56.5, 57.5), None),
+    (None, (-5., -4.)),
+    (None, None),
+    ((70., 71.), (-5., -4.)),
+])
+def test_memory_mapped_windows_match_the_pickle(summit_reference, memory_mapped_reference, latitude_window,
+                                                longitude_window):
+    expected = summit_reference.load(latitude_window=latitude_window, longitude_window=longitude_window)
+    window = memory_mapped_reference.load(latitude_window=latitude_window, longitude_window=longitude_window)
+    pd.testing.assert_frame_equal(in_original_order(window)[expected.columns], in_original_order(expected),
+                                  check_dtype=False)
+
+
+def test_trim_search_area_with_memory_mapped_reference(summit_reference, memory_mapped_reference):
+    trail = CoordinateSet(latitude=np.array([56.8, 57.1]), longitude=np.array([-4.6, -4.2]))
+    expected = trim_search_area(summit_reference, trail, search_window_width=0.1)
+    candidates = trim_search_area(memory_mapped_reference, trail, search_window_width=0.1)
+    assert len(expected)
+    assert sorted(candidates['Number']) == sorted(expected['Number'])
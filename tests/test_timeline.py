@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from src.summits.timeline import VisitTimeline
+from src.summits.visited import calculate_visits_batch
+
+
+def test_timeline_aggregates_match_groupby(activities, summit_index):
+    visits = calculate_visits_batch(activities, summit_index)
+    aggregates = VisitTimeline.from_visits(visits).aggregates()
+
+    dates = pd.to_datetime(visits['date'], utc=True).dt.date
+    expected = dates.groupby(visits['visited_summits']).agg(['min', 'max', 'count'])
+    assert len(aggregates) and aggregates.index.is_monotonic_increasing
+    np.testing.assert_array_equal(aggregates.index, expected.index)
+    assert aggregates['first_visit'].tolist() == expected['min'].tolist()
+    assert aggregates['latest_visit'].tolist() == expected['max'].tolist()
+    assert aggregates['visit_count'].tolist() == expected['count'].tolist()
+
+
+def test_timeline_orders_visits_by_summit_and_time():
+    timeline = VisitTimeline(summits=np.array([5, 2, 5, 2, 5]),
+                             activities=np.array([1, 2, 3, 4, 5]),
+                             timestamps=np.array([30, 20, 10, 40, 20]))
+
+    np.testing.assert_array_equal(timeline.summits, [2, 2, 5, 5, 5])
+    np.testing.assert_array_equal(timeline.activities, [2, 4, 3, 5, 1])
+    np.testing.assert_array_equal(timeline.visited_summits, [2, 5])
+    np.testing.assert_array_equal(timeline.first_visits, [20, 10])
+    np.testing.assert_array_equal(timeline.latest_visits, [40, 30])
+    np.testing.assert_array_equal(timeline.visit_counts, [2, 3])
+
+
+def test_empty_timeline():
+    visits = pd.DataFrame({'activity': np.array([], dtype='int64'),
+                           'date': pd.to_datetime([], utc=True),
+                           'visited_summits': np.array([], dtype='int64')})
+    timeline = VisitTimeline.from_visits(visits)
+    assert len(timeline) == 0 and timeline.aggregates().empty
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.strava.helpers import RouteStore
+from src.summits.visited import (calculate_summit_history_batch, calculate_visits_batch, find_route_visits,
+                                 summarise_visits)
+from tests.conftest import assert_visits_equal
+
+
+def search_every_route(activities, summit_index, exact: bool) -> pd.DataFrame:
+    return find_route_visits(summit_index=summit_index,
+                             routes=RouteStore.from_routes([activity.route for activity in activities]),
+                             activity_ids=np.array([activity.id for activity in activities], dtype='int64'),
+                             activity_dates=pd.to_datetime([activity.date for activity in activities]),
+                             exact=exact)
+
+
+@pytest.mark.parametrize('exact', [False, True])
+def test_batch_search_matches_searching_each_activity(activities, summit_index, exact):
+    activities = activities[:100]
+    expected = pd.concat([search_every_route([activity], summit_index, exact) for activity in activities],
+                         ignore_index=True)
+    visits = search_every_route(activities, summit_index, exact)
+    assert len(expected)
+    assert_visits_equal(visits, expected)
+
+
+def test_summarise_visits(summit_reference):
+    numbers = summit_reference.load()['Number'].to_numpy()
+    visits = pd.DataFrame({'activity': np.array([1, 2, 2, 3], dtype='int64'),
+                           'date': pd.to_datetime(['2020-01-01', '2021-06-01', '2021-06-01', '2019-03-01'], utc=True),
+                           'visited_summits': numbers[[0, 0, 1, 0]]})
+    dataset = summarise_visits(visits, summit_reference)
+
+    assert len(dataset) == len(numbers)
+    summit = dataset.loc[dataset['Number'] == numbers[0]].iloc[0]
+    assert (str(summit['first_visit']), str(summit['latest_visit']), summit['visit_count']) == \
+        ('2019-03-01', '2021-06-01', 3)
+    assert dataset.loc[dataset['Number'] == numbers[1], 'visit_count'].item() == 1
+    assert dataset['latest_visit'].notnull().sum() == 2
+    assert (dataset.loc[dataset['latest_visit'].isnull(), 'visit_count'] == 0).all()
+
+
+def test_calculate_summit_history_batch(activities, summit_reference, summit_index):
+    dataset = calculate_summit_history_batch(activities, summit_reference, summit_index)
+    visits = calculate_visits_batch(activities, summit_index)
+    visited = dataset.loc[dataset['latest_visit'].notnull()]
+    assert sorted(visited['Number']) == sorted(visits['visited_summits'].unique())
+    assert visited['visit_count'].sum() == len(visits)